@@ -0,0 +1,261 @@
+import numpy as np
+
+# Métricas das rotas de plot calculadas direto sobre os arrays colunares de fetch_trajectory_arrays
+# (identifier, category, timestamp, x, y por ponto). Não usa matplotlib nem TrajectoryCollection:
+# é o caminho de metrics_only=analytics, do resumo das imagens com summary=analytics (os dois usados
+# pela interface) e das métricas do renderizador native. O shapely só é importado pelas métricas de
+# linhas.
+# As chaves e as regras são próprias deste módulo, não as do resumo que as funções de plot da
+# smart_traject devolvem (ex.: mean_duration_seconds, total_points, trajectories_per_category em
+# summary_metrics); sem conferência de paridade com a biblioteca, o resumo "oficial" é o de
+# metrics_only=1, calculado pela própria biblioteca.
+
+
+def group_points(arrays):
+    # Ordena os pontos por (identificador, tempo) e devolve os arrays ordenados junto com
+    # o início e a quantidade de pontos de cada trajetória, como o agrupamento do TrajectoryCollection.
+    order = np.lexsort((arrays['timestamp'], arrays['identifier']))
+    points = {column: values[order] for column, values in arrays.items()}
+    identifiers = points['identifier']
+    if identifiers.size == 0:
+        return points, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, identifiers[1:] != identifiers[:-1]])
+    counts = np.diff(np.r_[starts, identifiers.size])
+
+    # Trajetórias com menos de 2 pontos são descartadas, como no TrajectoryCollection
+    keep = np.repeat(counts >= 2, counts)
+    if not keep.all():
+        points = {column: values[keep] for column, values in points.items()}
+        counts = counts[counts >= 2]
+        starts = np.cumsum(counts) - counts
+    return points, starts, counts
+
+
+def _per_trajectory_any(mask, starts):
+    # Verdadeiro para a trajetória se algum elemento do seu bloco for verdadeiro
+    if starts.size == 0:
+        return np.empty(0, dtype=bool)
+    return np.logical_or.reduceat(mask, starts)
+
+
+def _segments(points, starts, counts):
+    # Segmentos consecutivos de cada trajetória: índice do ponto inicial e trajetória a que pertence
+    first = np.zeros(points['x'].size, dtype=bool)
+    first[starts] = True
+    segment_start = np.flatnonzero(~np.r_[first[1:], True])
+    owner = np.repeat(np.arange(counts.size), counts - 1)
+    return segment_start, owner
+
+
+def _segment_lines(points, segment_start):
+    import shapely
+    coords = np.stack([
+        np.column_stack([points['x'][segment_start], points['y'][segment_start]]),
+        np.column_stack([points['x'][segment_start + 1], points['y'][segment_start + 1]])
+    ], axis=1)
+    return shapely.linestrings(coords)
+
+
+def _candidate_segments(points, segment_start, bounds):
+    # Segmentos cujo bbox cruza bounds (min_x, min_y, max_x, max_y): só comparações NumPy,
+    # sem criar geometrias. Montar os LineStrings é o custo dominante; com o filtro, o shapely
+    # só recebe os poucos segmentos perto da linha/área.
+    min_x, min_y, max_x, max_y = bounds
+    x0, x1 = points['x'][segment_start], points['x'][segment_start + 1]
+    y0, y1 = points['y'][segment_start], points['y'][segment_start + 1]
+    return np.flatnonzero((np.minimum(x0, x1) <= max_x) & (np.maximum(x0, x1) >= min_x)
+                          & (np.minimum(y0, y1) <= max_y) & (np.maximum(y0, y1) >= min_y))
+
+
+def _first_crossing_times(points, starts, counts, line):
+    # Instante do primeiro segmento de cada trajetória que cruza a linha (NaN se não cruza)
+    times = np.full(counts.size, np.nan)
+    if counts.size == 0:
+        return times
+    segment_start, owner = _segments(points, starts, counts)
+    import shapely
+    candidates = _candidate_segments(points, segment_start, line.bounds)
+    crosses = candidates[shapely.intersects(_segment_lines(points, segment_start[candidates]), line)]
+    # Segmentos já estão em ordem de tempo: o primeiro de cada trajetória é o de menor índice
+    crossing_owner, first = np.unique(owner[crosses], return_index=True)
+    times[crossing_owner] = points['timestamp'][segment_start[crosses[first]]]
+    return times
+
+
+def summary_metrics(arrays):
+    # Totais gerais: trajetórias, pontos e trajetórias por categoria.
+    points, starts, counts = group_points(arrays)
+    categories, per_category = np.unique(points['category'][starts], return_counts=True)
+    durations = points['timestamp'][starts + counts - 1] - points['timestamp'][starts]
+    return {
+        'total_trajectories': int(counts.size),
+        'total_points': int(counts.sum()),
+        'mean_duration_seconds': float(durations.mean()) if counts.size else 0.0,
+        'trajectories_per_category': {str(category): int(count)
+                                      for category, count in zip(categories.tolist(), per_category.tolist())}
+    }
+
+
+def category_metrics(arrays, category):
+    # Totais da categoria e comprimento médio percorrido (em pixels).
+    summary = summary_metrics(arrays)
+    points, starts, counts = group_points(arrays)
+    segment_start, owner = _segments(points, starts, counts)
+    steps = np.hypot(np.diff(points['x'])[segment_start], np.diff(points['y'])[segment_start])
+    lengths = np.bincount(owner, weights=steps, minlength=counts.size)
+    summary['category'] = category
+    summary['mean_length'] = float(lengths.mean()) if counts.size else 0.0
+    return summary
+
+
+def _total(counts, total_trajectories):
+    # Total de trajetórias da consulta: informado quando os pontos vieram de uma consulta pré-filtrada
+    return int(counts.size) if total_trajectories is None else int(total_trajectories)
+
+
+def reference_line_metrics(arrays, category, reference_line, total_trajectories=None):
+    # Quantas trajetórias cruzam a linha de referência.
+    points, starts, counts = group_points(arrays)
+    crossed = ~np.isnan(_first_crossing_times(points, starts, counts, reference_line))
+    total = _total(counts, total_trajectories)
+    return {
+        'category': category,
+        'total_trajectories': total,
+        'crossed_reference_line': int(crossed.sum()),
+        'not_crossed_reference_line': int(total - crossed.sum()),
+        'crossed_percentage': float(100 * crossed.sum() / total) if total else 0.0
+    }
+
+
+def start_finish_metrics(arrays, category, arrival_line, departure_line, total_trajectories=None):
+    # Cruzamentos das linhas de partida e chegada e tempo médio entre elas.
+    points, starts, counts = group_points(arrays)
+    departure = _first_crossing_times(points, starts, counts, departure_line)
+    arrival = _first_crossing_times(points, starts, counts, arrival_line)
+    # Percurso completo: cruzou a partida e, depois dela, a chegada
+    completed = ~np.isnan(departure) & ~np.isnan(arrival) & (arrival >= departure)
+    travel_times = arrival[completed] - departure[completed]
+    return {
+        'category': category,
+        'total_trajectories': _total(counts, total_trajectories),
+        'crossed_departure_line': int((~np.isnan(departure)).sum()),
+        'crossed_finish_line': int((~np.isnan(arrival)).sum()),
+        'completed_trajectories': int(completed.sum()),
+        'mean_travel_time_seconds': float(travel_times.mean()) if travel_times.size else 0.0
+    }
+
+
+def detect_stops(points, starts, counts, stop_threshold, min_duration, noise_tolerance):
+    # Paradas de todas as trajetórias de uma vez, sobre os arrays planos de group_points.
+    # Regras, fixadas pelos casos montados à mão de tests/test_analytics.py (o laço reference_stops
+    # de benchmarks/bench_stops.py segue as mesmas regras e só confere a versão vetorizada):
+    # - passo = dois pontos consecutivos da trajetória; é parado se o deslocamento em pixels
+    #   (distância euclidiana, sem reamostragem nem velocidade) for <= stop_threshold;
+    # - até noise_tolerance passos consecutivos em movimento entre dois passos parados não quebram
+    #   a sequência; com mais que isso ela termina no último passo parado;
+    # - a parada vai do primeiro ponto do primeiro passo parado ao último ponto do último passo
+    #   parado: passos em movimento no início e no fim ficam de fora, o ruído do meio entra;
+    # - fica a parada com fim - início >= min_duration segundos;
+    # - uma parada nunca junta duas trajetórias;
+    # - x e y são a média de todos os pontos da parada, inclusive os de ruído.
+    # Não é uma cópia da lógica de parada da smart_traject (o submódulo não vem no repositório e a
+    # equivalência com ela não foi conferida): /plot_with_stopped e /plot_with_stop_rec continuam
+    # usando a biblioteca na imagem e em metrics_only=1; esta função vale só para o resumo de
+    # metrics_only=analytics e summary=analytics, e fica fora dos agregados de app/rollups.py até a
+    # paridade ser conferida.
+    # Retorna arrays por parada: trajetória, início, fim, x médio e y médio.
+    empty = {'trajectory': np.empty(0, dtype=np.int64), 'start': np.empty(0), 'end': np.empty(0),
+             'x': np.empty(0), 'y': np.empty(0)}
+    if counts.size == 0:
+        return empty
+    segment_start, owner = _segments(points, starts, counts)
+    x, y, t = points['x'], points['y'], points['timestamp']
+    still = np.flatnonzero(np.hypot(x[segment_start + 1] - x[segment_start],
+                                    y[segment_start + 1] - y[segment_start]) <= stop_threshold)
+    if still.size == 0:
+        return empty
+
+    # Run-length: um passo parado abre nova sequência se vier de outra trajetória ou se houver
+    # mais de noise_tolerance passos em movimento desde o passo parado anterior
+    new_run = np.ones(still.size, dtype=bool)
+    new_run[1:] = (owner[still[1:]] != owner[still[:-1]]) | (np.diff(still) - 1 > noise_tolerance)
+    run_first = still[new_run]
+    run_last = still[np.r_[new_run[1:], True]]
+
+    first_point = segment_start[run_first]
+    last_point = segment_start[run_last] + 1
+    keep = t[last_point] - t[first_point] >= min_duration
+    first_point, last_point = first_point[keep], last_point[keep]
+
+    # Posição média dos pontos da parada por somas acumuladas
+    cum_x = np.r_[0.0, np.cumsum(x)]
+    cum_y = np.r_[0.0, np.cumsum(y)]
+    n = last_point - first_point + 1
+    return {
+        'trajectory': owner[run_first[keep]],
+        'start': t[first_point],
+        'end': t[last_point],
+        'x': (cum_x[last_point + 1] - cum_x[first_point]) / n,
+        'y': (cum_y[last_point + 1] - cum_y[first_point]) / n
+    }
+
+
+def _select_stops(stops, mask):
+    return {key: values[mask] for key, values in stops.items()}
+
+
+def _stop_summary(stops, total, category):
+    durations = stops['end'] - stops['start']
+    return {
+        'category': category,
+        'total_trajectories': total,
+        'stopped_trajectories': int(np.unique(stops['trajectory']).size),
+        'stop_events': int(durations.size),
+        'total_stop_seconds': float(durations.sum()),
+        'mean_stop_seconds': float(durations.mean()) if durations.size else 0.0
+    }
+
+
+def stop_metrics(arrays, category, stop_threshold, min_duration, noise_tolerance):
+    # Trajetórias paradas e eventos de parada.
+    points, starts, counts = group_points(arrays)
+    stops = detect_stops(points, starts, counts, stop_threshold, min_duration, noise_tolerance)
+    return _stop_summary(stops, int(counts.size), category)
+
+
+def _inside_rectangle(x, y, rect_min_x, rect_max_x, rect_min_y, rect_max_y):
+    return ((x >= min(rect_min_x, rect_max_x)) & (x <= max(rect_min_x, rect_max_x))
+            & (y >= min(rect_min_y, rect_max_y)) & (y <= max(rect_min_y, rect_max_y)))
+
+
+def stop_in_rectangle_metrics(arrays, category, stop_threshold, min_duration, noise_tolerance,
+                              rect_min_x, rect_max_x, rect_min_y, rect_max_y, total_trajectories=None):
+    # Paradas cujo ponto médio fica dentro do retângulo.
+    points, starts, counts = group_points(arrays)
+    stops = detect_stops(points, starts, counts, stop_threshold, min_duration, noise_tolerance)
+    stops = _select_stops(stops, _inside_rectangle(stops['x'], stops['y'],
+                                                   rect_min_x, rect_max_x, rect_min_y, rect_max_y))
+    return _stop_summary(stops, _total(counts, total_trajectories), category)
+
+
+def monitored_area_metrics(arrays, category, rect_min_x, rect_max_x, rect_min_y, rect_max_y,
+                           total_trajectories=None):
+    # Ocupação da área: trajetórias que entraram no retângulo e tempo médio dentro dele.
+    points, starts, counts = group_points(arrays)
+    inside = _inside_rectangle(points['x'], points['y'], rect_min_x, rect_max_x, rect_min_y, rect_max_y)
+    entered = _per_trajectory_any(inside, starts)
+
+    # Tempo dentro da área: soma dos passos cujo ponto inicial está dentro do retângulo
+    segment_start, owner = _segments(points, starts, counts)
+    dt = np.diff(points['timestamp'])[segment_start]
+    time_inside = np.bincount(owner, weights=dt * inside[segment_start], minlength=counts.size)
+
+    total = _total(counts, total_trajectories)
+    return {
+        'category': category,
+        'total_trajectories': total,
+        'trajectories_in_area': int(entered.sum()),
+        'percentage_in_area': float(100 * entered.sum() / total) if total else 0.0,
+        'points_in_area': int(inside.sum()),
+        'mean_seconds_in_area': float(time_inside[entered].mean()) if entered.any() else 0.0
+    }
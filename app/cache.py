@@ -0,0 +1,392 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Caches das rotas de plot/métricas:
+#   ResponseCache        -> corpo pronto da resposta, por rota + parâmetros
+#   TrajectoryArrayCache -> pontos buscados no MongoDB, por câmera + janela + categoria
+# Cada entrada guarda a câmera/janela de tempo que cobre, para que um upload invalide só o que mudou.
+
+
+def make_cache_key(route, params):
+    # Hash canônico da rota + parâmetros já normalizados (ordem das chaves não importa).
+    canonical = json.dumps({"route": route, "params": params}, sort_keys=True, default=str,
+                           separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def _overlaps(entry, camera, start, end):
+    return entry["camera"] == camera and start <= entry["end"] and end >= entry["start"]
+
+
+class ResponseCache:
+    # LRU em memória limitado por número de entradas e bytes, com uma camada opcional em disco.
+    # A camada em disco é compartilhada entre processos; as invalidações chegam a todos os
+    # processos pela coleção de eventos (ver record_invalidation/InvalidationFeed).
+
+    def __init__(self, max_entries=256, max_bytes=256 * 1024 * 1024, disk_dir=None,
+                 max_disk_bytes=1024 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "stores": 0,
+                       "evictions": 0, "invalidations": 0}
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # --- memória ---
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return entry
+
+        entry = self._disk_get(key)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._store_locked(key, entry)
+        return entry
+
+    def set(self, key, body, mimetype, camera, start, end, headers=None):
+        # start/end em epoch seconds: janela de tempo coberta pela resposta.
+        entry = {"body": body, "mimetype": mimetype, "headers": headers or {},
+                 "camera": camera, "start": start, "end": end}
+        if len(body) > self.max_bytes:
+            return entry
+        with self._lock:
+            self._store_locked(key, entry)
+            self._stats["stores"] += 1
+        self._disk_set(key, entry)
+        return entry
+
+    def _store_locked(self, key, entry):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous["body"])
+        self._entries[key] = entry
+        self._bytes += len(entry["body"])
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted["body"])
+            self._stats["evictions"] += 1
+
+    def invalidate(self, camera, start, end):
+        # Remove as entradas da câmera cuja janela cruza [start, end].
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if _overlaps(entry, camera, start, end)]
+            for key in keys:
+                self._bytes -= len(self._entries.pop(key)["body"])
+            self._stats["invalidations"] += len(keys)
+        removed = len(keys) + self._disk_invalidate(camera, start, end)
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                self._remove_disk_file(os.path.join(self.disk_dir, name))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"entries": len(self._entries), "bytes": self._bytes,
+                          "max_entries": self.max_entries, "max_bytes": self.max_bytes})
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        if self.disk_dir:
+            stats["disk_bytes"] = sum(size for _, size, _ in self._disk_files())
+        return stats
+
+    # --- disco ---
+
+    def _disk_paths(self, key):
+        return os.path.join(self.disk_dir, f"{key}.body"), os.path.join(self.disk_dir, f"{key}.json")
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        body_path, meta_path = self._disk_paths(key)
+        try:
+            with open(meta_path, 'r') as f:
+                entry = json.load(f)
+            with open(body_path, 'rb') as f:
+                entry["body"] = f.read()
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            return None
+        return entry
+
+    def _disk_set(self, key, entry):
+        if not self.disk_dir:
+            return
+        body_path, meta_path = self._disk_paths(key)
+        meta = {k: v for k, v in entry.items() if k != "body"}
+        try:
+            # Grava em arquivo temporário e renomeia: outro processo nunca lê um corpo pela metade
+            for path, data, mode in ((body_path, entry["body"], 'wb'),
+                                     (meta_path, json.dumps(meta), 'w')):
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, mode) as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Não foi possível gravar o cache em disco: {e}")
+            return
+        self._disk_evict()
+
+    def _disk_files(self):
+        # (chave, bytes, último acesso) de cada entrada em disco
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.json'):
+                continue
+            key = name[:-len('.json')]
+            body_path, meta_path = self._disk_paths(key)
+            try:
+                files.append((key, os.path.getsize(body_path), os.path.getmtime(meta_path)))
+            except OSError:
+                continue
+        return files
+
+    def _disk_evict(self):
+        files = sorted(self._disk_files(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in files)
+        for key, size, _ in files:
+            if total <= self.max_disk_bytes:
+                break
+            for path in self._disk_paths(key):
+                self._remove_disk_file(path)
+            total -= size
+            with self._lock:
+                self._stats["evictions"] += 1
+
+    def _disk_invalidate(self, camera, start, end):
+        if not self.disk_dir:
+            return 0
+        removed = 0
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.json'):
+                continue
+            meta_path = os.path.join(self.disk_dir, name)
+            try:
+                with open(meta_path, 'r') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if _overlaps(meta, camera, start, end):
+                for path in self._disk_paths(name[:-len('.json')]):
+                    self._remove_disk_file(path)
+                removed += 1
+        return removed
+
+    @staticmethod
+    def _remove_disk_file(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def record_invalidation(collection_events, camera, start, end):
+    # Registra que a câmera recebeu trajetórias em [start, end] (epoch seconds).
+    # Todos os processos aplicam o evento na próxima consulta ao cache.
+    collection_events.insert_one({"camera": camera, "start": float(start), "end": float(end),
+                                  "at": datetime.now(timezone.utc)})
+
+
+def _naive_utc(moment):
+    # datetime com fuso para UTC sem fuso, como o MongoDB devolve
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def _epoch(moment):
+    # datetime (sem fuso = UTC) para epoch seconds
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _arrays_nbytes(arrays):
+    return sum(values.nbytes for values in arrays.values())
+
+
+class TrajectoryArrayCache:
+    # Memoização dos pontos buscados para as rotas de plot, chave (câmera, dia, janela, categoria).
+    # Uma janela mais estreita (ou uma categoria específica) é respondida recortando uma entrada
+    # mais larga (ou com todas as categorias). Entradas expiram após ttl segundos e as menos
+    # usadas saem primeiro quando o total passa de max_bytes.
+    # Só consultas por câmera, categoria e janela de tempo passam pelo cache.
+    CACHEABLE_FIELDS = {"background", "category", "start_time", "end_time"}
+
+    def __init__(self, max_bytes=512 * 1024 * 1024, ttl=300):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "slices": 0, "misses": 0, "evictions": 0,
+                       "expirations": 0, "invalidations": 0}
+
+    def get_arrays(self, query, time_window, fetch):
+        # fetch(query, time_window) busca no MongoDB quando nenhuma entrada cobre a consulta.
+        camera = query.get("background")
+        if time_window is None or camera is None or set(query) - self.CACHEABLE_FIELDS:
+            return fetch(query, time_window)
+
+        category = query.get("category")
+        start, end = (_epoch(moment) for moment in time_window)
+        arrays = self.lookup(camera, category, start, end)
+        if arrays is None:
+            arrays = fetch(query, time_window)
+            self.store(camera, category, start, end, arrays)
+        return arrays
+
+    def lookup(self, camera, category, start, end):
+        with self._lock:
+            self._expire_locked()
+            best_key = None
+            for key, entry in self._entries.items():
+                if (entry["camera"] == camera and entry["start"] <= start and entry["end"] >= end
+                        and entry["category"] in (category, None)):
+                    # Prefere a entrada exata, depois a menor que cobre a consulta
+                    if best_key is None or entry["nbytes"] < self._entries[best_key]["nbytes"]:
+                        best_key = key
+                    if key == self._key(camera, category, start, end):
+                        best_key = key
+                        break
+            if best_key is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(best_key)
+            entry = self._entries[best_key]
+            exact = best_key == self._key(camera, category, start, end)
+            self._stats["hits" if exact else "slices"] += 1
+
+        arrays = entry["arrays"]
+        if exact:
+            return arrays
+        inside = (arrays["timestamp"] >= start) & (arrays["timestamp"] <= end)
+        if category is not None and entry["category"] is None:
+            inside &= arrays["category"] == category
+        return {column: values[inside] for column, values in arrays.items()}
+
+    def store(self, camera, category, start, end, arrays):
+        key = self._key(camera, category, start, end)
+        nbytes = _arrays_nbytes(arrays)
+        if nbytes > self.max_bytes:
+            return
+        entry = {"camera": camera, "category": category, "start": start, "end": end,
+                 "arrays": arrays, "nbytes": nbytes, "stored_at": time.monotonic()}
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous["nbytes"]
+            self._entries[key] = entry
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted["nbytes"]
+                self._stats["evictions"] += 1
+
+    def invalidate(self, camera, start, end):
+        with self._lock:
+            keys = [key for key, entry in self._entries.items() if _overlaps(entry, camera, start, end)]
+            for key in keys:
+                self._bytes -= self._entries.pop(key)["nbytes"]
+            self._stats["invalidations"] += len(keys)
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"entries": len(self._entries), "bytes": self._bytes,
+                          "max_bytes": self.max_bytes, "ttl": self.ttl})
+        lookups = stats["hits"] + stats["slices"] + stats["misses"]
+        stats["hit_ratio"] = (stats["hits"] + stats["slices"]) / lookups if lookups else 0.0
+        return stats
+
+    @staticmethod
+    def _key(camera, category, start, end):
+        day = datetime.fromtimestamp(start, timezone.utc).date().isoformat()
+        return (camera, day, start, end, category)
+
+    def _expire_locked(self):
+        limit = time.monotonic() - self.ttl
+        for key in [key for key, entry in self._entries.items() if entry["stored_at"] < limit]:
+            self._bytes -= self._entries.pop(key)["nbytes"]
+            self._stats["expirations"] += 1
+
+
+class InvalidationFeed:
+    # Aplica aos caches deste processo as invalidações registradas por outros processos
+    # (uploads, jobs de ingestão). Consulta a coleção no máximo uma vez a cada poll_interval segundos.
+    # O instante "at" vem do relógio de quem registrou o evento e um evento pode ficar visível depois
+    # de outro mais novo (commit atrasado), então "at" não serve como marca d'água exata: cada
+    # consulta volta overlap segundos antes do último evento visto e os _id já aplicados são ignorados.
+
+    def __init__(self, caches, poll_interval=1.0, overlap=60.0):
+        self.caches = [cache for cache in caches if cache is not None]
+        self.poll_interval = poll_interval
+        self.overlap = timedelta(seconds=overlap)
+        self._last_poll = 0.0
+        self._last_event = datetime.now(timezone.utc).replace(tzinfo=None)
+        # _id -> at dos eventos já aplicados que ainda caem na janela de sobreposição
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self, camera, start, end):
+        for cache in self.caches:
+            cache.invalidate(camera, start, end)
+
+    def poll(self, collection_events):
+        if not self.caches:
+            return
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_poll < self.poll_interval:
+                return
+            self._last_poll = now
+            try:
+                since = self._last_event - self.overlap
+                events = list(collection_events.find({"at": {"$gt": since}}).sort("at", 1))
+            except PyMongoError as e:
+                logger.warning(f"Não foi possível ler as invalidações do cache: {e}")
+                return
+            for event in events:
+                if event["_id"] in self._seen:
+                    continue
+                at = _naive_utc(event["at"])
+                self._seen[event["_id"]] = at
+                self.invalidate(event["camera"], event["start"], event["end"])
+                self._last_event = max(self._last_event, at)
+            # Eventos fora da janela não voltam mais na consulta
+            limit = self._last_event - self.overlap
+            self._seen = {key: at for key, at in self._seen.items() if at > limit}
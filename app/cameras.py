@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+
+class CameraRegistry:
+    # Cache das câmeras usadas pelas rotas de plot: documento do MongoDB e imagem de fundo
+    # já decodificada (e, se pedido, reduzida). As entradas são identificadas por nome + mtime
+    # do arquivo de imagem, então trocar o arquivo basta para a próxima leitura recarregar.
+    # O documento é conferido de novo no MongoDB depois de ttl segundos: uma câmera removida
+    # do banco deixa o cache (documento e imagens) na primeira consulta após esse prazo.
+    # As imagens decodificadas saem por LRU quando o total passa de max_bytes.
+    #
+    # Só o renderizador native (e os processos de renderização) usa a imagem decodificada. As
+    # funções de plot da smart_traject recebem o caminho e decodificam o arquivo a cada plot; para
+    # elas o cache economiza apenas o find_one no MongoDB e a checagem do arquivo (um stat).
+
+    def __init__(self, collection_cam, max_bytes=256 * 1024 * 1024, max_side=0, ttl=30):
+        self.collection_cam = collection_cam
+        self.max_bytes = max_bytes
+        self.max_side = max_side
+        self.ttl = ttl
+        self._cameras = {}
+        self._backgrounds = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "decodes": 0, "evictions": 0, "revalidations": 0, "removed": 0}
+
+    def get(self, name):
+        # Documento da câmera com o mtime atual da imagem ("image_mtime"; None se o arquivo não existe).
+        # Retorna None se a câmera não estiver cadastrada.
+        with self._lock:
+            camera = self._cameras.get(name)
+        if camera is not None and time.monotonic() - camera['cached_at'] > self.ttl:
+            with self._lock:
+                self._stats["revalidations"] += 1
+            return self.refresh(name)
+        mtime = _mtime(camera.get('image_path')) if camera is not None else None
+
+        if camera is None or mtime is None or mtime != camera['image_mtime']:
+            with self._lock:
+                self._stats["misses"] += 1
+            return self.refresh(name)
+
+        with self._lock:
+            self._stats["hits"] += 1
+        return camera
+
+    def refresh(self, name):
+        # Relê o documento do MongoDB (ex.: após /register_camera).
+        camera = self.collection_cam.find_one({'name': name})
+        if camera is None:
+            self.forget(name)
+            return None
+        camera['image_mtime'] = _mtime(camera.get('image_path'))
+        camera['cached_at'] = time.monotonic()
+        with self._lock:
+            # Câmeras cadastradas nunca são negativas no cache: uma nova aparece na próxima consulta
+            if camera['image_mtime'] is not None:
+                self._cameras[name] = camera
+            else:
+                self._cameras.pop(name, None)
+        return camera
+
+    def forget(self, name):
+        # Remove a câmera e as suas imagens decodificadas (ex.: câmera apagada do MongoDB).
+        with self._lock:
+            removed = self._cameras.pop(name, None) is not None
+            for key in [key for key in self._backgrounds if key[0] == name]:
+                self._bytes -= self._backgrounds.pop(key).nbytes
+                removed = True
+            if removed:
+                self._stats["removed"] += 1
+
+    def background(self, name):
+        # Imagem de fundo como array RGB(A) uint8, decodificada uma vez por arquivo.
+        # Com max_side > 0, o maior lado é reduzido a max_side pixels (proporção mantida).
+        camera = self.get(name)
+        if camera is None or camera['image_mtime'] is None:
+            return None
+        key = (name, camera['image_mtime'], self.max_side)
+        with self._lock:
+            image = self._backgrounds.get(key)
+            if image is not None:
+                self._backgrounds.move_to_end(key)
+                return image
+
+        image = decode_background(camera['image_path'], self.max_side)
+        with self._lock:
+            self._stats["decodes"] += 1
+            # Versões antigas da mesma câmera (outro mtime) saem logo
+            for old_key in [k for k in self._backgrounds if k[0] == name and k != key]:
+                self._bytes -= self._backgrounds.pop(old_key).nbytes
+            if image.nbytes <= self.max_bytes:
+                self._backgrounds[key] = image
+                self._bytes += image.nbytes
+            while self._bytes > self.max_bytes:
+                _, evicted = self._backgrounds.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self._stats["evictions"] += 1
+        return image
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({"cameras": len(self._cameras), "backgrounds": len(self._backgrounds),
+                          "bytes": self._bytes, "max_bytes": self.max_bytes, "ttl": self.ttl})
+        return stats
+
+
+def _mtime(path):
+    # mtime do arquivo, ou None se ele não existir (um único stat no lugar de isfile + getmtime)
+    if not path:
+        return None
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def decode_background(image_path, max_side=0):
+    # Decodifica a imagem da câmera em um array uint8 (altura x largura x canais).
+    with Image.open(image_path) as image:
+        if max_side:
+            # JPEG: decodifica já em escala reduzida quando possível
+            image.draft('RGB', (max_side, max_side))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+        if max_side and max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        array = np.asarray(image)
+    # Array só leitura: é compartilhado entre requisições
+    array.setflags(write=False)
+    return array
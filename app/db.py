@@ -0,0 +1,52 @@
+import os
+import threading
+
+from pymongo import MongoClient
+
+from config import (MONGODB_URI, DB_NAME, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS,
+                    MONGO_WAIT_QUEUE_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_CONNECT_TIMEOUT_MS,
+                    MONGO_SOCKET_TIMEOUT_MS)
+
+# Um único MongoClient por processo, com o pool configurado pelo config (run.py, app/utils.py e os
+# jobs de ingestão usam o mesmo). O cliente é criado com connect=False: nada abre conexão nem sobe
+# threads de monitoramento antes do primeiro uso, então importar a aplicação no master do gunicorn
+# (preload) é seguro. Se o processo for bifurcado depois do primeiro uso, o filho cria outro cliente.
+_client = None
+_client_pid = None
+_lock = threading.Lock()
+
+
+def _client_options():
+    # Timeouts 0 ficam de fora (padrão do pymongo: sem limite)
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS
+    }
+    return {name: value for name, value in options.items() if value}
+
+
+def get_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = MongoClient(MONGODB_URI, connect=False, appname='trajectories-service', **_client_options())
+            _client_pid = os.getpid()
+        return _client
+
+
+def get_database():
+    return get_client()[DB_NAME]
+
+
+def close_client():
+    # Fecha o cliente deste processo (saída de um worker do gunicorn).
+    global _client, _client_pid
+    with _lock:
+        client, _client, _client_pid = _client, None, None
+    if client is not None:
+        client.close()
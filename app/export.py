@@ -0,0 +1,135 @@
+import io
+import json
+from datetime import timezone
+
+import numpy as np
+
+from app.storage import document_points
+from app.utils import CustomJSONEncoder
+
+# Exportação das trajetórias em streaming: o cursor do MongoDB é lido em lotes e cada trajetória
+# vira uma linha (NDJSON) ou linhas de um lote Arrow/Parquet assim que chega. A memória fica
+# limitada a um lote do cursor, qualquer que seja o período pedido.
+#
+# NDJSON: uma trajetória por linha, pontos em arrays paralelos (t em epoch seconds):
+#   {"identifier", "category", "background", "start_time", "end_time", "summary", "t", "x", "y"}
+# Arrow/Parquet: uma linha por ponto (identifier, category, timestamp, x, y), como o CSV.
+# Arrow e Parquet dependem do pyarrow, que é opcional (pip install pyarrow).
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet'
+}
+
+_PROJECTION = {"_id": 0, "identifier": 1, "category": 1, "background": 1, "start_time": 1, "end_time": 1,
+               "summary": 1, "points": 1, "points_packed": 1}
+
+
+def _epoch(moment):
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def iter_export_records(collection, query, time_window=None, batch_size=500):
+    # Trajetórias da consulta em ordem de início: (documento sem os pontos, t, x, y).
+    # Com time_window=(início, fim), só os pontos em [início, fim); trajetórias sem pontos nela são puladas.
+    if time_window is not None:
+        window_start, window_end = (_epoch(moment) for moment in time_window)
+    cursor = collection.find(query, _PROJECTION).sort("start_time", 1).batch_size(batch_size)
+    for doc in cursor:
+        t, x, y = document_points(doc)
+        if time_window is not None:
+            inside = (t >= window_start) & (t < window_end)
+            if not inside.any():
+                continue
+            t, x, y = t[inside], x[inside], y[inside]
+        doc.pop('points', None)
+        doc.pop('points_packed', None)
+        yield doc, t, x, y
+
+
+def ndjson_chunks(records, chunk_bytes=64 * 1024):
+    # Linhas NDJSON agrupadas em blocos de ~chunk_bytes (menos chamadas de escrita no socket).
+    buffer = []
+    size = 0
+    for doc, t, x, y in records:
+        doc.update({"t": t.tolist(), "x": x.tolist(), "y": y.tolist()})
+        line = json.dumps(doc, cls=CustomJSONEncoder, ensure_ascii=False) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+class _ChunkSink(io.RawIOBase):
+    # Destino de escrita do pyarrow que só acumula os bytes até o gerador entregá-los.
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def arrow_chunks(records, export_format='arrow', rows_per_batch=256 * 1024):
+    # Pontos em lotes Arrow (stream IPC) ou row groups Parquet de até rows_per_batch linhas.
+    # O pyarrow é importado aqui, antes de a resposta começar, para que a falta dele vire um erro normal.
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Exportação em Arrow/Parquet requer o pacote pyarrow")
+
+    schema = pa.schema([('identifier', pa.float64()), ('category', pa.float64()),
+                        ('timestamp', pa.timestamp('us', tz='UTC')), ('x', pa.float64()), ('y', pa.float64())])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema) if export_format == 'parquet' else pa.ipc.new_stream(sink, schema)
+
+    def write(parts):
+        counts = [part[1].size for part in parts]
+        microseconds = np.rint(np.concatenate([part[1] for part in parts]) * 1e6).astype(np.int64)
+        columns = {
+            'identifier': np.repeat([part[0]['identifier'] for part in parts], counts).astype(np.float64),
+            'category': np.repeat([part[0]['category'] for part in parts], counts).astype(np.float64),
+            'timestamp': microseconds.astype('datetime64[us]'),
+            'x': np.concatenate([part[2] for part in parts]),
+            'y': np.concatenate([part[3] for part in parts])
+        }
+        writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+
+    def generate():
+        parts = []
+        rows = 0
+        for record in records:
+            parts.append(record)
+            rows += record[1].size
+            if rows >= rows_per_batch:
+                write(parts)
+                parts = []
+                rows = 0
+                yield sink.drain()
+        if parts:
+            write(parts)
+        writer.close()
+        yield sink.drain()
+
+    return generate()
@@ -0,0 +1,93 @@
+import logging
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+# Índices das trajetórias: as rotas /plot_* filtram por câmera, janela de tempo e quase sempre categoria.
+# O segundo índice atende /plot_with_background, que não filtra por categoria; o terceiro, a busca
+# da ingestão incremental por (câmera, identifier, start_time), e é único: duas ingestões do mesmo
+# arquivo ao mesmo tempo não gravam a trajetória duas vezes (a segunda recebe DuplicateKeyError e a
+# conta como skipped). Coleções com duplicatas de antes dele precisam de "flask dedup-trajectories".
+# background=True só tem efeito em servidores < 4.2; nos atuais toda construção já é online.
+TRAJECTORY_INDEXES = [
+    IndexModel([("background", ASCENDING), ("category", ASCENDING),
+                ("start_time", ASCENDING), ("end_time", ASCENDING)],
+               name="background_category_time", background=True),
+    IndexModel([("background", ASCENDING), ("start_time", ASCENDING), ("end_time", ASCENDING)],
+               name="background_time", background=True),
+    IndexModel([("background", ASCENDING), ("identifier", ASCENDING), ("start_time", ASCENDING)],
+               name="background_identifier_start", unique=True, background=True),
+]
+
+# Câmeras: find_one({'name': ...}) em toda rota e unicidade garantida pelo banco.
+CAMERA_INDEXES = [
+    IndexModel([("name", ASCENDING)], name="name_unique", unique=True, background=True),
+]
+
+# Eventos de invalidação do cache: lidos por instante e descartados após um dia.
+CACHE_EVENT_INDEXES = [
+    IndexModel([("at", ASCENDING)], name="at_ttl", expireAfterSeconds=24 * 3600, background=True),
+]
+
+# Agregados: um documento por câmera/resolução/intervalo/categoria (alvo dos upserts da ingestão).
+ROLLUP_INDEXES = [
+    IndexModel([("background", ASCENDING), ("resolution", ASCENDING), ("bucket", ASCENDING),
+                ("category", ASCENDING)], name="background_resolution_bucket_category", unique=True,
+               background=True),
+]
+
+
+def ensure_indexes(db, collection_traj_name, collection_cam_name, collection_events_name=None,
+                   collection_rollups_name=None):
+    # Cria os índices que ainda não existem (create_indexes é idempotente). Um por vez: um índice
+    # único que falha por duplicatas não impede os demais.
+    created = {}
+    targets = [(collection_traj_name, TRAJECTORY_INDEXES), (collection_cam_name, CAMERA_INDEXES)]
+    if collection_events_name:
+        targets.append((collection_events_name, CACHE_EVENT_INDEXES))
+    if collection_rollups_name:
+        targets.append((collection_rollups_name, ROLLUP_INDEXES))
+    for collection_name, indexes in targets:
+        created[collection_name] = []
+        for index in indexes:
+            try:
+                created[collection_name] += db[collection_name].create_indexes([index])
+            except OperationFailure as e:
+                # Ex.: câmeras ou trajetórias duplicadas impedem o índice único; os demais seguem
+                logger.error(f"Falha ao criar o índice '{index.document['name']}' em '{collection_name}': {e}")
+    return created
+
+
+def _winning_indexes(plan):
+    # Percorre o plano vencedor e devolve os índices usados (ou COLLSCAN).
+    if plan.get('stage') == 'IXSCAN':
+        return [plan.get('indexName')]
+    if plan.get('stage') == 'COLLSCAN':
+        return ['COLLSCAN']
+    names = []
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            names += _winning_indexes(plan[key])
+    for child in plan.get('inputStages', []):
+        names += _winning_indexes(child)
+    return names
+
+
+def verify_indexes(db, collection_traj_name, collection_cam_name, camera='__explain__'):
+    # Usa explain() nas consultas típicas das rotas para conferir qual índice o planner escolhe.
+    now = datetime.now(timezone.utc)
+    queries = {
+        'plot (câmera + categoria + janela)': (collection_traj_name, {
+            "background": camera, "category": 2, "start_time": {"$lte": now}, "end_time": {"$gte": now}}),
+        'plot (câmera + janela)': (collection_traj_name, {
+            "background": camera, "start_time": {"$lte": now}, "end_time": {"$gte": now}}),
+        'câmera por nome': (collection_cam_name, {"name": camera}),
+    }
+    report = {}
+    for label, (collection_name, query) in queries.items():
+        explain = db[collection_name].find(query).explain()
+        report[label] = _winning_indexes(explain['queryPlanner']['winningPlan'])
+    return report
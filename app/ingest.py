@@ -0,0 +1,499 @@
+import json
+import logging
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pymongo import DeleteOne, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from app.storage import (LAYOUT_PACKED, document_datetime_points, document_points, encode_packed_points,
+                         linestring_wkt, points_from_arrays, to_json_document)
+from app.parsing import arrays_from_trajectories, group_by_identifier, iter_trajectory_arrays, write_csv
+from app.summary import summarize_trajectory, summary_documents, trajectory_summaries
+from app.utils import CustomJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+CSV_HEADER = 'identifier,category,timestamp,x,y\n'
+
+# Código de erro do MongoDB para chave duplicada (índice único background_identifier_start)
+DUPLICATE_KEY = 11000
+
+# Uma thread basta para o arquivamento do CSV: fica fora do caminho crítico do upload
+_archive_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='csv-archive')
+
+
+def _epoch_to_datetime(epoch):
+    return datetime.fromtimestamp(float(epoch), timezone.utc).replace(tzinfo=None)
+
+
+def build_trajectory_document(identifier, category, t, x, y, camera, datetime_points=False, layout=None,
+                              summary=None):
+    # Documento MongoDB de uma trajetória a partir dos arrays de tempo e coordenadas.
+    # summary: resumo já calculado (ver app.summary); se omitido, é calculado aqui.
+    trajectory_data = {
+        "identifier": identifier,
+        "category": category,
+        "start_time": _epoch_to_datetime(t[0]),
+        "end_time": _epoch_to_datetime(t[-1])
+    }
+    if layout != LAYOUT_PACKED:
+        trajectory_data["geometry"] = linestring_wkt(x, y)
+    trajectory_data["background"] = camera
+    trajectory_data["summary"] = summary if summary is not None else summarize_trajectory(t, x, y)
+    if layout == LAYOUT_PACKED:
+        # Arrays paralelos: sem WKT por ponto e sem a LINESTRING redundante
+        trajectory_data["points_packed"] = encode_packed_points(t, x, y, as_datetime=datetime_points)
+    else:
+        trajectory_data["points"] = points_from_arrays(t, x, y, as_datetime=datetime_points)
+    return trajectory_data
+
+
+def build_trajectory_documents(arrays, camera, datetime_points=False, layout=None):
+    # Documentos de todas as trajetórias dos arrays do parser, sem passar por CSV nem iterrows.
+    # Trajetórias com menos de 2 pontos são descartadas, como no TrajectoryCollection.
+    arrays = group_by_identifier(arrays)
+    if arrays['counts'].size == 0:
+        return []
+    summaries = summary_documents(trajectory_summaries(arrays['t'], arrays['x'], arrays['y'], arrays['counts']))
+    return [
+        build_trajectory_document(identifier, category, t, x, y, camera, datetime_points, layout, summary)
+        for (identifier, category, t, x, y), summary in zip(iter_trajectory_arrays(arrays), summaries)
+        if t.size >= 2
+    ]
+
+
+def _log_archive_error(future):
+    if future.exception() is not None:
+        logger.error(f"Erro ao arquivar o CSV: {future.exception()}")
+
+
+def archive_csv_async(arrays, csv_file_path):
+    # Grava o CSV em segundo plano, como saída de arquivamento.
+    future = _archive_executor.submit(write_csv, arrays, csv_file_path)
+    future.add_done_callback(_log_archive_error)
+    return future
+
+
+def update_rollups(rollups, camera, arrays, sign=1):
+    # Soma as trajetórias recém-gravadas aos agregados (app.rollups). Uma falha aqui não desfaz
+    # a ingestão: fica no log e os agregados podem ser refeitos com "flask rebuild-rollups".
+    if rollups is None:
+        return
+    try:
+        rollups.update(camera, arrays, sign)
+    except PyMongoError as e:
+        logger.error(f"Erro ao atualizar os agregados da câmera {camera}: {e}")
+
+
+def _rollup_arrays(trajectories):
+    # Identificadores sequenciais: duas trajetórias gravadas com o mesmo identificador não se
+    # juntam ao calcular os agregados
+    return arrays_from_trajectories((i, category, t, x, y)
+                                    for i, (_, category, t, x, y) in enumerate(trajectories))
+
+
+def _merge_points(parts):
+    # Junta os pontos de várias partes de uma trajetória em ordem de tempo. Pontos repetidos
+    # (a menos de 2 ms do anterior: um BSON date trunca o instante em milissegundos, e a
+    # diferença ainda carrega o erro de arredondamento do epoch) ficam uma vez só, valendo o da
+    # primeira parte.
+    t = np.concatenate([part[0] for part in parts])
+    x = np.concatenate([part[1] for part in parts])
+    y = np.concatenate([part[2] for part in parts])
+    order = np.argsort(t, kind='stable')
+    t, x, y = t[order], x[order], y[order]
+    keep = np.r_[True, np.diff(t) >= 2e-3]
+    return t[keep], x[keep], y[keep]
+
+
+def _duplicate_indexes(error, allowed):
+    # Índices das operações de um lote não ordenado recusadas por chave duplicada: a trajetória
+    # já foi gravada por outra ingestão (ou por um envio anterior). Só as operações em allowed podem
+    # falhar assim; qualquer outro erro é repassado.
+    write_errors = error.details.get('writeErrors', [])
+    if error.details.get('writeConcernErrors') or any(
+            write_error['code'] != DUPLICATE_KEY or write_error['index'] not in allowed
+            for write_error in write_errors):
+        raise error
+    return {write_error['index'] for write_error in write_errors}
+
+
+def insert_trajectories(arrays, collection, camera, datetime_points=False, layout=None, rollups=None):
+    # Ingestão sem upsert: insert_many não ordenado dos documentos de build_trajectory_documents.
+    # O índice único (câmera, identifier, start_time) recusa as trajetórias já gravadas (reenvio do
+    # mesmo arquivo ou outra ingestão ao mesmo tempo), que são contadas como skipped.
+    # Retorna os documentos inseridos e as contagens, no formato de upsert_trajectories.
+    arrays = group_by_identifier(arrays)
+    trajectories = [trajectory for trajectory in iter_trajectory_arrays(arrays) if trajectory[2].size >= 2]
+    documents = build_trajectory_documents(arrays, camera, datetime_points, layout)
+    stats = {"inserted": 0, "updated": 0, "skipped": 0, "start": None, "end": None}
+    if not documents:
+        return [], stats
+
+    duplicates = set()
+    try:
+        collection.insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        duplicates = _duplicate_indexes(e, range(len(documents)))
+    inserted = [(doc, trajectory) for index, (doc, trajectory) in enumerate(zip(documents, trajectories))
+                if index not in duplicates]
+    stats["inserted"] = len(inserted)
+    stats["skipped"] = len(duplicates)
+    if inserted:
+        stats["start"] = min(float(trajectory[2][0]) for _, trajectory in inserted)
+        stats["end"] = max(float(trajectory[2][-1]) for _, trajectory in inserted)
+        update_rollups(rollups, camera, _rollup_arrays([trajectory for _, trajectory in inserted]))
+    return [doc for doc, _ in inserted], stats
+
+
+def _stored_trajectories(collection, camera, identifiers, start, end, merge_gap):
+    # Trajetórias já gravadas da câmera com esses identificadores que podem se juntar às novas
+    # (cruzam [start - merge_gap, end + merge_gap]), agrupadas por identificador.
+    cursor = collection.find(
+        {"background": camera, "identifier": {"$in": identifiers},
+         "start_time": {"$lte": _epoch_to_datetime(end + merge_gap)},
+         "end_time": {"$gte": _epoch_to_datetime(start - merge_gap)}},
+        {"identifier": 1, "category": 1, "start_time": 1, "end_time": 1, "points": 1, "points_packed": 1})
+    stored = {}
+    for doc in cursor:
+        t, x, y = document_points(doc)
+        stored.setdefault(doc['identifier'], []).append((doc, t, x, y))
+    return stored
+
+
+def upsert_trajectories(arrays, collection, camera, datetime_points=False, layout=None, merge_gap=0.0,
+                        batch_size=500, rollups=None, written=None):
+    # Ingestão incremental: cada trajetória é identificada por (câmera, identifier, start_time).
+    # Uma trajetória nova cujo identificador já existe na câmera com pontos a menos de merge_gap
+    # segundos de distância é mesclada à gravada (o arquivo anterior tinha só parte dela); se
+    # não trouxer nenhum ponto novo, é ignorada. As demais são inseridas com upsert pela chave,
+    # então reenviar o mesmo arquivo não duplica nada.
+    # Retorna os documentos gravados (para o JSON) e as contagens inserted/updated/skipped, com
+    # start/end (epoch seconds) das trajetórias gravadas.
+    # written (dict opcional) recebe identifier -> _id de cada trajetória gravada ou já presente.
+    arrays = group_by_identifier(arrays)
+    trajectories = [trajectory for trajectory in iter_trajectory_arrays(arrays) if trajectory[2].size >= 2]
+    stats = {"inserted": 0, "updated": 0, "skipped": 0, "start": None, "end": None}
+    documents = []
+
+    for offset in range(0, len(trajectories), batch_size):
+        batch = trajectories[offset:offset + batch_size]
+        stored = _stored_trajectories(collection, camera, [trajectory[0] for trajectory in batch],
+                                      min(float(t[0]) for _, _, t, _, _ in batch),
+                                      max(float(t[-1]) for _, _, t, _, _ in batch), merge_gap)
+
+        operations, written_docs, inserted, removed, added = [], [], [], [], []
+        for identifier, category, t, x, y in batch:
+            # Em ordem de início: o documento mantido é o mais antigo, então a chave regravada
+            # (start_time da junção) não colide com a de outra parte ainda não removida
+            matches = sorted((match for match in stored.get(identifier, [])
+                              if match[1][0] - merge_gap <= t[-1] and match[1][-1] + merge_gap >= t[0]),
+                             key=lambda match: match[1][0])
+            if not matches:
+                doc = build_trajectory_document(identifier, category, t, x, y, camera, datetime_points, layout)
+                inserted.append((len(operations), doc, (identifier, category, t, x, y)))
+                operations.append(UpdateOne({"background": camera, "identifier": identifier,
+                                             "start_time": doc["start_time"]},
+                                            {"$setOnInsert": doc}, upsert=True))
+                written_docs.append((doc, t))
+                continue
+
+            stored_parts = [match[1:] for match in matches]
+            merged_t, merged_x, merged_y = _merge_points(stored_parts + [(t, x, y)])
+            if len(matches) == 1 and merged_t.size == _merge_points(stored_parts)[0].size:
+                # Nenhum ponto novo: a trajetória já está gravada inteira
+                stats["skipped"] += 1
+                if written is not None:
+                    written[identifier] = matches[0][0]["_id"]
+                continue
+
+            # Mantém o _id e a categoria da parte gravada mais antiga; as demais partes são removidas
+            first = matches[0][0]
+            doc = build_trajectory_document(identifier, first['category'], merged_t, merged_x, merged_y,
+                                            camera, datetime_points, layout)
+            doc["_id"] = first["_id"]
+            operations.append(ReplaceOne({"_id": first["_id"]}, doc))
+            operations.extend(DeleteOne({"_id": match[0]["_id"]}) for match in matches[1:])
+            removed.extend((identifier, match[0]['category'], *match[1:]) for match in matches)
+            added.append((identifier, first['category'], merged_t, merged_x, merged_y))
+            written_docs.append((doc, merged_t))
+            stats["updated"] += 1
+
+        if not operations:
+            continue
+        try:
+            upserted_ids = collection.bulk_write(operations, ordered=False).upserted_ids
+        except BulkWriteError as e:
+            # Duas ingestões simultâneas inserindo a mesma chave: o índice único recusa a segunda
+            _duplicate_indexes(e, {index for index, _, _ in inserted})
+            upserted_ids = {upserted['index']: upserted['_id'] for upserted in e.details.get('upserted', [])}
+        for index, doc, trajectory in inserted:
+            if index in upserted_ids:
+                doc["_id"] = upserted_ids[index]
+                added.append(trajectory)
+                stats["inserted"] += 1
+            else:
+                # Outra ingestão gravou a mesma chave antes
+                stats["skipped"] += 1
+        written_docs = [(doc, t) for doc, t in written_docs if "_id" in doc]
+        documents.extend(doc for doc, _ in written_docs)
+        if written is not None:
+            written.update((doc["identifier"], doc["_id"]) for doc, _ in written_docs)
+        for _, t in written_docs:
+            stats["start"] = float(t[0]) if stats["start"] is None else min(stats["start"], float(t[0]))
+            stats["end"] = float(t[-1]) if stats["end"] is None else max(stats["end"], float(t[-1]))
+
+        if removed:
+            update_rollups(rollups, camera, _rollup_arrays(removed), sign=-1)
+        update_rollups(rollups, camera, _rollup_arrays(added))
+
+    return documents, stats
+
+
+def _deduplicate_batch(collection, groups, rollups):
+    # Junta as cópias de cada grupo de _ids (mesma chave) no documento mais antigo.
+    ids = [_id for group in groups for _id in group]
+    docs = {doc["_id"]: doc for doc in collection.find({"_id": {"$in": ids}})}
+    operations, removed, added = [], {}, {}
+    for group in groups:
+        copies = [docs[_id] for _id in sorted(group) if _id in docs]
+        if len(copies) < 2:
+            continue
+        kept = copies[0]
+        parts = [document_points(doc) for doc in copies]
+        merged_t, merged_x, merged_y = _merge_points(parts)
+        operations.extend(DeleteOne({"_id": doc["_id"]}) for doc in copies[1:])
+        if merged_t.size != parts[0][0].size:
+            # Alguma cópia tinha pontos que a mantida não tem: regrava no mesmo layout
+            doc = build_trajectory_document(kept["identifier"], kept["category"], merged_t, merged_x, merged_y,
+                                            kept["background"], document_datetime_points(kept),
+                                            LAYOUT_PACKED if "points_packed" in kept else None)
+            doc["_id"] = kept["_id"]
+            operations.append(ReplaceOne({"_id": kept["_id"]}, doc))
+        removed.setdefault(kept["background"], []).extend(
+            (doc["identifier"], doc["category"], *part) for doc, part in zip(copies, parts))
+        added.setdefault(kept["background"], []).append(
+            (kept["identifier"], kept["category"], merged_t, merged_x, merged_y))
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    for camera in removed:
+        update_rollups(rollups, camera, _rollup_arrays(removed[camera]), sign=-1)
+        update_rollups(rollups, camera, _rollup_arrays(added[camera]))
+
+
+def deduplicate_trajectories(collection, camera=None, rollups=None, dry_run=False, batch_size=500):
+    # Migração única para o índice único (câmera, identifier, start_time): as cópias de uma mesma
+    # chave gravadas antes dele (reenvios sem upsert, ingestões simultâneas) viram um documento só,
+    # com os pontos de todas as cópias (_merge_points) e o _id e a categoria da mais antiga.
+    # Com dry_run só conta. Retorna {"keys": chaves repetidas, "removed": documentos removidos}.
+    match = {"background": camera} if camera else {}
+    groups = collection.aggregate([
+        {"$match": match},
+        {"$group": {"_id": {"background": "$background", "identifier": "$identifier",
+                            "start_time": "$start_time"},
+                    "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+
+    stats = {"keys": 0, "removed": 0}
+    batch = []
+    for group in groups:
+        stats["keys"] += 1
+        stats["removed"] += group["count"] - 1
+        if dry_run:
+            continue
+        batch.append(group["ids"])
+        if len(batch) >= batch_size:
+            _deduplicate_batch(collection, batch, rollups)
+            batch = []
+    if batch:
+        _deduplicate_batch(collection, batch, rollups)
+    return stats
+
+
+def _csv_format(values):
+    # Inteiro quando todos os valores são inteiros, como write_csv faz com x e y
+    return '%d' if np.array_equal(values, np.round(values)) else '%s'
+
+
+def _write_csv_rows(csv_file, identifier, category, t, x, y):
+    # Mesmas linhas de write_csv: identifier e category como float (1.0), como no txt_to_csv
+    rows = np.column_stack([np.full(t.size, identifier), np.full(t.size, category), t, x, y])
+    fmt = ['%s', '%s', '%s', _csv_format(x), _csv_format(y)]
+    np.savetxt(csv_file, rows, fmt=fmt, delimiter=',')
+
+
+def _concatenate_points(parts):
+    # Junta as partes em ordem de tempo sem descartar pontos, como group_by_identifier
+    # (empates ficam na ordem das partes, isto é, das linhas do arquivo).
+    t = np.concatenate([part[0] for part in parts])
+    order = np.argsort(t, kind='stable')
+    return (t[order], np.concatenate([part[1] for part in parts])[order],
+            np.concatenate([part[2] for part in parts])[order])
+
+
+def _continue_written(collection, camera, continued, written, upsert, datetime_points, layout):
+    # Trajetórias de um lote cujo identificador já foi gravado (ou encontrado já gravado) por esta
+    # mesma ingestão, isto é, linhas repetidas do identificador em lotes diferentes: a parte nova é
+    # juntada ao documento gravado e o resultado é o mesmo da ingestão de uma vez (group_by_identifier).
+    # Com upsert a junção segue upsert_trajectories (_merge_points e a categoria do documento
+    # gravado); sem upsert, todos os pontos entram e a categoria é a do ponto mais antigo.
+    # Retorna os documentos regravados e as partes (removidas, adicionadas) para os agregados.
+    stored = {doc["_id"]: doc for doc in collection.find(
+        {"_id": {"$in": [written[trajectory[0]] for trajectory in continued]}},
+        {"category": 1, "points": 1, "points_packed": 1})}
+    operations, documents, removed, added = [], [], [], []
+    for identifier, category, t, x, y in continued:
+        _id = written[identifier]
+        doc = stored.get(_id)
+        if doc is None:
+            # Removido por outro processo no meio da ingestão: a parte nova fica sozinha
+            parts, merged_category = [], category
+        else:
+            stored_t, stored_x, stored_y = document_points(doc)
+            parts = [(stored_t, stored_x, stored_y)]
+            removed.append((identifier, doc["category"], stored_t, stored_x, stored_y))
+            merged_category = doc["category"] if upsert or stored_t[0] <= t[0] else category
+        merge = _merge_points if upsert else _concatenate_points
+        merged_t, merged_x, merged_y = merge(parts + [(t, x, y)])
+        new_doc = build_trajectory_document(identifier, merged_category, merged_t, merged_x, merged_y,
+                                            camera, datetime_points, layout)
+        new_doc["_id"] = _id
+        operations.append(ReplaceOne({"_id": _id}, new_doc, upsert=True))
+        documents.append(new_doc)
+        added.append((identifier, merged_category, merged_t, merged_x, merged_y))
+    collection.bulk_write(operations, ordered=False)
+    return documents, removed, added
+
+
+def _write_json_array(json_file_path, partial_file_path, versions):
+    # Monta o JSON final a partir das versões gravadas em partial_file_path (uma por linha,
+    # "_id<TAB>documento"), ficando só com a última versão de cada documento.
+    seen = {}
+    with open(partial_file_path) as partial_file, open(json_file_path, 'w') as json_file:
+        json_file.write('[')
+        first_document = True
+        for line in partial_file:
+            key, _, document = line.partition('\t')
+            seen[key] = seen.get(key, 0) + 1
+            if seen[key] != versions[key]:
+                continue
+            if not first_document:
+                json_file.write(', ')
+            json_file.write(document.rstrip('\n'))
+            first_document = False
+        json_file.write(']')
+
+
+def store_trajectories_streaming(trajectories, collection, camera, json_file_path, csv_file_path=None,
+                                 datetime_points=False, layout=None, batch_size=500, on_progress=None,
+                                 rollups=None, upsert=False, merge_gap=0.0):
+    # Grava as trajetórias em lotes: insert_trajectories (insert_many não ordenado) e escrita incremental do JSON
+    # (as versões de cada documento vão para um arquivo parcial; o JSON final fica com a última).
+    # A memória fica limitada a um lote (mais o _id de cada identificador gravado), qualquer que
+    # seja o tamanho do arquivo.
+    # on_progress(stats) é chamado após cada lote gravado; rollups (RollupStore) recebe cada lote.
+    # Com upsert, cada lote passa por upsert_trajectories (mescla e ignora o que já está gravado).
+    # Linhas repetidas de um identificador viram um documento só, como na ingestão de uma vez
+    # (group_by_identifier): dentro do lote pelo agrupamento e entre lotes por _continue_written.
+    # Os documentos gravados são, nos dois modos, os mesmos de build_trajectory_documents /
+    # upsert_trajectories sobre o arquivo inteiro (com datetime_points, a parte regravada volta
+    # do MongoDB truncada em milissegundos).
+    # stats: read (trajetórias lidas do iterador, uma por linha do TXT), trajectories (documentos
+    # distintos gravados), inserted/updated/skipped e start/end (menor e maior instante gravado,
+    # epoch seconds, para invalidar o cache de respostas)
+    stats = {"read": 0, "trajectories": 0, "inserted": 0, "updated": 0, "skipped": 0,
+             "start": None, "end": None}
+    batch = []
+    # identifier -> _id dos documentos gravados por esta ingestão
+    written = {}
+    # Trajetórias com menos de 2 pontos ainda não gravadas: podem ser completadas por linhas seguintes
+    pending = {}
+    # Número de versões de cada documento no arquivo parcial do JSON
+    versions = {}
+    partial_file_path = json_file_path + '.partial'
+
+    csv_file = open(csv_file_path, 'w') if csv_file_path else None
+    try:
+        if csv_file:
+            csv_file.write(CSV_HEADER)
+
+        with open(partial_file_path, 'w') as partial_file:
+
+            def flush():
+                if not batch:
+                    return
+                grouped = []
+                for identifier, category, t, x, y in iter_trajectory_arrays(
+                        group_by_identifier(arrays_from_trajectories(batch))):
+                    if identifier in pending:
+                        pending_category, pending_t, pending_x, pending_y = pending.pop(identifier)
+                        if pending_t[0] <= t[0]:
+                            category = pending_category
+                        t, x, y = _concatenate_points([(pending_t, pending_x, pending_y), (t, x, y)])
+                    if identifier not in written and t.size < 2:
+                        # Trajetórias com menos de 2 pontos são descartadas, como no TrajectoryCollection
+                        pending[identifier] = (category, t, x, y)
+                        continue
+                    grouped.append((identifier, category, t, x, y))
+                batch.clear()
+
+                continued = [trajectory for trajectory in grouped if trajectory[0] in written]
+                fresh = [trajectory for trajectory in grouped if trajectory[0] not in written]
+                documents, bounds = [], []
+                if continued:
+                    rewritten, removed, added = _continue_written(collection, camera, continued, written,
+                                                                  upsert, datetime_points, layout)
+                    documents.extend(rewritten)
+                    bounds.extend((trajectory[2][0], trajectory[2][-1]) for trajectory in added)
+                    update_rollups(rollups, camera, _rollup_arrays(removed), sign=-1)
+                    update_rollups(rollups, camera, _rollup_arrays(added))
+                if fresh and upsert:
+                    stored, result = upsert_trajectories(
+                        arrays_from_trajectories(fresh), collection, camera, datetime_points, layout,
+                        merge_gap, batch_size, rollups, written)
+                    for key in ("inserted", "updated", "skipped"):
+                        stats[key] += result[key]
+                    documents.extend(stored)
+                    if result["start"] is not None:
+                        bounds.append((result["start"], result["end"]))
+                elif fresh:
+                    stored, result = insert_trajectories(arrays_from_trajectories(fresh), collection, camera,
+                                                         datetime_points, layout, rollups)
+                    stats["inserted"] += result["inserted"]
+                    stats["skipped"] += result["skipped"]
+                    written.update((doc["identifier"], doc["_id"]) for doc in stored)
+                    documents.extend(stored)
+                    if result["start"] is not None:
+                        bounds.append((result["start"], result["end"]))
+
+                for start, end in bounds:
+                    stats["start"] = float(start) if stats["start"] is None else min(stats["start"], float(start))
+                    stats["end"] = float(end) if stats["end"] is None else max(stats["end"], float(end))
+                for doc in documents:
+                    key = str(doc["_id"])
+                    if key not in versions:
+                        stats["trajectories"] += 1
+                    versions[key] = versions.get(key, 0) + 1
+                    partial_file.write(f"{key}\t{json.dumps(to_json_document(doc), cls=CustomJSONEncoder)}\n")
+                if on_progress:
+                    on_progress(stats)
+
+            for identifier, category, t, x, y in trajectories:
+                stats["read"] += 1
+                if csv_file:
+                    _write_csv_rows(csv_file, identifier, category, t, x, y)
+                batch.append((identifier, category, t, x, y))
+                if len(batch) >= batch_size:
+                    flush()
+            flush()
+
+        _write_json_array(json_file_path, partial_file_path, versions)
+    finally:
+        if csv_file:
+            csv_file.close()
+        if os.path.exists(partial_file_path):
+            os.remove(partial_file_path)
+
+    return stats
@@ -0,0 +1,244 @@
+import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+from app.db import get_database
+from config import (COLLECTION_TRAJ, COLLECTION_JOBS, COLLECTION_CACHE_EVENTS,
+                    COLLECTION_ROLLUPS, POINTS_STORAGE, INGEST_BATCH_SIZE, INGEST_WORKERS, INGEST_MERGE_GAP_SECONDS,
+                    INGEST_JOB_HEARTBEAT_SECONDS, INGEST_JOB_STALE_SECONDS, INGEST_JOB_MAX_ATTEMPTS,
+                    INGEST_UPSERT, ROLLUPS_ENABLED, ROLLUP_BUCKET_SECONDS, ROLLUP_CELL_SIZE)
+
+logger = logging.getLogger(__name__)
+
+# Estados de um job de ingestão
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+_executor = None
+# Threads do gunicorn (gthread) e a de recuperação dos jobs podem pedir o pool ao mesmo tempo
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # Pool de processos local, criado sob demanda em cada processo web.
+    # "spawn" evita herdar via fork os clientes MongoDB e threads do processo pai.
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=INGEST_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return _executor
+
+
+def _discard_executor(executor):
+    # Um processo do pool morreu (ex.: falta de memória): o pool fica inutilizável e o próximo
+    # job cria outro.
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+
+
+def _get_worker_db():
+    # Cada processo do pool tem o seu próprio cliente MongoDB (o compartilhado de app/db.py).
+    return get_database()
+
+
+def make_rollup_store(collection_rollups):
+    # RollupStore com os parâmetros do config (None quando os agregados estão desativados).
+    from app.rollups import RollupStore
+    if not ROLLUPS_ENABLED:
+        return None
+    return RollupStore(collection_rollups, bucket_seconds=ROLLUP_BUCKET_SECONDS, cell_size=ROLLUP_CELL_SIZE)
+
+
+def _fail_job(collection_jobs, job_id, error, statuses=(JOB_QUEUED, JOB_RUNNING)):
+    # Marca o job como falho se ele ainda estiver em um dos estados indicados.
+    return collection_jobs.update_one(
+        {"_id": ObjectId(job_id), "status": {"$in": list(statuses)}},
+        {"$set": {"status": JOB_FAILED, "error": error, "finished_at": datetime.now(timezone.utc)}}
+    ).modified_count
+
+
+def _submit(collection_jobs, job_id, job):
+    # Entrega o job ao pool. Se o processo do pool morrer ou o job nem chegar a rodar, o
+    # callback marca o job como falho (run_ingest_job já trata as exceções da ingestão).
+    # Jobs gravados antes do campo "upsert" seguem o padrão do config.
+    executor = _get_executor()
+    future = executor.submit(run_ingest_job, job_id, job["camera"], job["file"], job["json_file"],
+                             job["csv_file"], job["datetime_points"], job.get("upsert", INGEST_UPSERT))
+
+    def on_done(future):
+        if future.cancelled():
+            error = "Job cancelado antes de executar"
+        elif future.exception() is not None:
+            error = f"Falha no processo de ingestão: {future.exception()}"
+            if isinstance(future.exception(), BrokenProcessPool):
+                _discard_executor(executor)
+        else:
+            return
+        logger.error(f"Job de ingestão {job_id}: {error}")
+        try:
+            _fail_job(collection_jobs, job_id, error)
+        except PyMongoError as e:
+            logger.error(f"Não foi possível marcar o job {job_id} como falho: {e}")
+
+    future.add_done_callback(on_done)
+    return future
+
+
+def submit_ingest_job(collection_jobs, camera, txt_file_path, json_file_path, csv_file_path,
+                      datetime_points=False, upsert=False):
+    # Registra o job na fila (coleção MongoDB) e o entrega ao pool; retorna o id imediatamente.
+    now = datetime.now(timezone.utc)
+    job = {
+        "status": JOB_QUEUED,
+        "camera": camera,
+        "file": txt_file_path,
+        "json_file": json_file_path,
+        "csv_file": csv_file_path,
+        "datetime_points": datetime_points,
+        "upsert": upsert,
+        "attempts": 0,
+        "created_at": now,
+        "queued_at": now,
+        "progress": {"trajectories_read": 0, "trajectories_inserted": 0, "trajectories_updated": 0,
+                     "trajectories_skipped": 0, "read_per_second": 0.0, "trajectories_per_second": 0.0,
+                     "elapsed_seconds": 0.0}
+    }
+    job_id = str(collection_jobs.insert_one(job).inserted_id)
+    _submit(collection_jobs, job_id, job)
+    return job_id
+
+
+def recover_stale_jobs(collection_jobs, stale_seconds=INGEST_JOB_STALE_SECONDS,
+                       max_attempts=INGEST_JOB_MAX_ATTEMPTS):
+    # Jobs órfãos de um processo que morreu (reinício do servidor, worker morto pelo gunicorn):
+    # - "running" sem heartbeat há stale_seconds: com upsert a ingestão pode ser refeita sem
+    #   duplicar nada e o job volta para a fila (até max_attempts vezes); sem upsert, falha.
+    # - "queued" há mais de stale_seconds: é entregue de novo ao pool deste processo. Se o job
+    #   original ainda estiver na fila de outro processo, só um dos dois o reivindica.
+    # Retorna as contagens {"requeued", "failed"}.
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=stale_seconds)
+    counts = {"requeued": 0, "failed": 0}
+
+    for job in collection_jobs.find({"status": JOB_RUNNING, "heartbeat_at": {"$lt": cutoff}}):
+        if not job.get("upsert", INGEST_UPSERT) or job.get("attempts", 1) >= max_attempts:
+            counts["failed"] += _fail_job(collection_jobs, job["_id"],
+                                          f"Job interrompido: sem sinal do processo há mais de {stale_seconds} s",
+                                          statuses=(JOB_RUNNING,))
+            continue
+        collection_jobs.update_one({"_id": job["_id"], "status": JOB_RUNNING, "heartbeat_at": job["heartbeat_at"]},
+                                   {"$set": {"status": JOB_QUEUED, "queued_at": cutoff}})
+
+    while True:
+        # Reivindica um job parado na fila renovando queued_at: outro processo não o pega de novo
+        job = collection_jobs.find_one_and_update(
+            {"status": JOB_QUEUED, "queued_at": {"$lte": cutoff}},
+            {"$set": {"queued_at": datetime.now(timezone.utc)}}, return_document=ReturnDocument.AFTER)
+        if job is None:
+            break
+        if "json_file" not in job:
+            # Job de antes do registro dos caminhos de saída: não dá para refazer
+            counts["failed"] += _fail_job(collection_jobs, job["_id"], "Job interrompido antes de executar",
+                                          statuses=(JOB_QUEUED,))
+            continue
+        _submit(collection_jobs, str(job["_id"]), job)
+        counts["requeued"] += 1
+    return counts
+
+
+def get_job(collection_jobs, job_id):
+    # Retorna o documento do job pronto para JSON, ou None se não existir.
+    try:
+        job = collection_jobs.find_one({"_id": ObjectId(job_id)})
+    except InvalidId:
+        return None
+    if job is not None:
+        job["_id"] = str(job["_id"])
+    return job
+
+
+def run_ingest_job(job_id, camera, txt_file_path, json_file_path, csv_file_path, datetime_points,
+                   upsert=False):
+    # Executado dentro do pool: reivindica o job, roda a ingestão em streaming e publica o progresso.
+    from app.cache import record_invalidation
+    from app.ingest import store_trajectories_streaming
+    from app.parsing import iter_txt_trajectories
+
+    db = _get_worker_db()
+    collection_jobs = db[COLLECTION_JOBS]
+    started_at = datetime.now(timezone.utc)
+
+    # Só um processo consegue passar o job de "queued" para "running"
+    claimed = collection_jobs.find_one_and_update(
+        {"_id": ObjectId(job_id), "status": JOB_QUEUED},
+        {"$set": {"status": JOB_RUNNING, "started_at": started_at, "heartbeat_at": started_at},
+         "$inc": {"attempts": 1}},
+        return_document=ReturnDocument.AFTER)
+    if claimed is None:
+        return
+
+    # Heartbeat independente do ritmo dos lotes: recover_stale_jobs só considera órfão o job
+    # cujo processo parou de dar sinal
+    stop_heartbeat = threading.Event()
+
+    def heartbeat():
+        while not stop_heartbeat.wait(INGEST_JOB_HEARTBEAT_SECONDS):
+            try:
+                collection_jobs.update_one({"_id": ObjectId(job_id), "status": JOB_RUNNING},
+                                           {"$set": {"heartbeat_at": datetime.now(timezone.utc)}})
+            except PyMongoError as e:
+                logger.warning(f"Falha no heartbeat do job {job_id}: {e}")
+
+    threading.Thread(target=heartbeat, name=f'job-heartbeat-{job_id}', daemon=True).start()
+    clock = time.perf_counter()
+
+    def progress_fields(stats):
+        elapsed = time.perf_counter() - clock
+        return {
+            "progress.trajectories_read": stats["read"],
+            "progress.trajectories_inserted": stats["inserted"],
+            "progress.trajectories_updated": stats["updated"],
+            "progress.trajectories_skipped": stats["skipped"],
+            "progress.read_per_second": stats["read"] / elapsed if elapsed else 0.0,
+            "progress.trajectories_per_second": stats["trajectories"] / elapsed if elapsed else 0.0,
+            "progress.elapsed_seconds": elapsed
+        }
+
+    def report(stats):
+        collection_jobs.update_one({"_id": ObjectId(job_id)}, {"$set": progress_fields(stats)})
+
+    try:
+        stats = store_trajectories_streaming(
+            iter_txt_trajectories(txt_file_path, datetime_input=datetime_points),
+            db[COLLECTION_TRAJ], camera, json_file_path, csv_file_path,
+            datetime_points=datetime_points, layout=POINTS_STORAGE, batch_size=INGEST_BATCH_SIZE,
+            on_progress=report, rollups=make_rollup_store(db[COLLECTION_ROLLUPS]),
+            upsert=upsert, merge_gap=INGEST_MERGE_GAP_SECONDS)
+    except Exception as e:
+        logger.error(f"Erro no job de ingestão {job_id}: {str(e)}")
+        collection_jobs.update_one({"_id": ObjectId(job_id)}, {"$set": {
+            "status": JOB_FAILED, "error": str(e), "finished_at": datetime.now(timezone.utc)}})
+        return
+    finally:
+        stop_heartbeat.set()
+
+    # Avisa os processos web para descartarem as respostas em cache afetadas pelo upload
+    if stats["trajectories"]:
+        record_invalidation(db[COLLECTION_CACHE_EVENTS], camera, stats["start"], stats["end"])
+
+    update = progress_fields(stats)
+    update.update({"status": JOB_DONE, "finished_at": datetime.now(timezone.utc)})
+    collection_jobs.update_one({"_id": ObjectId(job_id)}, {"$set": update})
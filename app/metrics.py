@@ -0,0 +1,270 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+# Instrumentação por requisição: cada etapa do caminho crítico (busca no MongoDB, decodificação dos
+# pontos, montagem do TrajectoryCollection, análise, savefig, codificação da resposta) soma o seu
+# tempo na requisição corrente. No fim da requisição os tempos vão para o cabeçalho Server-Timing e
+# para os contadores/histogramas expostos em /metrics no formato texto do Prometheus.
+#
+# Os tempos das etapas são exclusivos: uma etapa aninhada (ex.: "mongo" dentro de "decode") é
+# descontada da etapa de fora, então a soma das etapas nunca passa do total da requisição.
+# Fora de uma requisição (CLI, jobs, benchmarks) stage() e timed_iter() não medem nada.
+#
+# Cada processo do gunicorn tem os seus próprios contadores: o Prometheus deve coletar cada
+# processo (ou somar as séries pelo rótulo instance).
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_local = threading.local()
+
+
+class RequestTimings:
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = defaultdict(float)
+        self.bytes = defaultdict(int)
+        # Tempo já atribuído a etapas aninhadas, um acumulador por etapa aberta
+        self._children = []
+
+    def open(self):
+        self._children.append(0.0)
+        return time.perf_counter()
+
+    def close(self, name, started):
+        elapsed = time.perf_counter() - started
+        self.stages[name] += elapsed - self._children.pop()
+        if self._children:
+            self._children[-1] += elapsed
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def begin_request():
+    _local.timings = RequestTimings()
+    return _local.timings
+
+
+def end_request():
+    timings = getattr(_local, 'timings', None)
+    _local.timings = None
+    return timings
+
+
+def current_timings():
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def stage(name):
+    timings = current_timings()
+    if timings is None:
+        yield
+        return
+    started = timings.open()
+    try:
+        yield
+    finally:
+        timings.close(name, started)
+
+
+def timed_iter(iterable, name):
+    # Itera medindo só a espera por cada item (ex.: lotes do cursor do MongoDB)
+    timings = current_timings()
+    if timings is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        started = timings.open()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            timings.close(name, started)
+            return
+        timings.close(name, started)
+        yield item
+
+
+def record_bytes(name, size):
+    timings = current_timings()
+    if timings is not None:
+        timings.bytes[name] += size
+
+
+def server_timing_header(timings, total):
+    # Ex.: "mongo;dur=12.4, decode;dur=3.1, total;dur=18.0" (milissegundos)
+    parts = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.stages.items()]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(parts)
+
+
+def _labels(labels):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in labels) + '}' if labels else ''
+
+
+def _number(value):
+    # Valor completo: inteiros sem expoente e floats com todos os dígitos (repr). Com "g" um
+    # contador passa a 1.23457e+06 depois de 10⁶ e o rate() do Prometheus anda em degraus.
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class MetricsRegistry:
+    # Contadores e histogramas em memória, exportados no formato texto do Prometheus.
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = defaultdict(float)
+        self._histograms = {}
+
+    def describe(self, name, kind, help_text):
+        self._help[name] = (kind, help_text)
+
+    def inc(self, name, labels=(), value=1):
+        with self._lock:
+            self._counters[(name, tuple(labels))] += value
+
+    def observe(self, name, labels=(), value=0.0):
+        key = (name, tuple(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(counts), total, count) for key, (counts, total, count)
+                          in self._histograms.items()}
+
+        lines = []
+        for name, (kind, help_text) in self._help.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == 'counter':
+                for (metric, labels), value in counters.items():
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {_number(value)}")
+                continue
+            for (metric, labels), (counts, total, count) in histograms.items():
+                if metric != name:
+                    continue
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', f'{bound:g}'),))} {bucket_count}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    # Amostra a pilha de uma thread a cada interval segundos (sys._current_frames) e conta as pilhas
+    # no formato "collapsed" (uma linha "raiz;...;folha contagem"), lido por flamegraph.pl e speedscope.
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def install_request_metrics(app, registry, server_timing=True, profile_dir=None, profile_interval=0.005):
+    # Registra os hooks do Flask que abrem/fecham a medição de cada requisição.
+    # Com profile_dir, requisições com profile=1 são amostradas e a pilha vai para um arquivo
+    # .folded nesse diretório (nome no cabeçalho X-Profile).
+    from flask import request
+
+    registry.describe('trajectories_http_requests_total', 'counter', 'Requisições atendidas')
+    registry.describe('trajectories_http_request_duration_seconds', 'histogram', 'Tempo total da requisição')
+    registry.describe('trajectories_request_stage_seconds', 'histogram', 'Tempo de cada etapa da requisição')
+    registry.describe('trajectories_request_stage_bytes_total', 'counter', 'Bytes produzidos por etapa')
+    registry.describe('trajectories_response_bytes_total', 'counter', 'Bytes enviados no corpo das respostas')
+
+    @app.before_request
+    def _start_request_timing():
+        timings = begin_request()
+        if profile_dir and request.values.get('profile') == '1':
+            timings.profiler = SamplingProfiler(threading.get_ident(), profile_interval).start()
+
+    @app.after_request
+    def _finish_request_timing(response):
+        timings = end_request()
+        if timings is None:
+            return response
+        total = timings.elapsed()
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+        registry.inc('trajectories_http_requests_total',
+                     (('route', route), ('method', request.method), ('status', response.status_code)))
+        registry.observe('trajectories_http_request_duration_seconds', (('route', route),), total)
+        for name, seconds in timings.stages.items():
+            registry.observe('trajectories_request_stage_seconds', (('route', route), ('stage', name)), seconds)
+        for name, size in timings.bytes.items():
+            registry.inc('trajectories_request_stage_bytes_total', (('route', route), ('stage', name)), size)
+        if not response.is_streamed:
+            registry.inc('trajectories_response_bytes_total', (('route', route),),
+                         response.calculate_content_length() or 0)
+
+        if server_timing:
+            response.headers['Server-Timing'] = server_timing_header(timings, total)
+
+        profiler = getattr(timings, 'profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            os.makedirs(profile_dir, exist_ok=True)
+            filename = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{route.strip('/').replace('/', '_') or 'root'}.folded"
+            profiler.write(os.path.join(profile_dir, filename))
+            response.headers['X-Profile'] = filename
+        return response
+
+    @app.teardown_request
+    def _discard_request_timing(error):
+        # Requisição que terminou em exceção não tratada: after_request não roda
+        timings = end_request()
+        if timings is not None:
+            profiler = getattr(timings, 'profiler', None)
+            if profiler is not None:
+                profiler.stop()
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            registry.inc('trajectories_http_requests_total', (('route', route), ('method', request.method),
+                                                              ('status', 500)))
@@ -0,0 +1,218 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Parser dos arquivos TXT do rastreador. Módulo leve (só NumPy; pandas apenas para datas e CSV) para
+# que os processos do pool de parsing não precisem importar geopandas, movingpandas ou pymongo.
+
+_POINT_PUNCTUATION = str.maketrans('[]()', '    ')
+_executor = None
+
+
+def _parse_txt_time(value, datetime_input):
+    # Início/fim da trajetória: epoch seconds ou "AAAA-MM-DD HH:MM:SS.ffffff" (tratado como UTC).
+    if datetime_input:
+        return datetime.fromisoformat(value.strip()).replace(tzinfo=timezone.utc).timestamp()
+    return float(value)
+
+
+def parse_txt_line(line, datetime_input=False):
+    # Linha do rastreador: "id, categoria, início, fim, [(x, y), (x, y), ...]".
+    # Os instantes dos pontos são distribuídos uniformemente a partir do início, como em txt_to_csv.
+    header, bracket, points = line.partition('[')
+    fields = header.split(',')
+    if not bracket or len(fields) < 5:
+        raise ValueError(f"Linha fora do formato esperado: {line[:80]!r}")
+
+    coords = np.fromstring(points.translate(_POINT_PUNCTUATION), sep=',')
+    if coords.size % 2:
+        raise ValueError(f"Lista de pontos incompleta: {line[:80]!r}")
+    x, y = coords[0::2], coords[1::2]
+
+    start = _parse_txt_time(fields[2], datetime_input)
+    end = _parse_txt_time(fields[3], datetime_input)
+    t = start + np.arange(x.size) * ((end - start) / max(x.size, 1))
+    return float(fields[0]), float(fields[1]), t, x, y
+
+
+def iter_txt_trajectories(txt_file_path, datetime_input=False):
+    # Lê o TXT linha a linha: uma trajetória por vez, sem carregar o arquivo inteiro.
+    with open(txt_file_path, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield parse_txt_line(line, datetime_input)
+            except ValueError as e:
+                raise ValueError(f"Linha {line_number}: {e}") from e
+
+
+def _empty_arrays():
+    return {
+        'identifier': np.empty(0), 'category': np.empty(0), 'counts': np.empty(0, dtype=np.int64),
+        't': np.empty(0), 'x': np.empty(0), 'y': np.empty(0)
+    }
+
+
+def parse_txt_lines(lines, datetime_input=False):
+    # Converte um bloco de linhas em arrays colunares de uma só vez.
+    # Caminho rápido: todas as listas de pontos do bloco viram uma única string numérica
+    # lida por np.fromstring, sem tratar tupla a tupla em Python.
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        return _empty_arrays()
+
+    headers, point_lists = [], []
+    for line in lines:
+        header, _, points = line.partition('[')
+        headers.append(header.split(',', 4))
+        point_lists.append(points)
+
+    counts = np.fromiter((points.count('(') for points in point_lists), dtype=np.int64, count=len(lines))
+    coords = np.fromstring(','.join(point_lists).translate(_POINT_PUNCTUATION), sep=',')
+    if coords.size != 2 * counts.sum() or any(len(fields) < 5 for fields in headers):
+        # Algo fora do padrão: refaz linha a linha para apontar o erro
+        return arrays_from_trajectories(parse_txt_line(line, datetime_input) for line in lines)
+
+    fields = np.char.strip(np.array([fields[:4] for fields in headers]))
+    if datetime_input:
+        import pandas as pd
+        bounds = pd.to_datetime(fields[:, 2:4].ravel(), format='ISO8601').asi8.reshape(-1, 2) / 1e9
+        start, end = bounds[:, 0], bounds[:, 1]
+    else:
+        start, end = fields[:, 2].astype(np.float64), fields[:, 3].astype(np.float64)
+
+    # Índice de cada ponto dentro da sua trajetória e passo de tempo de cada trajetória
+    offsets = np.cumsum(counts) - counts
+    local_index = np.arange(counts.sum()) - np.repeat(offsets, counts)
+    step = (end - start) / np.maximum(counts, 1)
+    t = np.repeat(start, counts) + local_index * np.repeat(step, counts)
+
+    return {
+        'identifier': fields[:, 0].astype(np.float64),
+        'category': fields[:, 1].astype(np.float64),
+        'counts': counts,
+        't': t,
+        'x': coords[0::2],
+        'y': coords[1::2]
+    }
+
+
+def arrays_from_trajectories(trajectories):
+    # Arrays colunares a partir de tuplas (identifier, category, t, x, y).
+    identifiers, categories, counts, ts, xs, ys = [], [], [], [], [], []
+    for identifier, category, t, x, y in trajectories:
+        identifiers.append(identifier)
+        categories.append(category)
+        counts.append(t.size)
+        ts.append(t)
+        xs.append(x)
+        ys.append(y)
+    if not identifiers:
+        return _empty_arrays()
+    return {
+        'identifier': np.asarray(identifiers, dtype=np.float64),
+        'category': np.asarray(categories, dtype=np.float64),
+        'counts': np.asarray(counts, dtype=np.int64),
+        't': np.concatenate(ts), 'x': np.concatenate(xs), 'y': np.concatenate(ys)
+    }
+
+
+def _parse_txt_chunk(txt_file_path, start, end, datetime_input):
+    # Executado no pool: lê apenas o intervalo de bytes [start, end) do arquivo.
+    with open(txt_file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return parse_txt_lines(data.decode('utf-8').splitlines(), datetime_input)
+
+
+def _chunk_bounds(txt_file_path, n_chunks):
+    # Divide o arquivo em intervalos de bytes alinhados ao fim de linha.
+    size = os.path.getsize(txt_file_path)
+    bounds = [0]
+    with open(txt_file_path, 'rb') as f:
+        for i in range(1, n_chunks):
+            f.seek(max(size * i // n_chunks, bounds[-1]))
+            f.readline()
+            position = min(f.tell(), size)
+            if position > bounds[-1]:
+                bounds.append(position)
+    if bounds[-1] < size:
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def merge_arrays(parts):
+    # Junta os arrays dos blocos, na ordem do arquivo.
+    parts = [part for part in parts if part['counts'].size]
+    if not parts:
+        return _empty_arrays()
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+
+
+def _get_executor(workers):
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+    return _executor
+
+
+def parse_txt_file(txt_file_path, datetime_input=False, workers=None, min_parallel_bytes=8 * 1024 * 1024):
+    # Lê o TXT inteiro em arrays colunares (identifier, category, counts por trajetória; t, x, y por ponto).
+    # Arquivos grandes são divididos em blocos de linhas e processados em paralelo no pool.
+    workers = workers or os.cpu_count() or 1
+    if workers < 2 or os.path.getsize(txt_file_path) < min_parallel_bytes:
+        with open(txt_file_path, 'r') as f:
+            return parse_txt_lines(f.read().splitlines(), datetime_input)
+
+    executor = _get_executor(workers)
+    futures = [executor.submit(_parse_txt_chunk, txt_file_path, start, end, datetime_input)
+               for start, end in _chunk_bounds(txt_file_path, workers * 4)]
+    return merge_arrays([future.result() for future in futures])
+
+
+def group_by_identifier(arrays):
+    # Junta linhas repetidas de um mesmo identificador numa só trajetória ordenada por tempo e
+    # ordena as trajetórias por identificador, como o TrajectoryCollection faz ao agrupar por 'identifier'.
+    point_identifiers = np.repeat(arrays['identifier'], arrays['counts'])
+    point_categories = np.repeat(arrays['category'], arrays['counts'])
+    order = np.lexsort((arrays['t'], point_identifiers))
+    unique_identifiers, first, counts = np.unique(point_identifiers[order], return_index=True,
+                                                  return_counts=True)
+    return {
+        'identifier': unique_identifiers,
+        'category': point_categories[order][first],
+        'counts': counts.astype(np.int64),
+        't': arrays['t'][order],
+        'x': arrays['x'][order],
+        'y': arrays['y'][order]
+    }
+
+
+def iter_trajectory_arrays(arrays):
+    # Percorre os arrays colunares uma trajetória por vez: (identifier, category, t, x, y).
+    bounds = np.concatenate([[0], np.cumsum(arrays['counts'])])
+    for i, (start, end) in enumerate(zip(bounds[:-1].tolist(), bounds[1:].tolist())):
+        yield (arrays['identifier'][i].item(), arrays['category'][i].item(),
+               arrays['t'][start:end], arrays['x'][start:end], arrays['y'][start:end])
+
+
+def write_csv(arrays, csv_file_path):
+    # Grava o CSV no formato de txt_to_csv (identifier, category, timestamp, x, y): identifier e
+    # category como float (1.0), timestamp em epoch e x/y inteiros quando inteiros.
+    import pandas as pd
+    counts = arrays['counts']
+    df = pd.DataFrame({
+        'identifier': np.repeat(arrays['identifier'], counts),
+        'category': np.repeat(arrays['category'], counts),
+        'timestamp': arrays['t'],
+        'x': arrays['x'],
+        'y': arrays['y']
+    })
+    for column in ('x', 'y'):
+        if np.array_equal(df[column], np.round(df[column])):
+            df[column] = df[column].astype(np.int64)
+    df.to_csv(csv_file_path, index=False)
@@ -0,0 +1,34 @@
+import gc
+import importlib
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bibliotecas pesadas que a aplicação importa sob demanda (nas funções que as usam), na ordem de
+# dependência. preload_modules() as importa de uma vez: usado no master do gunicorn (GUNICORN_PRELOAD)
+# e por benchmarks/bench_startup.py para medir o custo de cada uma.
+HEAVY_MODULES = ('numpy', 'pandas', 'shapely', 'matplotlib', 'matplotlib.pyplot', 'geopandas', 'movingpandas',
+                 'smart_traject.smart_trajectories.plot')
+
+
+def preload_modules(modules=HEAVY_MODULES, freeze=False):
+    # Importa os módulos e retorna o tempo de import de cada um (s); os que faltam são só registrados.
+    # Com freeze=True, move os objetos já criados para a geração permanente do GC: as coletas dos
+    # processos filhos não escrevem nesses objetos e as páginas continuam compartilhadas após o fork.
+    timings = {}
+    for name in modules:
+        start = time.perf_counter()
+        try:
+            module = importlib.import_module(name)
+        except ImportError as e:
+            logger.warning(f"Pré-carregamento de {name} falhou: {e}")
+            continue
+        if name == 'matplotlib':
+            # Backend definido antes do pyplot, como em run._pyplot
+            module.use('Agg')
+        timings[name] = time.perf_counter() - start
+    if freeze:
+        gc.collect()
+        gc.freeze()
+    return timings
@@ -0,0 +1,84 @@
+import io
+
+import numpy as np
+
+from app.analytics import group_points
+
+# Resolução e nível de detalhe dos plots.
+# O front-end exibe a imagem com xsize * 37.8 px de largura (xsize em cm, 96 ppi); renderizar
+# acima disso (vezes a densidade de pixels da tela) só gasta CPU e bytes de PNG.
+PIXELS_PER_CM = 37.8
+
+
+def target_pixels(plot_params, pixel_ratio=2.0):
+    # Tamanho (largura, altura) em pixels da imagem que o navegador vai mostrar.
+    return (max(1, int(round(plot_params['xsize'] * PIXELS_PER_CM * pixel_ratio))),
+            max(1, int(round(plot_params['ysize'] * PIXELS_PER_CM * pixel_ratio))))
+
+
+def render_dpi(figure_width_inches, plot_params, pixel_ratio=2.0, min_dpi=72, max_dpi=300):
+    # DPI que faz a figura sair com a largura exibida, limitado a [min_dpi, max_dpi].
+    width_px, _ = target_pixels(plot_params, pixel_ratio)
+    return float(np.clip(width_px / figure_width_inches, min_dpi, max_dpi))
+
+
+def decimate_to_pixels(arrays, plot_params, pixel_ratio=2.0):
+    # Nível de detalhe: mantém só o primeiro ponto de cada sequência que cai na mesma célula
+    # de pixel da imagem final, além do primeiro e do último ponto de cada trajetória.
+    # Numa trajetória que anda menos de um pixel entre amostras, o desenho não muda.
+    points, starts, counts = group_points(arrays)
+    if counts.size == 0:
+        return points
+    width_px, height_px = target_pixels(plot_params, pixel_ratio)
+    cell_w = max(plot_params['max_x'] - plot_params['min_x'], 1e-9) / width_px
+    cell_h = max(plot_params['max_y'] - plot_params['min_y'], 1e-9) / height_px
+    cx = np.floor((points['x'] - plot_params['min_x']) / cell_w)
+    cy = np.floor((points['y'] - plot_params['min_y']) / cell_h)
+
+    keep = np.ones(cx.size, dtype=bool)
+    keep[1:] = (cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1])
+    keep[starts] = True
+    keep[starts + counts - 1] = True
+    return {column: values[keep] for column, values in points.items()}
+
+
+def _trajectory_segments(arrays):
+    # Polilinhas de cada trajetória (lista de arrays N x 2) e a categoria de cada uma
+    points, starts, counts = group_points(arrays)
+    xy = np.column_stack([points['x'], points['y']])
+    return np.split(xy, starts[1:]), points['category'][starts]
+
+
+def render_trajectories(arrays, background, plot_params, image_format='png', pixel_ratio=2.0,
+                        min_dpi=72, max_dpi=300, level_of_detail=True):
+    # Renderizador próprio (API orientada a objetos, sem pyplot): fundo da câmera e todas as
+    # trajetórias num único LineCollection, cor por categoria. Retorna os bytes da imagem.
+    # Com level_of_detail, só os segmentos desenhados são reduzidos à resolução da imagem; as
+    # métricas são calculadas à parte, sobre os arrays completos.
+    # matplotlib importado só no primeiro plot (o boot do processo web não paga por ele)
+    from matplotlib import colormaps
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(plot_params['xsize'] / 2.54, plot_params['ysize'] / 2.54))
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot()
+
+    extent = [plot_params['xlim1'], plot_params['xlim2'], plot_params['ylim1'], plot_params['ylim2']]
+    if background is not None:
+        ax.imshow(background, extent=extent)
+
+    if level_of_detail:
+        arrays = decimate_to_pixels(arrays, plot_params, pixel_ratio)
+    segments, categories = _trajectory_segments(arrays)
+    palette = colormaps['tab10']
+    _, color_index = np.unique(categories, return_inverse=True)
+    ax.add_collection(LineCollection(segments, colors=palette(color_index % palette.N), linewidths=0.8))
+    ax.set_xlim(extent[0], extent[1])
+    ax.set_ylim(extent[2], extent[3])
+
+    dpi = render_dpi(figure.get_figwidth(), plot_params, pixel_ratio, min_dpi, max_dpi)
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format=image_format, bbox_inches='tight', dpi=dpi)
+    return buffer.getvalue()
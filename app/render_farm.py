@@ -0,0 +1,329 @@
+import io
+import multiprocessing
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Pool de processos dedicado à renderização dos plots: o renderizador próprio (render) e as funções
+# de plot da smart_traject (render_library). Cada processo já sobe com matplotlib, backend Agg e
+# fontes carregados e atende um job por vez, então o pyplot global da biblioteca não precisa de lock
+# e os plots de processos diferentes rodam em paralelo, fora do GIL do processo web. Os pontos vão
+# para o processo por memória compartilhada (um bloco float64 com as 5 colunas), sem serializar os
+# arrays; a imagem de fundo do renderizador próprio é decodificada e mantida em cache em cada processo.
+# A fila é limitada: com max_pending jobs em andamento, novos pedidos esperam até queue_timeout
+# segundos por uma vaga e depois recebem RenderFarmBusy. Cada job tem no máximo timeout segundos,
+# contando a espera por um processo livre: passado o limite, o processo que o executa é encerrado
+# (terminate) e substituído, e a vaga e o bloco de memória são liberados na hora.
+COLUMNS = ('identifier', 'category', 'timestamp', 'x', 'y')
+
+
+class RenderFarmBusy(Exception):
+    pass
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+# --- processo de renderização ---
+
+_backgrounds = OrderedDict()
+_MAX_BACKGROUNDS = 8
+
+
+def _warm_worker():
+    # Inicialização de cada processo: carrega o Agg e o cache de fontes renderizando uma figura vazia
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(1, 1))
+    FigureCanvasAgg(figure)
+    figure.add_subplot().set_title('warm-up')
+    figure.savefig(io.BytesIO(), format='png')
+
+
+def _worker_background(image_path, image_mtime, max_side):
+    from app.cameras import decode_background
+    if image_path is None:
+        return None
+    key = (image_path, image_mtime, max_side)
+    image = _backgrounds.get(key)
+    if image is None:
+        image = decode_background(image_path, max_side)
+        _backgrounds[key] = image
+        while len(_backgrounds) > _MAX_BACKGROUNDS:
+            _backgrounds.popitem(last=False)
+    else:
+        _backgrounds.move_to_end(key)
+    return image
+
+
+def _render_job(shm_name, n_points, dtypes, image_path, image_mtime, max_side, plot_params, image_format,
+                pixel_ratio, min_dpi, max_dpi, level_of_detail):
+    from app.render import render_trajectories
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        block = np.ndarray((len(COLUMNS), n_points), dtype=np.float64, buffer=shm.buf)
+        arrays = {column: block[i] for i, column in enumerate(COLUMNS)}
+        image = render_trajectories(arrays, _worker_background(image_path, image_mtime, max_side), plot_params,
+                                    image_format, pixel_ratio, min_dpi, max_dpi, level_of_detail)
+        # As views precisam sair de escopo antes de fechar o bloco
+        del arrays, block
+    finally:
+        shm.close()
+    return image
+
+
+def _library_job(shm_name, n_points, dtypes, plot_name, p_args, kw_args, image_format, pixel_ratio,
+                 min_dpi, max_dpi):
+    # Função de plot da smart_traject sobre o TrajectoryCollection montado dos pontos compartilhados.
+    # Devolve (bytes da imagem, resumo da biblioteca); sem image_format, só o resumo (metrics_only=1).
+    import importlib
+    import matplotlib.pyplot as plt
+    from app.render import render_dpi
+    from app.utils import trajectory_collection_from_arrays
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        block = np.ndarray((len(COLUMNS), n_points), dtype=np.float64, buffer=shm.buf)
+        # Cópias com os tipos originais: o TrajectoryCollection não pode guardar views do bloco, e
+        # identifier/category voltam como no processo web (a biblioteca usa os valores nas chaves)
+        arrays = {column: block[i].astype(dtypes[column]) for i, column in enumerate(COLUMNS)}
+        del block
+    finally:
+        shm.close()
+
+    plot_function = getattr(importlib.import_module('smart_traject.smart_trajectories.plot'), plot_name)
+    result = plot_function(trajectory_collection_from_arrays(arrays), *p_args, **kw_args)
+    figure = plt.gcf()
+    plt.close(figure)
+    if image_format is None:
+        return None, result
+    buffer = io.BytesIO()
+    dpi = render_dpi(figure.get_figwidth(), kw_args, pixel_ratio, min_dpi, max_dpi)
+    figure.savefig(buffer, format=image_format, bbox_inches='tight', dpi=dpi)
+    return buffer.getvalue(), result
+
+
+def shareable(arrays):
+    # Só colunas numéricas cabem no bloco float64 (identificadores em texto ficam no processo web)
+    return all(arrays[column].dtype.kind in 'biuf' for column in COLUMNS)
+
+
+def _worker_main(connection):
+    # Laço de cada processo de renderização: um job (função, argumentos) por vez pelo pipe
+    _warm_worker()
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        job, args = message
+        try:
+            reply = (True, job(*args))
+        except Exception as e:
+            reply = (False, e)
+        try:
+            connection.send(reply)
+        except Exception as e:
+            # Resultado ou exceção que não passa pelo pickle
+            connection.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+
+
+# --- processo web ---
+
+class RenderWorkerDied(Exception):
+    pass
+
+
+class _Worker:
+    # Processo de renderização com o seu pipe; encerrado individualmente no tempo limite
+
+    def __init__(self, context):
+        self.connection, child = context.Pipe()
+        # "spawn": o processo não herda clientes MongoDB nem threads do processo web
+        self.process = context.Process(target=_worker_main, args=(child,), name='render-worker', daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self, graceful=False):
+        if graceful:
+            try:
+                self.connection.send(None)
+            except OSError:
+                pass
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class RenderFarm:
+
+    def __init__(self, workers=2, max_pending=8, timeout=120.0, queue_timeout=5.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.Lock()
+        # Processos livres e total de processos vivos (livres + ocupados), sob o mesmo lock
+        self._available = threading.Condition(self._lock)
+        self._idle = []
+        self._alive = 0
+        self._closed = False
+        self._stats = {"rendered": 0, "rejected": 0, "timeouts": 0, "failed": 0, "pending": 0, "recycled": 0}
+
+    def start(self):
+        # Sobe todos os processos de uma vez (chamado em segundo plano na inicialização); cada um
+        # se aquece sozinho antes de ler o primeiro job
+        with self._lock:
+            missing = self.workers - self._alive
+            self._alive += missing
+        started = []
+        try:
+            for _ in range(missing):
+                started.append(_Worker(self._context))
+        finally:
+            for worker in started:
+                self._return_worker(worker)
+            if len(started) < missing:
+                with self._available:
+                    self._alive -= missing - len(started)
+                    self._available.notify_all()
+
+    def _acquire_worker(self, deadline):
+        # Processo livre, ou um novo se houver menos de workers vivos; espera no máximo até deadline
+        with self._available:
+            while not self._idle and self._alive >= self.workers:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._available.wait(remaining):
+                    if self._idle or self._alive < self.workers:
+                        break
+                    raise RenderTimeout(f"Nenhum processo de renderização livre em {self.timeout} s")
+            if self._idle:
+                return self._idle.pop()
+            self._alive += 1
+        try:
+            return _Worker(self._context)
+        except Exception:
+            with self._available:
+                self._alive -= 1
+                self._available.notify()
+            raise
+
+    def _return_worker(self, worker):
+        with self._available:
+            if not self._closed:
+                self._idle.append(worker)
+                self._available.notify()
+                return
+            self._alive -= 1
+        worker.stop(graceful=True)
+
+    def _discard_worker(self, worker):
+        # Processo travado ou morto: encerra e libera o lugar para um novo
+        worker.stop()
+        with self._available:
+            self._alive -= 1
+            self._stats["recycled"] += 1
+            self._available.notify()
+
+    def render(self, arrays, image_path, image_mtime, plot_params, image_format='png', max_side=0,
+               pixel_ratio=2.0, min_dpi=72, max_dpi=300, level_of_detail=True):
+        # Renderiza no pool e devolve os bytes da imagem (mesmos parâmetros de render_trajectories).
+        return self._run(_render_job, arrays, image_path, image_mtime, max_side, plot_params, image_format,
+                         pixel_ratio, min_dpi, max_dpi, level_of_detail)
+
+    def render_library(self, plot_name, arrays, p_args, kw_args, image_format='png', pixel_ratio=2.0,
+                       min_dpi=72, max_dpi=300):
+        # Chama plot_name(TrajectoryCollection dos arrays, *p_args, **kw_args) no pool e devolve
+        # (bytes da imagem, resumo da biblioteca). image_format=None: só o resumo, sem savefig.
+        return self._run(_library_job, arrays, plot_name, p_args, kw_args, image_format, pixel_ratio,
+                         min_dpi, max_dpi)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _run(self, job, arrays, *job_args):
+        # Copia os pontos para um bloco compartilhado e executa job(nome do bloco, n_points, dtypes, *job_args)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._count("rejected")
+            raise RenderFarmBusy(f"{self.max_pending} renderizações já em andamento")
+        deadline = time.monotonic() + self.timeout
+        with self._lock:
+            self._stats["pending"] += 1
+
+        shm = None
+        try:
+            n_points = arrays['timestamp'].size
+            shm = shared_memory.SharedMemory(create=True, size=max(1, len(COLUMNS) * n_points * 8))
+            block = np.ndarray((len(COLUMNS), n_points), dtype=np.float64, buffer=shm.buf)
+            for i, column in enumerate(COLUMNS):
+                block[i] = arrays[column]
+            del block
+            dtypes = {column: arrays[column].dtype.str for column in COLUMNS}
+
+            try:
+                worker = self._acquire_worker(deadline)
+            except RenderTimeout:
+                self._count("timeouts")
+                raise
+            try:
+                worker.connection.send((job, (shm.name, n_points, dtypes) + job_args))
+                finished = worker.connection.poll(max(0.0, deadline - time.monotonic()))
+                if finished:
+                    ok, result = worker.connection.recv()
+            except (EOFError, OSError):
+                self._discard_worker(worker)
+                self._count("failed")
+                raise RenderWorkerDied("O processo de renderização terminou durante o job")
+            if not finished:
+                # O job continua rodando no processo: só encerrando o processo a vaga fica livre de fato
+                self._discard_worker(worker)
+                self._count("timeouts")
+                raise RenderTimeout(f"Renderização excedeu {self.timeout} s")
+            self._return_worker(worker)
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            with self._lock:
+                self._stats["pending"] -= 1
+            self._slots.release()
+
+        if not ok:
+            self._count("failed")
+            raise result
+        self._count("rendered")
+        return result
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["alive"] = self._alive
+        stats.update({"workers": self.workers, "max_pending": self.max_pending})
+        return stats
+
+    def shutdown(self):
+        # Encerra os processos livres; os ocupados são encerrados ao terminar o job em andamento
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._alive -= len(idle)
+        for worker in idle:
+            worker.stop(graceful=True)
@@ -0,0 +1,239 @@
+import math
+from datetime import datetime, timezone
+
+import numpy as np
+from pymongo import UpdateOne
+
+from app.parsing import arrays_from_trajectories, group_by_identifier
+from app.storage import document_points
+
+# Agregados pré-calculados na ingestão, por câmera, categoria e intervalo de tempo:
+#   {"background", "resolution" (segundos do intervalo), "bucket" (início do intervalo, UTC),
+#    "category", "trajectories", "points",
+#    "occupancy": {"<cx>_<cy>": segundos}, "visits": {"<cx>_<cy>": trajetórias}}
+# Cada documento existe em duas resoluções (bucket_seconds e um dia) e só recebe $inc, então
+# uploads novos se somam aos agregados sem reler nada. As células do mapa de calor têm
+# cell_size pixels. Trajetórias são contadas no intervalo em que começam.
+# Paradas ficam de fora: as de app.analytics.detect_stops não foram conferidas contra as das rotas
+# /plot_with_stopped e /plot_with_stop_rec (smart_traject).
+DAY_SECONDS = 24 * 3600
+CELL_FIELDS = ('occupancy', 'visits')
+
+
+def _epoch(moment):
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def _bucket_datetime(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+
+def _unique_rows(keys, return_inverse=False):
+    # np.unique(keys, axis=0) para linhas de inteiros, codificando cada linha num único int64:
+    # ordenar int64 é muito mais rápido que ordenar as linhas como bytes.
+    low = keys.min(axis=0)
+    dims = keys.max(axis=0) - low + 1
+    codes = np.ravel_multi_index((keys - low).T, dims)
+    unique_codes, inverse = np.unique(codes, return_inverse=True)
+    unique = np.column_stack(np.unravel_index(unique_codes, dims)) + low
+    return (unique, inverse) if return_inverse else unique
+
+
+def _add(increments, resolution, keys, field, weights=None):
+    # Soma weights (ou conta linhas) por linha distinta de keys: categoria, número do intervalo
+    # (epoch // resolution) e, para os campos com subchave, cx e cy.
+    # Acumula em increments[(resolution, início do intervalo em epoch, categoria)].
+    if keys.shape[0] == 0:
+        return
+    unique, inverse = _unique_rows(keys, return_inverse=True)
+    if weights is None:
+        totals = np.bincount(inverse, minlength=unique.shape[0])
+    else:
+        totals = np.bincount(inverse, weights=weights, minlength=unique.shape[0])
+    for row, total in zip(unique.tolist(), totals.tolist()):
+        name = field if len(row) == 2 else f"{field}." + '_'.join(str(value) for value in row[2:])
+        increment = increments.setdefault((resolution, row[1] * resolution, row[0]), {})
+        increment[name] = increment.get(name, 0) + total
+
+
+class RollupStore:
+    # Mantém e consulta a coleção de agregados. As consultas combinam documentos diários para
+    # os dias inteiros do intervalo e documentos de bucket_seconds para as bordas.
+
+    def __init__(self, collection, bucket_seconds=300, cell_size=32):
+        if DAY_SECONDS % bucket_seconds:
+            raise ValueError("bucket_seconds deve dividir um dia")
+        self.collection = collection
+        self.bucket_seconds = int(bucket_seconds)
+        self.cell_size = cell_size
+
+    # --- ingestão ---
+
+    def increments(self, arrays):
+        # $inc de cada documento de agregado para os arrays do parser
+        # (identifier, category, counts por trajetória; t, x, y por ponto).
+        arrays = group_by_identifier(arrays)
+        # Trajetórias com menos de 2 pontos são descartadas, como no TrajectoryCollection
+        valid = arrays['counts'] >= 2
+        counts = arrays['counts'][valid]
+        if counts.size == 0:
+            return {}
+        point_valid = np.repeat(valid, arrays['counts'])
+        t, x, y = arrays['t'][point_valid], arrays['x'][point_valid], arrays['y'][point_valid]
+        categories = arrays['category'][valid].astype(np.int64)
+        starts = np.cumsum(counts) - counts
+        owner = np.repeat(np.arange(counts.size), counts)
+        cx = np.floor(x / self.cell_size).astype(np.int64)
+        cy = np.floor(y / self.cell_size).astype(np.int64)
+
+        # Passos dentro de cada trajetória: o tempo do passo conta na célula do ponto de partida
+        segment = np.flatnonzero(owner[:-1] == owner[1:])
+        dt = t[segment + 1] - t[segment]
+
+        increments = {}
+        for resolution in (self.bucket_seconds, DAY_SECONDS):
+            bucket = np.floor(t / resolution).astype(np.int64)
+            point_categories = categories[owner]
+            _add(increments, resolution, np.column_stack([categories, bucket[starts]]), 'trajectories')
+            _add(increments, resolution, np.column_stack([point_categories, bucket]), 'points')
+            _add(increments, resolution,
+                 np.column_stack([point_categories[segment], bucket[segment], cx[segment], cy[segment]]),
+                 'occupancy', dt)
+            # Visitas: cada trajetória conta uma vez por célula e intervalo
+            visits = _unique_rows(np.column_stack([owner, bucket, cx, cy]))
+            _add(increments, resolution, np.column_stack([categories[visits[:, 0]], visits[:, 1:]]), 'visits')
+        return increments
+
+    def update(self, camera, arrays, sign=1):
+        # Soma os agregados dos arrays aos documentos existentes (upsert). Retorna os documentos tocados.
+        # sign=-1 desconta trajetórias que vão ser substituídas (ex.: pontos mesclados na ingestão).
+        operations = [
+            UpdateOne({"background": camera, "resolution": resolution, "bucket": _bucket_datetime(bucket),
+                       "category": category},
+                      {"$inc": {name: sign * value for name, value in increment.items()},
+                       "$setOnInsert": {"cell_size": self.cell_size}},
+                      upsert=True)
+            for (resolution, bucket, category), increment in self.increments(arrays).items()
+        ]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        return len(operations)
+
+    def rebuild(self, collection_traj, camera=None, batch_size=500):
+        # Refaz os agregados a partir das trajetórias gravadas (ex.: após mudar bucket_seconds).
+        cameras = [camera] if camera else collection_traj.distinct('background')
+        updated = 0
+        for name in cameras:
+            self.collection.delete_many({"background": name})
+            batch = []
+            cursor = collection_traj.find({"background": name},
+                                          {"identifier": 1, "category": 1, "points": 1, "points_packed": 1})
+            for doc in cursor:
+                batch.append((doc['identifier'], doc['category'], *document_points(doc)))
+                if len(batch) >= batch_size:
+                    updated += self.update(name, arrays_from_trajectories(batch))
+                    batch = []
+            if batch:
+                updated += self.update(name, arrays_from_trajectories(batch))
+        return updated
+
+    # --- consulta ---
+
+    def _ranges(self, start, end, interval):
+        # Intervalos [início, fim) por resolução que cobrem [start, end) alinhado a bucket_seconds.
+        # Com interval (série temporal), só a resolução fina é usada.
+        fine = self.bucket_seconds
+        start = math.floor(start / fine) * fine
+        end = math.ceil(end / fine) * fine
+        first_day = math.ceil(start / DAY_SECONDS) * DAY_SECONDS
+        last_day = math.floor(end / DAY_SECONDS) * DAY_SECONDS
+        if interval or first_day >= last_day:
+            return start, end, [(fine, start, end)]
+        ranges = [(DAY_SECONDS, first_day, last_day)]
+        if start < first_day:
+            ranges.append((fine, start, first_day))
+        if last_day < end:
+            ranges.append((fine, last_day, end))
+        return start, end, ranges
+
+    def query(self, camera, start, end, category=None, rect=None, heatmap=False, interval=None):
+        # Métricas de [start, end) a partir dos agregados. rect: (min_x, max_x, min_y, max_y) limita
+        # ocupação e visitas às células que cruzam o retângulo (precisão de uma célula).
+        # interval: segundos (múltiplo de bucket_seconds) para devolver também a série temporal.
+        start, end, ranges = self._ranges(_epoch(start), _epoch(end), interval)
+        selector = {"background": camera, "$or": [
+            {"resolution": resolution, "bucket": {"$gte": _bucket_datetime(low), "$lt": _bucket_datetime(high)}}
+            for resolution, low, high in ranges]}
+        if category is not None:
+            selector["category"] = category
+        projection = {"_id": 0, "cell_size": 0}
+        if rect is None and not heatmap:
+            projection.update({field: 0 for field in CELL_FIELDS})
+
+        totals = {"trajectories": 0, "points": 0}
+        per_category = {}
+        cells = {field: {} for field in CELL_FIELDS}
+        series = {}
+        documents = 0
+        for doc in self.collection.find(selector, projection):
+            documents += 1
+            for field in totals:
+                totals[field] += doc.get(field, 0)
+            key = str(doc['category'])
+            per_category[key] = per_category.get(key, 0) + doc.get('trajectories', 0)
+            for field in CELL_FIELDS:
+                target = cells[field]
+                for cell, value in doc.get(field, {}).items():
+                    target[cell] = target.get(cell, 0) + value
+            if interval:
+                moment = math.floor(_epoch(doc['bucket']) / interval) * interval
+                point = series.setdefault(moment, {"trajectories": 0})
+                point["trajectories"] += doc.get('trajectories', 0)
+
+        result = {
+            'camera': camera,
+            'category': category,
+            'start': _bucket_datetime(start).isoformat(),
+            'end': _bucket_datetime(end).isoformat(),
+            'bucket_seconds': self.bucket_seconds,
+            'documents': documents,
+            'total_trajectories': totals['trajectories'],
+            'total_points': totals['points'],
+            'trajectories_per_category': per_category
+        }
+        if rect is not None:
+            result['region'] = self._region(cells, rect)
+        if heatmap:
+            result['heatmap'] = self._heatmap(cells)
+        if interval:
+            result['series'] = [dict(start=_bucket_datetime(moment).isoformat(), **point)
+                                for moment, point in sorted(series.items())]
+        return result
+
+    def _cell_bounds(self, cell):
+        cx, cy = (int(v) for v in cell.split('_'))
+        return cx * self.cell_size, cy * self.cell_size
+
+    def _region(self, cells, rect):
+        min_x, max_x, min_y, max_y = rect
+        region = {}
+        for field in CELL_FIELDS:
+            total = 0
+            for cell, value in cells[field].items():
+                x0, y0 = self._cell_bounds(cell)
+                if x0 <= max_x and x0 + self.cell_size > min_x and y0 <= max_y and y0 + self.cell_size > min_y:
+                    total += value
+            region[field] = total
+        return {'occupancy_seconds': float(region['occupancy']), 'visits': int(region['visits'])}
+
+    def _heatmap(self, cells):
+        # Células esparsas: [x, y, segundos, visitas], x/y do canto da célula em pixels
+        names = sorted(set().union(*(cells[field] for field in CELL_FIELDS)))
+        return {
+            'cell_size': self.cell_size,
+            'cells': [[*self._cell_bounds(cell), float(cells['occupancy'].get(cell, 0)),
+                       int(cells['visits'].get(cell, 0))] for cell in names]
+        }
+
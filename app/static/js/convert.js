@@ -49,6 +49,34 @@ function handleFile(file) {
     `;
 }
 
+// Consulta o status do job de ingestão até a conclusão, atualizando a barra de progresso
+async function waitForJob(statusUrl, intervalMs = 1000) {
+    while (true) {
+        const response = await fetch(statusUrl);
+        const result = await response.json();
+        const job = result.job || {};
+
+        if (!response.ok || job.status === 'failed') {
+            throw new Error(job.error || result.message || 'Falha no processamento do arquivo');
+        }
+
+        const progress = job.progress || {};
+        document.getElementById('filePreview').innerHTML = `
+            <div class="alert alert-info mt-3">
+                Processando: ${progress.trajectories_read || 0} trajetórias lidas,
+                ${progress.trajectories_inserted || 0} trajetórias salvas
+                (${(progress.read_per_second || 0).toFixed(0)} lidas/s)
+            </div>
+        `;
+
+        if (job.status === 'done') {
+            progressFill.style.width = '100%';
+            return job;
+        }
+        await new Promise(resolve => setTimeout(resolve, intervalMs));
+    }
+}
+
 // Envio do formulário
 form.addEventListener('submit', async (e) => {
     e.preventDefault();
@@ -62,6 +90,7 @@ form.addEventListener('submit', async (e) => {
     const formData = new FormData();
     formData.append('file', file);
     formData.append('camera', camera);
+    formData.append('async', '1');
     try {
         // Estado de carregamento
         submitButton.disabled = true;
@@ -82,7 +111,15 @@ form.addEventListener('submit', async (e) => {
         }
         
         // Processamento do sucesso
-        const resposeJson = await response.json();
+        let resposeJson = await response.json();
+
+        // Upload assíncrono: acompanha o job até terminar
+        if (response.status === 202 && resposeJson.job_id) {
+            const job = await waitForJob(resposeJson.status_url);
+            resposeJson = {
+                message: `Arquivo processado. ${job.progress.trajectories_inserted} trajetórias salvas com sucesso!`
+            };
+        }
 
         document.getElementById('filePreview').innerHTML = `
             <div class="alert alert-success mt-3">
@@ -303,10 +303,17 @@ async function handleRequest(isMetricsOnly = false) {
                 break;
         }
 
-         // Requisição Fetch
-        const response = await fetch(plotType, {
-            method: 'POST',
-            body: formData,
+         // Requisição Fetch: imagem binária via GET, para o navegador revalidar com ETag (304).
+        // No modo só métricas o servidor não renderiza a imagem e responde apenas o JSON das métricas,
+        // calculadas direto sobre os pontos (sem pyplot). A imagem vem com o mesmo resumo.
+        if (isMetricsOnly) {
+            formData.append('metrics_only', 'analytics');
+        } else {
+            formData.append('format', 'png');
+            formData.append('summary', 'analytics');
+        }
+        const response = await fetch(`${plotType}?${new URLSearchParams(formData)}`, {
+            method: 'GET',
             signal: controller.signal
         });
 
@@ -317,20 +324,32 @@ async function handleRequest(isMetricsOnly = false) {
             throw new Error(`Erro ${response.status}: ${errData.message || response.statusText}`);
         }
 
-        const data = await response.json();
+        // Métricas chegam no corpo JSON (só métricas, ou métricas grandes demais para o cabeçalho,
+        // com a imagem em base64) ou no cabeçalho X-Plot-Metrics (corpo é a imagem)
+        const contentType = response.headers.get('Content-Type') || '';
+        const body = contentType.startsWith('application/json') ? await response.json() : null;
+        const metrics = body
+            ? body.metrics
+            : JSON.parse(response.headers.get('X-Plot-Metrics') || '{}');
 
         // Processa a resposta e atualiza a UI 
         if (isMetricsOnly) {
-            metricsContainer.innerHTML = `<div class="metric-section"><h4>Métricas Analíticas</h4>${buildMetricsHTML(data.metrics.summary)}</div>`;
+            metricsContainer.innerHTML = `<div class="metric-section"><h4>Métricas Analíticas</h4>${buildMetricsHTML(metrics.summary)}</div>`;
             metricsContainer.style.display = 'block';
-        } else if (data.image) {
+        } else if (contentType.startsWith('image/') || (body && body.image)) {
+            const image = body
+                ? await (await fetch(`data:${body.mimetype};base64,${body.image}`)).blob()
+                : await response.blob();
             const widthCm = parseFloat(document.getElementById('bgXsize').value);
             const heightCm = parseFloat(document.getElementById('bgYsize').value);
             imgElement.style.width = `${widthCm * 37.8}px`;
             imgElement.style.height = `${heightCm * 37.8}px`;
-            imgElement.src = `data:image/png;base64,${data.image}`;
+            if (imgElement.src.startsWith('blob:')) {
+                URL.revokeObjectURL(imgElement.src);
+            }
+            imgElement.src = URL.createObjectURL(image);
             imgElement.style.display = 'block';
-            metricsContainer.innerHTML = `<div class="metric-section"><h4>Métricas Analíticas</h4>${buildMetricsHTML(data.metrics.summary)}</div>`;
+            metricsContainer.innerHTML = `<div class="metric-section"><h4>Métricas Analíticas</h4>${buildMetricsHTML(metrics.summary)}</div>`;
             metricsContainer.style.display = 'block';
         } else {
             throw new Error('Resposta inválida do servidor.');
@@ -0,0 +1,172 @@
+from datetime import datetime
+
+import bson
+import numpy as np
+from bson.binary import Binary
+from pymongo import UpdateOne
+
+# Layouts de armazenamento dos pontos de uma trajetória:
+#   "points" -> lista de subdocumentos {"timestamp": ISO/datetime, "geometry": "POINT (x y)"}
+#   "packed" -> arrays paralelos em BSON binary (epoch float64 + x/y int32 ou float64), com
+#               "datetime" indicando se os instantes eram datas BSON no layout "points"
+LAYOUT_POINTS = 'points'
+LAYOUT_PACKED = 'packed'
+LAYOUTS = (LAYOUT_POINTS, LAYOUT_PACKED)
+
+_INT32 = np.iinfo(np.int32)
+_WKT_PUNCTUATION = str.maketrans('()', '  ')
+
+
+def timestamps_to_epoch(timestamps):
+    # Converte timestamps (strings ISO ou datetime) para epoch seconds de uma só vez.
+    # Arredonda em microssegundos, como pd.Timestamp.timestamp() fazia ponto a ponto.
+    import pandas as pd
+    if not timestamps:
+        return np.empty(0, dtype=np.float64)
+    ns = pd.to_datetime(timestamps, format='ISO8601', utc=True).asi8
+    return np.rint(ns / 1000) / 1e6
+
+
+def points_wkt_to_xy(geometries):
+    # Extrai x e y de uma lista de geometrias "POINT (x y)" numa única passada.
+    if not geometries:
+        return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+    coords = np.fromstring(
+        ' '.join(geometries).replace('POINT', ' ').translate(_WKT_PUNCTUATION), sep=' ')
+    if coords.size != 2 * len(geometries):
+        # Geometrias fora do padrão "POINT (x y)" ficam a cargo do parser do shapely
+        import shapely
+        coords = shapely.get_coordinates(shapely.from_wkt(geometries)).ravel()
+    coords = coords.reshape(-1, 2)
+    return coords[:, 0], coords[:, 1]
+
+
+def _xy_dtype(x, y):
+    # Coordenadas em pixel inteiras cabem em int32; qualquer outra coisa fica em float64.
+    for values in (x, y):
+        if values.size and (not np.array_equal(values, np.round(values))
+                            or values.min() < _INT32.min or values.max() > _INT32.max):
+            return '<f8'
+    return '<i4'
+
+
+def encode_packed_points(timestamps, x, y, as_datetime=False):
+    # Empacota epoch seconds e coordenadas em três buffers little-endian. as_datetime guarda o tipo
+    # dos instantes no layout "points" (datetime ou ISO) para a conversão de volta.
+    timestamps = np.asarray(timestamps, dtype='<f8')
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    xy_dtype = _xy_dtype(x, y)
+    return {
+        "n": int(timestamps.size),
+        "t": Binary(timestamps.tobytes()),
+        "x": Binary(x.astype(xy_dtype).tobytes()),
+        "y": Binary(y.astype(xy_dtype).tobytes()),
+        "xy_dtype": xy_dtype,
+        "datetime": bool(as_datetime)
+    }
+
+
+def decode_packed_points(packed):
+    # Lê os buffers sem parse: epoch seconds e coordenadas como float64.
+    xy_dtype = packed.get('xy_dtype', '<f8')
+    return (
+        np.frombuffer(packed['t'], dtype='<f8'),
+        np.frombuffer(packed['x'], dtype=xy_dtype).astype(np.float64),
+        np.frombuffer(packed['y'], dtype=xy_dtype).astype(np.float64)
+    )
+
+
+def points_from_arrays(timestamps, x, y, as_datetime=False):
+    # Monta a lista de subdocumentos do layout "points" (timestamps em ISO ou datetime).
+    # Arredonda em microssegundos: unit='s' truncaria 0.767 (0.76699...) para 766999 us.
+    import pandas as pd
+    import shapely
+    micros = np.rint(np.asarray(timestamps, dtype=np.float64) * 1e6).astype(np.int64)
+    index = pd.to_datetime(micros, unit='us')
+    if as_datetime:
+        moments = index.as_unit('us').to_pydatetime().tolist()
+    else:
+        moments = np.datetime_as_string(index.values, unit='us').tolist()
+    wkt = shapely.to_wkt(shapely.points(x, y), rounding_precision=-1)
+    return [{"timestamp": t, "geometry": g} for t, g in zip(moments, wkt.tolist())]
+
+
+def points_to_arrays(points):
+    # Converte a lista de subdocumentos do layout "points" em arrays NumPy.
+    x, y = points_wkt_to_xy([point['geometry'] for point in points])
+    return timestamps_to_epoch([point['timestamp'] for point in points]), x, y
+
+
+def document_points(doc):
+    # Arrays (epoch, x, y) de um documento de trajetória, em qualquer um dos layouts.
+    if doc.get('points_packed') is not None:
+        return decode_packed_points(doc['points_packed'])
+    return points_to_arrays(doc.get('points') or [])
+
+
+def document_datetime_points(doc):
+    # Verdadeiro se os instantes do documento são (ou eram, no layout "packed") datas BSON e não ISO.
+    packed = doc.get('points_packed')
+    if packed is not None:
+        return bool(packed.get('datetime', False))
+    points = doc.get('points') or [{}]
+    return isinstance(points[0].get('timestamp'), datetime)
+
+
+def linestring_wkt(x, y):
+    # WKT da trajetória completa, no mesmo formato de Trajectory.to_linestring().wkt.
+    import shapely
+    return shapely.to_wkt(shapely.linestrings(x, y), rounding_precision=-1)
+
+
+def to_json_document(doc):
+    # Substitui os buffers binários por listas para gravar o documento em JSON.
+    packed = doc.get('points_packed')
+    if packed is None:
+        return doc
+    timestamps, x, y = decode_packed_points(packed)
+    doc = dict(doc)
+    doc['points_packed'] = {"t": timestamps.tolist(), "x": x.tolist(), "y": y.tolist()}
+    return doc
+
+
+def migrate_points_layout(collection, layout=LAYOUT_PACKED, batch_size=500, query={}):
+    # Converte documentos existentes para o layout indicado, em lotes de bulk_write. Os pontos e o
+    # tipo dos instantes (datetime ou ISO) voltam iguais na conversão de ida e volta.
+    if layout not in LAYOUTS:
+        raise ValueError(f"Layout desconhecido: {layout}")
+
+    source_field = 'points' if layout == LAYOUT_PACKED else 'points_packed'
+    selector = dict(query)
+    selector[source_field] = {"$exists": True}
+
+    stats = {"converted": 0, "bytes_before": 0, "bytes_after": 0}
+    operations = []
+    for doc in collection.find(selector):
+        stats["bytes_before"] += len(bson.encode(doc))
+        if layout == LAYOUT_PACKED:
+            packed = encode_packed_points(*points_to_arrays(doc['points']), as_datetime=document_datetime_points(doc))
+            changes = {"$set": {"points_packed": packed},
+                       "$unset": {"points": "", "geometry": ""}}
+        else:
+            timestamps, x, y = decode_packed_points(doc['points_packed'])
+            points = points_from_arrays(timestamps, x, y, as_datetime=document_datetime_points(doc))
+            changes = {"$set": {"points": points,
+                                "geometry": linestring_wkt(x, y)},
+                       "$unset": {"points_packed": ""}}
+
+        migrated = {k: v for k, v in doc.items() if k not in changes["$unset"]}
+        migrated.update(changes["$set"])
+        stats["bytes_after"] += len(bson.encode(migrated))
+
+        operations.append(UpdateOne({"_id": doc["_id"]}, changes))
+        if len(operations) >= batch_size:
+            collection.bulk_write(operations, ordered=False)
+            stats["converted"] += len(operations)
+            operations = []
+
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+        stats["converted"] += len(operations)
+    return stats
@@ -0,0 +1,94 @@
+import numpy as np
+from pymongo import UpdateOne
+
+from app.storage import document_points
+
+# Resumo por trajetória gravado junto com o documento no momento da ingestão:
+#   {"n_points", "duration", "length", "mean_speed", "max_speed",
+#    "start_point": [x, y], "end_point": [x, y], "bbox": {"min_x", "min_y", "max_x", "max_y"}}
+# Distâncias em pixels, tempos em segundos. Permite filtrar no MongoDB (ex.: bbox) sem ler os pontos.
+
+
+def trajectory_summaries(t, x, y, counts):
+    # Resumo de várias trajetórias de uma vez. t/x/y: pontos de todas as trajetórias em sequência;
+    # counts: quantidade de pontos de cada uma (todas com pelo menos 1 ponto).
+    counts = np.asarray(counts, dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    ends = starts + counts - 1
+
+    # Passo i liga o ponto i ao i+1; o passo que atravessa de uma trajetória para a próxima é zerado
+    step = np.zeros(t.size)
+    speed = np.zeros(t.size)
+    if t.size > 1:
+        step[:-1] = np.hypot(np.diff(x), np.diff(y))
+        dt = np.diff(t)
+        speed[:-1] = np.divide(step[:-1], dt, out=np.zeros(dt.size), where=dt > 0)
+    step[ends] = 0.0
+    speed[ends] = 0.0
+
+    duration = t[ends] - t[starts]
+    length = np.add.reduceat(step, starts)
+    return {
+        'n_points': counts,
+        'duration': duration,
+        'length': length,
+        'mean_speed': np.divide(length, duration, out=np.zeros(counts.size), where=duration > 0),
+        'max_speed': np.maximum.reduceat(speed, starts),
+        'start_x': x[starts], 'start_y': y[starts],
+        'end_x': x[ends], 'end_y': y[ends],
+        'min_x': np.minimum.reduceat(x, starts), 'max_x': np.maximum.reduceat(x, starts),
+        'min_y': np.minimum.reduceat(y, starts), 'max_y': np.maximum.reduceat(y, starts)
+    }
+
+
+def summary_documents(summaries):
+    # Converte a saída de trajectory_summaries na lista de subdocumentos "summary".
+    columns = {key: values.tolist() for key, values in summaries.items()}
+    return [{
+        "n_points": columns['n_points'][i],
+        "duration": columns['duration'][i],
+        "length": columns['length'][i],
+        "mean_speed": columns['mean_speed'][i],
+        "max_speed": columns['max_speed'][i],
+        "start_point": [columns['start_x'][i], columns['start_y'][i]],
+        "end_point": [columns['end_x'][i], columns['end_y'][i]],
+        "bbox": {"min_x": columns['min_x'][i], "min_y": columns['min_y'][i],
+                 "max_x": columns['max_x'][i], "max_y": columns['max_y'][i]}
+    } for i in range(len(columns['n_points']))]
+
+
+def summarize_trajectory(t, x, y):
+    # Resumo de uma única trajetória.
+    return summary_documents(trajectory_summaries(t, x, y, [t.size]))[0]
+
+
+def bbox_query(min_x, max_x, min_y, max_y):
+    # Filtro MongoDB: trajetórias cujo bbox cruza o retângulo dado.
+    # Documentos antigos, ainda sem resumo, sempre passam (o filtro exato é feito nos pontos).
+    return {"$or": [
+        {"summary.bbox": {"$exists": False}},
+        {"summary.bbox.min_x": {"$lte": max_x}, "summary.bbox.max_x": {"$gte": min_x},
+         "summary.bbox.min_y": {"$lte": max_y}, "summary.bbox.max_y": {"$gte": min_y}}
+    ]}
+
+
+def backfill_summaries(collection, batch_size=500, query={}):
+    # Grava o resumo nos documentos que ainda não têm (ingeridos antes deste campo existir).
+    selector = dict(query)
+    selector["summary"] = {"$exists": False}
+    updated = 0
+    operations = []
+    for doc in collection.find(selector, {"points": 1, "points_packed": 1}):
+        t, x, y = document_points(doc)
+        if t.size == 0:
+            continue
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"summary": summarize_trajectory(t, x, y)}}))
+        if len(operations) >= batch_size:
+            collection.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    return updated
@@ -1,16 +1,15 @@
 import json
-import pandas as pd
+import numpy as np
 from bson import ObjectId
-import geopandas as gpd
-import movingpandas as mpd
-from pymongo import MongoClient
-from shapely.geometry import Point
-from datetime import datetime
-from config import MONGODB_URI, DB_NAME, COLLECTION_TRAJ
+from datetime import datetime, timedelta, timezone
+from app.db import get_database
+from app.metrics import stage, timed_iter
+from app.storage import decode_packed_points, points_wkt_to_xy, timestamps_to_epoch
+from app.summary import bbox_query
+from config import COLLECTION_TRAJ
 
-client = MongoClient(MONGODB_URI)
-db = client[DB_NAME]
-collection_traj = db[COLLECTION_TRAJ]
+# Mesmo cliente MongoDB do run.py (app/db.py)
+collection_traj = get_database()[COLLECTION_TRAJ]
 
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, o):
@@ -21,50 +20,173 @@ class CustomJSONEncoder(json.JSONEncoder):
         return super().default(o)
 
 
-def fetch_trajectory_data_from_mongodb(query={}):
+def _naive_utc(moment):
+    # Datas sem fuso são tratadas como UTC, como o pymongo faz ao gravar.
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _points_in_window(start, end):
+    # Expressão $filter que mantém apenas os pontos dentro de [start, end].
+    # Pontos gravados pela rota _datetime têm timestamp BSON date; os demais, string ISO sem fuso.
+    # Na ordem de comparação BSON toda string é menor que qualquer date, então cada
+    # intervalo só pode ser satisfeito por timestamps do seu próprio tipo.
+    timestamp = "$$point.timestamp"
+    start, end = (_naive_utc(moment) for moment in (start, end))
+    return {"$filter": {"input": "$points", "as": "point", "cond": {"$or": [
+        {"$and": [{"$gte": [timestamp, start.isoformat()]}, {"$lte": [timestamp, end.isoformat()]}]},
+        {"$and": [{"$gte": [timestamp, start]}, {"$lte": [timestamp, end]}]}
+    ]}}}
+
+
+def _trajectory_pipeline(query, time_window=None):
+    # Pipeline de agregação: filtra as trajetórias, projeta só o necessário e recorta os pontos no servidor.
+    projection = {"_id": 0, "identifier": 1, "category": 1, "points_packed": 1, "points": 1}
+    if time_window is not None:
+        projection["points"] = _points_in_window(*time_window)
+    return [{"$match": query}, {"$project": projection}]
+
+
+def _with_bbox(query, bbox):
+    return query if bbox is None else dict(query, **bbox_query(*bbox))
+
+
+def fetch_trajectory_arrays(query={}, time_window=None, bbox=None):
+    # Busca dados do MongoDB em formato colunar (um array NumPy por coluna do CSV).
+    # Aceita os dois layouts de pontos: subdocumentos ("points") e arrays empacotados ("points_packed").
+    # Com time_window=(início, fim), só os pontos dentro da janela são retornados.
+    # Com bbox=(min_x, max_x, min_y, max_y), só as trajetórias cujo resumo gravado na ingestão cruza
+    # o bbox (o filtro é feito no MongoDB, antes de ler os pontos).
+    # Tempos: "mongo" é a espera pelo cursor; "decode", o resto (conversão dos pontos)
+    with stage('decode'):
+        return _fetch_trajectory_arrays(_with_bbox(query, bbox), time_window)
+
+
+def _fetch_trajectory_arrays(query, time_window):
+    if time_window is not None:
+        window_start, window_end = (_naive_utc(moment).replace(tzinfo=timezone.utc).timestamp()
+                                    for moment in time_window)
+
+    identifiers, categories, blocks = [], [], []
+    timestamps, geometries = [], []
+    for doc in timed_iter(collection_traj.aggregate(_trajectory_pipeline(query, time_window)), 'mongo'):
+        identifiers.append(doc['identifier'])
+        categories.append(doc['category'])
+        packed = doc.get('points_packed')
+        if packed is not None:
+            t, x, y = decode_packed_points(packed)
+            if time_window is not None:
+                # Buffers binários não são filtráveis no servidor: recorta aqui
+                inside = (t >= window_start) & (t <= window_end)
+                t, x, y = t[inside], x[inside], y[inside]
+            blocks.append((t, x, y))
+        else:
+            points = doc['points']
+            blocks.append(len(points))
+            timestamps.extend(point['timestamp'] for point in points)
+            geometries.extend(point['geometry'] for point in points)
+
+    t = timestamps_to_epoch(timestamps)
+    x, y = points_wkt_to_xy(geometries)
+    counts = [block if isinstance(block, int) else block[0].size for block in blocks]
+
+    if len(timestamps) != sum(counts):
+        # Há documentos empacotados: intercala os blocos na ordem em que chegaram
+        columns, offset = ([], [], []), 0
+        for block in blocks:
+            if isinstance(block, int):
+                block = (t[offset:offset + block], x[offset:offset + block], y[offset:offset + block])
+                offset += block[0].size
+            for column, values in zip(columns, block):
+                column.append(values)
+        t, x, y = (np.concatenate(column) if column else np.empty(0) for column in columns)
+
+    return {
+        'identifier': np.repeat(np.asarray(identifiers), counts),
+        'category': np.repeat(np.asarray(categories), counts),
+        'timestamp': t,
+        'x': x,
+        'y': y
+    }
+
+
+def count_trajectories(query={}, time_window=None):
+    # Quantas trajetórias da consulta teriam ao menos 2 pontos na janela, a mesma regra do
+    # TrajectoryCollection e de app.analytics.group_points, sem trazer as coordenadas.
+    # Documentos inteiros dentro da janela usam o n_points do resumo gravado na ingestão. Nos outros,
+    # pontos em subdocumentos são contados no servidor ($filter/$size) e, nos empacotados, só o buffer
+    # de tempos vem e é recortado aqui. Documentos do mesmo identificador somam os seus pontos.
+    summarized = {"$gt": ["$summary.n_points", 0]}
+    if time_window is not None:
+        window_start, window_end = (_naive_utc(moment) for moment in time_window)
+        # start_time/end_time são datas BSON (milissegundos truncados): o último ponto pode passar
+        # até 1 ms do end_time gravado
+        summarized = {"$and": [summarized, {"$gte": ["$start_time", window_start]},
+                               {"$lte": ["$end_time", window_end - timedelta(milliseconds=1)]}]}
+        points = _points_in_window(*time_window)
+        window_start, window_end = (moment.replace(tzinfo=timezone.utc).timestamp()
+                                    for moment in (window_start, window_end))
+    else:
+        points = "$points"
+    pipeline = [{"$match": query}, {"$project": {
+        "_id": 0, "identifier": 1,
+        "t": {"$cond": [summarized, None, "$points_packed.t"]},
+        "n_points": {"$cond": [summarized, "$summary.n_points", {"$size": {"$ifNull": [points, []]}}]}
+    }}]
+
+    counts = {}
+    for doc in timed_iter(collection_traj.aggregate(pipeline), 'mongo'):
+        if doc.get('t') is not None:
+            t = np.frombuffer(doc['t'], dtype='<f8')
+            n_points = int(((t >= window_start) & (t <= window_end)).sum()) if time_window is not None else t.size
+        else:
+            n_points = doc['n_points']
+        counts[doc['identifier']] = counts.get(doc['identifier'], 0) + n_points
+    return sum(1 for n_points in counts.values() if n_points >= 2)
+
+
+def fetch_trajectory_data_from_mongodb(query={}, time_window=None):
     # Busca dados do MongoDB e estrutura no formato equivalente ao CSV.
-    data = []
-    for doc in collection_traj.find(query):
-        identifier = doc['identifier']
-        category = doc['category']
-        
-        for point in doc['points']:
-            # Converte timestamp ISO para epoch seconds (com decimal)
-            timestamp = pd.to_datetime(point['timestamp']).timestamp()
-            
-            # Extrai x e y da geometria "POINT (x y)"
-            geom_str = point['geometry'].split('(')[1].split(')')[0]
-            x, y = map(float, geom_str.strip().split())
-            
-            data.append({
-                'identifier': identifier,
-                'category': category,
-                'timestamp': timestamp,
-                'x': x,
-                'y': y
-            })
-    
-    return pd.DataFrame(data)
-
-
-def create_trajectory_collection_mongodb(query={}):
+    import pandas as pd
+    return pd.DataFrame(fetch_trajectory_arrays(query, time_window))
+
+
+def trajectory_collection_from_arrays(arrays):
+    # Cria um TrajectoryCollection a partir das colunas identifier, category, timestamp, x e y.
+    # pandas, geopandas e movingpandas só são importados aqui, na primeira requisição que precisa deles.
+    import pandas as pd
+    import geopandas as gpd
+    import movingpandas as mpd
+    with stage('collection'):
+        gdf = gpd.GeoDataFrame(
+            {'identifier': arrays['identifier'], 'category': arrays['category']},
+            geometry=gpd.points_from_xy(arrays['x'], arrays['y']),
+            index=pd.to_datetime(arrays['timestamp'], unit='s'),
+            crs="EPSG:4326"
+        )
+        gdf.index.name = 'timestamp'
+
+        # Agrupa por identificador para criar trajetórias
+        return mpd.TrajectoryCollection(gdf, 'identifier')
+
+
+def load_trajectory_arrays(query={}, time_window=None, cache=None, bbox=None):
+    # Como fetch_trajectory_arrays, mas reaproveitando os pontos já buscados quando há cache
+    # (TrajectoryArrayCache). Consultas com bbox não passam pelo cache.
+    if cache is not None and bbox is None:
+        return cache.get_arrays(query, time_window, fetch_trajectory_arrays)
+    return fetch_trajectory_arrays(query, time_window, bbox)
+
+
+def create_trajectory_collection_mongodb(query={}, time_window=None, cache=None):
     # Cria um objeto TrajectoryCollection diretamente do MongoDB.
-    df = fetch_trajectory_data_from_mongodb(query)
-    
-    if df.empty:
+    arrays = load_trajectory_arrays(query, time_window, cache)
+
+    if arrays['timestamp'].size == 0:
         return None
-    
-    # Cria geometrias Point e prepara GeoDataFrame
-    df['geometry'] = df.apply(lambda row: Point(row.x, row.y), axis=1)
-    df = df.drop(['x', 'y'], axis=1)
-    gdf = gpd.GeoDataFrame(df, geometry='geometry', crs="EPSG:4326")
-    
-    # Converte timestamp e define como índice
-    gdf['timestamp'] = pd.to_datetime(gdf['timestamp'], unit='s')
-    gdf.set_index('timestamp', inplace=True)
-    
-    # Agrupa por identificador para criar trajetórias
-    return mpd.TrajectoryCollection(gdf, 'identifier')
+
+    return trajectory_collection_from_arrays(arrays)
 
 # Arquivos de imagem aceitos
 def allowed_file(filename):
@@ -0,0 +1,127 @@
+# Benchmark do carregamento de trajetórias do MongoDB: laço ponto a ponto (legado)
+# versus o carregador colunar de app/utils.py.
+#
+# Uso:
+#   python -m benchmarks.bench_loader --trajectories 2000 --points 150
+#   python -m benchmarks.bench_loader --mongo-uri mongodb://localhost:27017/
+#
+# Sem --mongo-uri os documentos ficam num mongomock em memória (pip install mongomock).
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import movingpandas as mpd
+from shapely.geometry import Point
+
+import app.utils as utils
+
+
+def legacy_create_trajectory_collection(collection, query={}):
+    # Cópia do caminho original: parse ponto a ponto e df.apply para as geometrias.
+    data = []
+    for doc in collection.find(query):
+        identifier = doc['identifier']
+        category = doc['category']
+        for point in doc['points']:
+            timestamp = pd.to_datetime(point['timestamp']).timestamp()
+            geom_str = point['geometry'].split('(')[1].split(')')[0]
+            x, y = map(float, geom_str.strip().split())
+            data.append({'identifier': identifier, 'category': category,
+                         'timestamp': timestamp, 'x': x, 'y': y})
+    df = pd.DataFrame(data)
+    if df.empty:
+        return None
+    df['geometry'] = df.apply(lambda row: Point(row.x, row.y), axis=1)
+    df = df.drop(['x', 'y'], axis=1)
+    gdf = gpd.GeoDataFrame(df, geometry='geometry', crs="EPSG:4326")
+    gdf['timestamp'] = pd.to_datetime(gdf['timestamp'], unit='s')
+    gdf.set_index('timestamp', inplace=True)
+    return mpd.TrajectoryCollection(gdf, 'identifier')
+
+
+def generate_documents(n_trajectories, n_points, camera='bench', as_datetime=False, seed=0):
+    # Gera documentos no mesmo formato gravado por _process_and_store_trajectory.
+    rng = np.random.default_rng(seed)
+    base = datetime(2023, 6, 21, 8, 0, 0)
+    docs = []
+    for identifier in range(1, n_trajectories + 1):
+        start = base + timedelta(seconds=float(rng.uniform(0, 8 * 3600)))
+        times = [start + timedelta(seconds=0.1 * i) for i in range(n_points)]
+        xs = np.cumsum(rng.integers(-5, 6, n_points)) + int(rng.integers(100, 1800))
+        ys = np.cumsum(rng.integers(-5, 6, n_points)) + int(rng.integers(100, 900))
+        docs.append({
+            "identifier": float(identifier),
+            "category": float(rng.integers(0, 8)),
+            "start_time": times[0],
+            "end_time": times[-1],
+            "background": camera,
+            "points": [
+                {"timestamp": t if as_datetime else t.isoformat(), "geometry": f"POINT ({x} {y})"}
+                for t, x, y in zip(times, xs, ys)
+            ]
+        })
+    return docs
+
+
+def assert_same_collection(expected, actual):
+    # Confere trajetória a trajetória: ids, categorias, coordenadas e tempos (tolerância de 1 µs).
+    assert len(expected) == len(actual), (len(expected), len(actual))
+    for traj_a, traj_b in zip(expected, actual):
+        assert traj_a.id == traj_b.id
+        assert (traj_a.df['category'].values == traj_b.df['category'].values).all()
+        assert np.array_equal(traj_a.df.geometry.x.values, traj_b.df.geometry.x.values)
+        assert np.array_equal(traj_a.df.geometry.y.values, traj_b.df.geometry.y.values)
+        delta = np.abs(traj_a.df.index.asi8 - traj_b.df.index.asi8)
+        assert delta.max() <= 1000, delta.max()
+
+
+def best_of(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do carregador de trajetórias")
+    parser.add_argument('--trajectories', type=int, default=1000)
+    parser.add_argument('--points', type=int, default=150)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--datetime', action='store_true',
+                        help='Grava timestamps como datetime (rota _datetime) em vez de ISO string')
+    parser.add_argument('--mongo-uri', help='Usa um mongod real em vez do mongomock')
+    args = parser.parse_args()
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        collection = MongoClient(args.mongo_uri)['smart-trajectories-bench']['trajectories']
+        collection.drop()
+    else:
+        import mongomock
+        collection = mongomock.MongoClient()['smart-trajectories-bench']['trajectories']
+
+    collection.insert_many(generate_documents(args.trajectories, args.points, as_datetime=args.datetime))
+    utils.collection_traj = collection
+    total_points = args.trajectories * args.points
+
+    legacy_time, legacy_tc = best_of(lambda: legacy_create_trajectory_collection(collection), args.repeat)
+    columnar_time, columnar_tc = best_of(utils.create_trajectory_collection_mongodb, args.repeat)
+    assert_same_collection(legacy_tc, columnar_tc)
+
+    print(f"{args.trajectories} trajetórias, {total_points} pontos")
+    print(f"legado:   {legacy_time:8.3f} s  ({total_points / legacy_time:12.0f} pontos/s)")
+    print(f"colunar:  {columnar_time:8.3f} s  ({total_points / columnar_time:12.0f} pontos/s)")
+    print(f"ganho:    {legacy_time / columnar_time:8.1f}x")
+
+    if args.mongo_uri:
+        collection.drop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+# Benchmark do parsing dos TXT do rastreador: leitura linha a linha versus o parser em blocos
+# (em um processo e no pool de processos).
+#
+# Uso:
+#   python -m benchmarks.bench_parsing --tracks 50000 --points 150 --workers 8
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from app.parsing import arrays_from_trajectories, iter_txt_trajectories, parse_txt_file
+from benchmarks.synthetic import generate_txt
+
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do parser de TXT")
+    parser.add_argument('--tracks', type=int, default=20000)
+    parser.add_argument('--points', type=int, default=150)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--datetime', action='store_true', help='Início/fim como data e hora')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = generate_txt(os.path.join(tmp, 'bench.txt'), args.tracks, args.points,
+                            datetime_format=args.datetime)
+        size_mb = os.path.getsize(path) / 1e6
+
+        line_time, reference = timed(
+            lambda: arrays_from_trajectories(iter_txt_trajectories(path, args.datetime)))
+        chunk_time, chunked = timed(lambda: parse_txt_file(path, args.datetime, workers=1))
+        # A primeira chamada paga o spawn do pool; mede a segunda
+        parse_txt_file(path, args.datetime, workers=args.workers, min_parallel_bytes=0)
+        pool_time, pooled = timed(
+            lambda: parse_txt_file(path, args.datetime, workers=args.workers, min_parallel_bytes=0))
+
+        for arrays in (chunked, pooled):
+            for key, values in reference.items():
+                assert np.allclose(arrays[key], values, rtol=0, atol=1e-6), key
+
+        points = reference['t'].size
+        print(f"{args.tracks} trajetórias, {points} pontos, {size_mb:.1f} MB")
+        for label, seconds in (('linha a linha', line_time), ('blocos (1 proc.)', chunk_time),
+                               (f'pool ({args.workers} proc.)', pool_time)):
+            print(f"{label:18s} {seconds:8.3f} s  ({size_mb / seconds:7.1f} MB/s, {points / seconds:12.0f} pontos/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# Teste de carga do servidor: dispara requisições concorrentes e mede vazão e latência.
+# Com --compare, sobe o gunicorn (gunicorn.conf.py) uma vez por classe de worker e compara
+# o perfil síncrono antigo com o gthread, com o mesmo número de processos.
+#
+# Uso:
+#   python -m benchmarks.bench_server --url http://localhost:5002 --camera cam1 --date 2023-06-21
+#   python -m benchmarks.bench_server --compare sync gthread --workers 2 --camera cam1 --date 2023-06-21
+#
+# Precisa de um MongoDB com a câmera e trajetórias ingeridas (MONGO_URI). As rotas de plot vão com
+# metrics_only=analytics e no_cache=1: o tempo medido é o de buscar e processar os pontos (sem
+# smart_traject nem pyplot), não o do cache.
+import argparse
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import numpy as np
+
+
+def default_paths(camera, date):
+    period = {'camera': camera, 'start': f'{date}T00:00:00', 'end': f'{date}T23:59:59'}
+    plot = {'camera': camera, 'selected_date': date, 'start_time': 0, 'end_time': 24,
+            'metrics_only': 'analytics', 'no_cache': 1}
+    return [
+        '/plot_with_background?' + urlencode(plot),
+        '/plot_one_category?' + urlencode(dict(plot, category=0)),
+        '/plot_monitored_area?' + urlencode(dict(plot, rect_min_x=0, rect_max_x=500, rect_min_y=0, rect_max_y=500)),
+        '/rollups?' + urlencode(period),
+        '/cache/stats'
+    ]
+
+
+def _request(url, timeout):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            ok = response.status < 400
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+def run_load(base_url, paths, n_requests, concurrency, timeout=120):
+    # n_requests requisições distribuídas entre os caminhos, concurrency clientes ao mesmo tempo
+    urls = [base_url + paths[i % len(paths)] for i in range(n_requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda url: _request(url, timeout), urls))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    return {
+        'requests': n_requests,
+        'errors': sum(1 for _, ok in results if not ok),
+        'seconds': elapsed,
+        'requests_per_second': n_requests / elapsed,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p95_ms': float(np.percentile(latencies, 95)),
+        'p99_ms': float(np.percentile(latencies, 99))
+    }
+
+
+def _wait_ready(base_url, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(base_url + '/cache/stats', timeout=5):
+                return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    raise RuntimeError(f"Servidor não respondeu em {timeout} s")
+
+
+def start_server(worker_class, workers, threads, port, app):
+    env = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class, GUNICORN_WORKERS=str(workers),
+               GUNICORN_THREADS=str(threads), GUNICORN_BIND=f'127.0.0.1:{port}')
+    return subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                             '--access-logfile', '/dev/null', app], env=env)
+
+
+def print_result(label, result):
+    print(f"{label:10s} {result['requests_per_second']:8.1f} req/s  p50 {result['p50_ms']:8.1f} ms  "
+          f"p95 {result['p95_ms']:8.1f} ms  p99 {result['p99_ms']:8.1f} ms  erros {result['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do servidor")
+    parser.add_argument('--url', default='http://127.0.0.1:5002', help='Servidor já em execução')
+    parser.add_argument('--compare', nargs='+', metavar='WORKER_CLASS',
+                        help='Sobe o gunicorn com cada classe de worker (ex.: sync gthread) e compara')
+    parser.add_argument('--app', default='run:app')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--camera', default='bench')
+    parser.add_argument('--date', default='2023-06-21')
+    parser.add_argument('--path', action='append', dest='paths',
+                        help='Caminho (com query string) a requisitar; pode repetir. Padrão: plots só métricas, '
+                             '/rollups e /cache/stats')
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    paths = args.paths or default_paths(args.camera, args.date)
+    if not args.compare:
+        print_result('servidor', run_load(args.url, paths, args.requests, args.concurrency))
+        return
+
+    base_url = f'http://127.0.0.1:{args.port}'
+    results = {}
+    for worker_class in args.compare:
+        server = start_server(worker_class, args.workers, args.threads, args.port, args.app)
+        try:
+            _wait_ready(base_url)
+            # Aquecimento: conexões do pool, imports tardios e caches de câmera
+            run_load(base_url, paths, len(paths) * 2, args.concurrency)
+            results[worker_class] = run_load(base_url, paths, args.requests, args.concurrency)
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f"{args.workers} processos, {args.threads} threads (gthread), {args.concurrency} clientes, "
+          f"{args.requests} requisições")
+    for worker_class, result in results.items():
+        print_result(worker_class, result)
+    if len(results) > 1:
+        first, last = list(results.values())[0], list(results.values())[-1]
+        print(f"ganho:     {last['requests_per_second'] / first['requests_per_second']:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# Benchmark da inicialização: tempo de import e RSS de um processo novo com as bibliotecas pesadas
+# importadas sob demanda (padrão) versus todas importadas de saída (como antes / preload do master).
+#
+# Uso:
+#   python -m benchmarks.bench_startup                      # importa run (precisa do smart_traject)
+#   python -m benchmarks.bench_startup --target app.utils --target app.render --repeat 5
+#
+# Cada medição roda num interpretador novo, então o cache de bytecode já deve estar gerado
+# (a primeira rodada é descartada).
+import argparse
+import json
+import subprocess
+import sys
+
+import numpy as np
+
+_CHILD = '''
+import importlib, json, resource, sys, time
+start = time.perf_counter()
+if {eager}:
+    from app.preload import preload_modules
+    preload_modules()
+for target in {targets!r}:
+    importlib.import_module(target)
+elapsed = time.perf_counter() - start
+from app.preload import HEAVY_MODULES
+print(json.dumps({{
+    "seconds": elapsed,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "loaded": [name for name in HEAVY_MODULES if name in sys.modules]
+}}))
+'''
+
+
+def measure(targets, eager, repeat):
+    code = _CHILD.format(eager=eager, targets=targets)
+    runs = []
+    for _ in range(repeat + 1):
+        output = subprocess.run([sys.executable, '-W', 'ignore', '-c', code], capture_output=True, text=True)
+        if output.returncode != 0:
+            sys.exit(f"Falha ao importar {', '.join(targets)}:\n{output.stderr.strip().splitlines()[-1]}")
+        runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    runs = runs[1:]
+    return {
+        'seconds': float(np.median([run['seconds'] for run in runs])),
+        'rss_mb': float(np.median([run['rss_mb'] for run in runs])),
+        'loaded': runs[-1]['loaded']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da inicialização (imports sob demanda)")
+    parser.add_argument('--target', action='append', dest='targets',
+                        help='Módulo a importar (pode repetir). Padrão: run')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    targets = args.targets or ['run']
+
+    lazy = measure(targets, False, args.repeat)
+    eager = measure(targets, True, args.repeat)
+    print(f"import {', '.join(targets)}")
+    for label, result in (('sob demanda', lazy), ('tudo no boot', eager)):
+        print(f"{label:13s} {result['seconds']:6.2f} s  RSS {result['rss_mb']:6.0f} MB  "
+              f"carregados: {', '.join(result['loaded']) or '-'}")
+    print(f"ganho:        {eager['seconds'] / lazy['seconds']:6.1f}x no tempo, "
+          f"{eager['rss_mb'] - lazy['rss_mb']:.0f} MB a menos por processo")
+
+
+if __name__ == '__main__':
+    main()
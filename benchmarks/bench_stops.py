@@ -0,0 +1,85 @@
+# Benchmark da detecção de paradas: laço trajetória a trajetória com as regras de
+# app.analytics.detect_stops versus a versão vetorizada sobre os arrays planos da coleção inteira.
+# O laço só confere a vetorização; não é a lógica de parada da smart_traject.
+#
+# Uso:
+#   python -m benchmarks.bench_stops --tracks 1000 10000 50000 --points 150
+import argparse
+import time
+
+import numpy as np
+
+from app.analytics import detect_stops, group_points
+from benchmarks.synthetic import generate_point_arrays
+
+
+def reference_stops(points, starts, counts, stop_threshold, min_duration, noise_tolerance):
+    # Implementação anterior, uma trajetória por vez; serve de referência para os resultados
+    stops = []
+    for trajectory, (start, count) in enumerate(zip(starts.tolist(), counts.tolist())):
+        t = points['timestamp'][start:start + count]
+        x = points['x'][start:start + count]
+        y = points['y'][start:start + count]
+        steps = np.hypot(np.diff(x), np.diff(y))
+        runs = []
+        run_start = None
+        last_still = None
+        noisy = 0
+        for i, step in enumerate(steps):
+            if step <= stop_threshold:
+                if run_start is None:
+                    run_start = i
+                last_still = i
+                noisy = 0
+            elif run_start is not None:
+                noisy += 1
+                if noisy > noise_tolerance:
+                    runs.append((run_start, last_still + 1))
+                    run_start = None
+                    noisy = 0
+        if run_start is not None:
+            runs.append((run_start, last_still + 1))
+        stops.extend((trajectory, t[first], t[last], x[first:last + 1].mean(), y[first:last + 1].mean())
+                     for first, last in runs if t[last] - t[first] >= min_duration)
+    return stops
+
+
+def assert_same_stops(reference, stops):
+    assert len(reference) == stops['trajectory'].size, (len(reference), stops['trajectory'].size)
+    if reference:
+        expected = np.array(reference)
+        got = np.column_stack([stops['trajectory'], stops['start'], stops['end'], stops['x'], stops['y']])
+        assert np.allclose(expected, got, rtol=0, atol=1e-6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da detecção de paradas")
+    parser.add_argument('--tracks', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--points', type=int, default=150)
+    parser.add_argument('--stop-threshold', type=float, default=3)
+    parser.add_argument('--min-duration', type=float, default=2)
+    parser.add_argument('--noise-tolerance', type=int, default=2)
+    parser.add_argument('--skip-reference-above', type=int, default=20000,
+                        help='Não roda o laço de referência acima deste número de trajetórias')
+    args = parser.parse_args()
+    params = (args.stop_threshold, args.min_duration, args.noise_tolerance)
+
+    for tracks in args.tracks:
+        points, starts, counts = group_points(generate_point_arrays(tracks, args.points))
+        start = time.perf_counter()
+        stops = detect_stops(points, starts, counts, *params)
+        vector_time = time.perf_counter() - start
+
+        line = (f"{tracks:7d} trajetórias {counts.sum():10d} pontos {stops['trajectory'].size:8d} paradas  "
+                f"vetorizado {vector_time:8.3f} s")
+        if tracks <= args.skip_reference_above:
+            start = time.perf_counter()
+            reference = reference_stops(points, starts, counts, *params)
+            loop_time = time.perf_counter() - start
+            assert_same_stops(reference, stops)
+            line += f"  laço {loop_time:8.3f} s  ({loop_time / vector_time:5.1f}x)"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,19 @@
+import functools
+
+# O pymongo 4.13 passa sort= para UpdateOne/ReplaceOne dentro de bulk_write e o mongomock 4.3
+# não aceita o argumento (TypeError); as operações da aplicação não usam sort. Usado pela suíte de
+# benchmarks e pelos testes para rodar a ingestão incremental e os agregados no mongomock.
+
+
+def _ignore_sort(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, sort=None, **kwargs):
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+def patch_mongomock_bulk_write():
+    from mongomock.collection import BulkOperationBuilder
+    if getattr(BulkOperationBuilder.add_update, '__wrapped__', None) is None:
+        BulkOperationBuilder.add_update = _ignore_sort(BulkOperationBuilder.add_update)
+        BulkOperationBuilder.add_replace = _ignore_sort(BulkOperationBuilder.add_replace)
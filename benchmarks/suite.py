@@ -0,0 +1,290 @@
+# Suíte de benchmarks de ponta a ponta: gera TXT sintéticos no formato do rastreador, faz o parsing,
+# ingere no MongoDB, carrega o TrajectoryCollection e chama as rotas /plot_* (imagem, metrics_only=1 e
+# metrics_only=analytics).
+# Por etapa: vazão (itens/s), latência p50/p95/p99 por operação e pico de RSS do processo.
+# O resultado pode ser salvo como baseline JSON e comparado com uma execução anterior.
+#
+# Uso:
+#   python -m benchmarks.suite --tracks 2000 --points 150 --cameras 2 --save baseline.json
+#   python -m benchmarks.suite --tracks 2000 --points 150 --cameras 2 --compare baseline.json
+#   python -m benchmarks.suite --mongo-uri mongodb://localhost:27017/ --stages parse ingest load
+#
+# Sem --mongo-uri os documentos ficam num mongomock em memória (pip install mongomock), com o ajuste
+# de benchmarks.mongomock_compat para o bulk_write; nos dois casos a ingestão é a incremental com os
+# agregados, como o upload padrão.
+# Os plots com imagem do renderizador "library" precisam do submódulo smart_traject; sem ele essas
+# requisições e as de metrics_only=1 aparecem como erros (as de metrics_only=analytics não dependem dele).
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+import app.utils as utils
+from app.cameras import CameraRegistry
+from app.ingest import upsert_trajectories
+from app.jobs import make_rollup_store
+from app.parsing import parse_txt_file
+from benchmarks.synthetic import generate_txt
+from config import (POINTS_STORAGE, INGEST_BATCH_SIZE, INGEST_MERGE_GAP_SECONDS, INGEST_PARSE_WORKERS,
+                    COLLECTION_TRAJ, COLLECTION_CAM, COLLECTION_CACHE_EVENTS, COLLECTION_JOBS, COLLECTION_ROLLUPS)
+
+STAGES = ('parse', 'ingest', 'load', 'routes')
+BENCH_DB = 'smart-trajectories-bench'
+BENCH_DATE = '2023-06-21'
+IMAGE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'data', 'input_data', 'img', 'Fisica_20250414082245.jpg')
+
+# Parâmetros de cada rota de plot, além de câmera, data e limites do gráfico
+ROUTES = {
+    '/plot_with_background': {},
+    '/plot_one_category': {'category': 2},
+    '/plot_with_limits': {'category': 2, 'reference_line': 'LINESTRING (900 0, 900 1080)'},
+    '/plot_start_finish': {'category': 2, 'departure_line': 'LINESTRING (500 0, 500 1080)',
+                           'finish_line': 'LINESTRING (1400 0, 1400 1080)'},
+    '/plot_with_stopped': {'category': 2, 'stop_threshold': 3, 'min_duration': 2, 'noise_tolerance': 2},
+    '/plot_with_stop_rec': {'category': 2, 'stop_threshold': 3, 'min_duration': 2, 'noise_tolerance': 2,
+                            'rect_min_x': 400, 'rect_max_x': 1200, 'rect_min_y': 200, 'rect_max_y': 800},
+    '/plot_monitored_area': {'category': 2, 'rect_min_x': 400, 'rect_max_x': 1200, 'rect_min_y': 200,
+                             'rect_max_y': 800}
+}
+
+
+def _reset_peak_rss():
+    # Zera o pico de RSS do processo (Linux: VmHWM), para medir cada etapa separadamente
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Sem /proc: pico do processo inteiro (KB no Linux, bytes no macOS)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def measure(operations, items):
+    # Executa as operações (funções sem argumentos) em sequência e resume a etapa.
+    # items: quantidade processada no total (pontos, requisições) para a vazão.
+    _reset_peak_rss()
+    latencies = []
+    errors = 0
+    for operation in operations:
+        start = time.perf_counter()
+        ok = operation()
+        latencies.append(time.perf_counter() - start)
+        errors += ok is False
+    total = sum(latencies)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'operations': len(operations),
+        'items': items,
+        'errors': errors,
+        'seconds': total,
+        'items_per_second': items / total if total else 0.0,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'peak_rss_mb': _peak_rss_mb()
+    }
+
+
+def _time_window():
+    start = datetime.fromisoformat(BENCH_DATE).replace(tzinfo=timezone.utc)
+    return start, start.replace(hour=23, minute=59, second=59)
+
+
+def _open_database(mongo_uri):
+    if mongo_uri:
+        from pymongo import MongoClient
+        database = MongoClient(mongo_uri)[BENCH_DB]
+    else:
+        import mongomock
+        from benchmarks.mongomock_compat import patch_mongomock_bulk_write
+        patch_mongomock_bulk_write()
+        database = mongomock.MongoClient()[BENCH_DB]
+    for name in (COLLECTION_TRAJ, COLLECTION_CAM, COLLECTION_CACHE_EVENTS, COLLECTION_JOBS, COLLECTION_ROLLUPS):
+        database.drop_collection(name)
+    return database
+
+
+def run_parse(files, repeat):
+    points = 0
+    operations = []
+    for path in files.values():
+        points += parse_txt_file(path, workers=INGEST_PARSE_WORKERS)['t'].size * repeat
+        operations += [lambda path=path: parse_txt_file(path, workers=INGEST_PARSE_WORKERS)] * repeat
+    return measure(operations, points)
+
+
+def run_ingest(files, database, rollups):
+    collection = database[COLLECTION_TRAJ]
+    parsed = {camera: parse_txt_file(path, workers=INGEST_PARSE_WORKERS) for camera, path in files.items()}
+
+    def ingest(camera):
+        upsert_trajectories(parsed[camera], collection, camera, layout=POINTS_STORAGE,
+                            merge_gap=INGEST_MERGE_GAP_SECONDS, batch_size=INGEST_BATCH_SIZE, rollups=rollups)
+
+    points = sum(arrays['t'].size for arrays in parsed.values())
+    return measure([lambda camera=camera: ingest(camera) for camera in parsed], points)
+
+
+def run_load(cameras, database, repeat):
+    utils.collection_traj = database[COLLECTION_TRAJ]
+    window = _time_window()
+    points = sum(utils.fetch_trajectory_arrays({'background': camera}, window)['timestamp'].size
+                 for camera in cameras) * repeat
+    operations = [lambda camera=camera: utils.create_trajectory_collection_mongodb({'background': camera}, window)
+                  for camera in cameras] * repeat
+    return measure(operations, points)
+
+
+def run_routes(cameras, database, rollups, repeat):
+    # Cada rota duas vezes: com a imagem e só com as métricas. Caches desligados para medir o trabalho real.
+    try:
+        import run
+    except ImportError as e:
+        return {'skipped': f'run.py não importável: {e}'}
+
+    run.collection_traj = utils.collection_traj = database[COLLECTION_TRAJ]
+    run.collection_cam = database[COLLECTION_CAM]
+    run.collection_cache_events = database[COLLECTION_CACHE_EVENTS]
+    run.collection_jobs = database[COLLECTION_JOBS]
+    run.camera_registry = CameraRegistry(run.collection_cam)
+    run.rollup_store = rollups
+    run.response_cache = None
+    run.trajectory_cache = None
+    client = run.app.test_client()
+
+    def call(path, data):
+        return client.post(path, data=data).status_code == 200
+
+    results = {}
+    for path, params in ROUTES.items():
+        for metrics_only in (None, '1', 'analytics'):
+            operations = []
+            for camera in cameras:
+                data = dict(params, camera=camera, selected_date=BENCH_DATE, start_time=0, end_time=23.99,
+                            xsize=10, ysize=6, xlim1=0, xlim2=1920, ylim1=1080, ylim2=0, no_cache=1)
+                if metrics_only:
+                    data['metrics_only'] = metrics_only
+                operations += [lambda data=data, path=path: call(path, data)] * repeat
+            label = f"{path}{f' metrics_only={metrics_only}' if metrics_only else ''}"
+            results[label] = measure(operations, len(operations))
+    return results
+
+
+def compare(baseline, current, tolerance):
+    # Regressões: vazão abaixo de (1 - tolerance) da baseline ou p95 acima de (1 + tolerance)
+    regressions = []
+    for stage, result in current.items():
+        reference = baseline.get(stage)
+        if not reference or 'skipped' in reference or 'skipped' in result:
+            continue
+        throughput = result['items_per_second'] / reference['items_per_second'] if reference['items_per_second'] else 1
+        p95 = result['p95_ms'] / reference['p95_ms'] if reference['p95_ms'] else 1
+        regressed = throughput < 1 - tolerance or p95 > 1 + tolerance
+        print(f"{stage:44s} vazão {throughput:6.2f}x  p95 {p95:6.2f}x{'  REGRESSÃO' if regressed else ''}")
+        if regressed:
+            regressions.append(stage)
+    return regressions
+
+
+def print_results(results):
+    for stage, result in results.items():
+        if 'skipped' in result:
+            print(f"{stage:44s} pulada ({result['skipped']})")
+            continue
+        print(f"{stage:44s} {result['items_per_second']:12.0f} itens/s  p50 {result['p50_ms']:9.1f} ms  "
+              f"p95 {result['p95_ms']:9.1f} ms  p99 {result['p99_ms']:9.1f} ms  "
+              f"RSS {result['peak_rss_mb']:7.0f} MB  erros {result['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Suíte de benchmarks: ingestão, consulta e renderização")
+    parser.add_argument('--tracks', type=int, default=2000, help='Trajetórias por câmera')
+    parser.add_argument('--points', type=int, default=150, help='Pontos por trajetória (média)')
+    parser.add_argument('--cameras', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3, help='Repetições por câmera (parse, load e rotas)')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--mongo-uri', help='Usa um mongod real (banco smart-trajectories-bench) em vez do mongomock')
+    parser.add_argument('--save', metavar='JSON', help='Salva o resultado como baseline')
+    parser.add_argument('--compare', metavar='JSON', help='Compara com uma baseline salva')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    database = _open_database(args.mongo_uri)
+    rollups = make_rollup_store(database[COLLECTION_ROLLUPS])
+    cameras = [f'bench-{i}' for i in range(args.cameras)]
+    for camera in cameras:
+        database[COLLECTION_CAM].insert_one({'name': camera, 'image_path': IMAGE_PATH,
+                                             'created_at': datetime.now(timezone.utc)})
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        start_epoch = _time_window()[0].timestamp()
+        files = {camera: generate_txt(os.path.join(tmp, f'{camera}.txt'), args.tracks, args.points,
+                                      start_epoch=start_epoch, duration_hours=20, seed=i)
+                 for i, camera in enumerate(cameras)}
+
+        if 'parse' in args.stages:
+            results['parse'] = run_parse(files, args.repeat)
+        # Consultas e rotas precisam dos dados ingeridos
+        if {'ingest', 'load', 'routes'} & set(args.stages):
+            results['ingest'] = run_ingest(files, database, rollups)
+        if 'load' in args.stages:
+            results['load'] = run_load(cameras, database, args.repeat)
+        if 'routes' in args.stages:
+            routes = run_routes(cameras, database, rollups, args.repeat)
+            if 'skipped' in routes:
+                results['routes'] = routes
+            else:
+                results.update({f'route {label}': result for label, result in routes.items()})
+
+    print(f"{args.cameras} câmeras x {args.tracks} trajetórias x ~{args.points} pontos "
+          f"({'mongod' if args.mongo_uri else 'mongomock'})")
+    print_results(results)
+
+    if args.mongo_uri:
+        database.client.drop_database(BENCH_DB)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'backend': 'mongod' if args.mongo_uri else 'mongomock',
+                'params': {'tracks': args.tracks, 'points': args.points, 'cameras': args.cameras,
+                           'repeat': args.repeat},
+                'results': results
+            }, f, indent=2)
+        print(f"Baseline salva em {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline['params'] != {'tracks': args.tracks, 'points': args.points, 'cameras': args.cameras,
+                                  'repeat': args.repeat}:
+            print(f"Atenção: baseline gerada com outros parâmetros: {baseline['params']}")
+        regressions = compare(baseline['results'], results, args.tolerance)
+        if regressions:
+            sys.exit(f"{len(regressions)} etapa(s) com regressão acima de {args.tolerance:.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# Geração de arquivos TXT sintéticos no formato do rastreador (data/input_data/txt):
+#   "id, categoria, início, fim, [(x, y), (x, y), ...]"
+# com início/fim em epoch seconds ou em "AAAA-MM-DD HH:MM:SS.ffffff" (rota _datetime).
+from datetime import datetime, timezone
+
+import numpy as np
+
+
+def _format_time(epoch, datetime_format):
+    if datetime_format:
+        return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%d %H:%M:%S.%f')
+    return repr(epoch)
+
+
+def generate_txt(path, tracks=1000, points_per_track=150, start_epoch=1687334400.0, duration_hours=8,
+                 categories=8, datetime_format=False, seed=0):
+    # Escreve `tracks` trajetórias com ~points_per_track pontos cada (passeio aleatório em pixels).
+    rng = np.random.default_rng(seed)
+    with open(path, 'w') as f:
+        for identifier in range(1, tracks + 1):
+            n = max(1, int(rng.integers(points_per_track // 2, points_per_track * 3 // 2 + 1)))
+            start = start_epoch + float(rng.uniform(0, duration_hours * 3600))
+            end = start + n * float(rng.uniform(0.05, 0.2))
+            x = np.clip(np.cumsum(rng.integers(-8, 9, n)) + int(rng.integers(100, 1800)), 0, 1919)
+            y = np.clip(np.cumsum(rng.integers(-8, 9, n)) + int(rng.integers(100, 980)), 0, 1079)
+            points = ', '.join(f'({xi}, {yi})' for xi, yi in zip(x.tolist(), y.tolist()))
+            f.write(f"{identifier}, {int(rng.integers(0, categories))}, "
+                    f"{_format_time(start, datetime_format)}, {_format_time(end, datetime_format)}, [{points}]\n")
+    return path
+
+
+def generate_point_arrays(tracks=1000, points_per_track=150, start_epoch=1687334400.0, duration_hours=24,
+                          categories=8, dwell_fraction=0.3, seed=0):
+    # Pontos no formato de fetch_trajectory_arrays (identifier, category, timestamp, x, y), com
+    # trechos de permanência: em dwell_fraction dos passos o objeto anda no máximo 2 px.
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(points_per_track // 2, points_per_track * 3 // 2 + 1, tracks)
+    total = int(counts.sum())
+    starts = np.cumsum(counts) - counts
+    first = np.zeros(total, dtype=bool)
+    first[starts] = True
+
+    # Trechos parados e em movimento se alternam em blocos de ~20 passos
+    block = np.cumsum(rng.random(total) < 0.05)
+    dwelling = (rng.random(block.max() + 1) < dwell_fraction)[block]
+    step_x = np.where(dwelling, rng.integers(-1, 2, total), rng.integers(-12, 13, total))
+    step_y = np.where(dwelling, rng.integers(-1, 2, total), rng.integers(-12, 13, total))
+    step_x[first] = rng.integers(100, 1800, tracks)
+    step_y[first] = rng.integers(100, 980, tracks)
+
+    # Soma acumulada por trajetória: desconta o acumulado até o início de cada uma
+    owner = np.repeat(np.arange(tracks), counts)
+    x = np.cumsum(step_x)
+    y = np.cumsum(step_y)
+    x = x - np.repeat(x[starts] - step_x[starts], counts)
+    y = y - np.repeat(y[starts] - step_y[starts], counts)
+
+    t0 = start_epoch + rng.uniform(0, duration_hours * 3600, tracks)
+    dt = rng.uniform(0.1, 0.5, tracks)
+    local_index = np.arange(total) - np.repeat(starts, counts)
+    return {
+        'identifier': (owner + 1).astype(np.float64),
+        'category': np.repeat(rng.integers(0, categories, tracks), counts).astype(np.float64),
+        'timestamp': t0[owner] + local_index * dt[owner],
+        'x': x.astype(np.float64),
+        'y': y.astype(np.float64)
+    }
@@ -10,6 +10,140 @@ MONGODB_URI = os.getenv("MONGO_URI", "mongodb://mongo_db:27017/")
 DB_NAME = "smart-trajectories"
 COLLECTION_TRAJ = "trajectories"
 COLLECTION_CAM = "cameras"
+COLLECTION_JOBS = "ingest_jobs"
+COLLECTION_CACHE_EVENTS = "cache_invalidations"
+COLLECTION_ROLLUPS = "rollups"
+
+# Pool de conexões do MongoClient compartilhado por processo (app/db.py). Com o gunicorn em gthread,
+# MONGO_MAX_POOL_SIZE deve ser >= GUNICORN_THREADS. Timeouts em ms (0 = padrão do pymongo, sem limite).
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "32"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+# Espera por uma conexão livre quando o pool está todo em uso
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))
+
+# Servidor de produção (gunicorn.conf.py): processos, threads por processo (worker gthread: as rotas
+# passam a maior parte do tempo esperando o MongoDB) e tempo máximo de uma requisição
+GUNICORN_BIND = os.getenv("GUNICORN_BIND", "0.0.0.0:5002")
+GUNICORN_WORKERS = int(os.getenv("GUNICORN_WORKERS", str(min(4, os.cpu_count() or 1))))
+GUNICORN_WORKER_CLASS = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+GUNICORN_THREADS = int(os.getenv("GUNICORN_THREADS", "8"))
+GUNICORN_TIMEOUT = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+GUNICORN_KEEPALIVE = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+# Recicla o processo após N requisições (0 = nunca), com variação aleatória para não reciclar todos juntos
+GUNICORN_MAX_REQUESTS = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+GUNICORN_MAX_REQUESTS_JITTER = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+# Importa a aplicação e as bibliotecas pesadas (pandas, matplotlib, geopandas, movingpandas) no master,
+# antes do fork: os processos sobem já prontos e compartilham essas páginas de memória (copy-on-write).
+# Sem preload, cada processo importa as bibliotecas sob demanda, na primeira requisição que as usa.
+GUNICORN_PRELOAD = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+
+# Layout dos pontos gravados nas trajetórias: "points" (subdocumentos ISO/WKT) ou "packed" (arrays binários)
+POINTS_STORAGE = os.getenv("POINTS_STORAGE", "points")
+
+# Cria os índices das coleções ao iniciar a aplicação
+ENSURE_INDEXES_ON_STARTUP = os.getenv("ENSURE_INDEXES_ON_STARTUP", "1") == "1"
+
+# Ingestão de TXT: "batch" (conversão completa em memória) ou "streaming" (lotes de tamanho fixo)
+INGEST_MODE = os.getenv("INGEST_MODE", "batch")
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+
+# Ingestão incremental: trajetórias identificadas por (câmera, identifier, start_time), gravadas com
+# upsert; reenvios não duplicam e partes de uma trajetória separadas por até
+# INGEST_MERGE_GAP_SECONDS (arquivos consecutivos do rastreador) são mescladas. Desligada por padrão
+# (o upload insere as trajetórias, como antes); cada upload pode pedir com upsert=1
+INGEST_UPSERT = os.getenv("INGEST_UPSERT", "0") == "1"
+INGEST_MERGE_GAP_SECONDS = float(os.getenv("INGEST_MERGE_GAP_SECONDS", "2"))
+
+# Ingestão assíncrona: o upload devolve um job id e o processamento roda num pool de processos
+INGEST_ASYNC = os.getenv("INGEST_ASYNC", "0") == "1"
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+
+# Jobs órfãos (processo morto no meio da ingestão): o job em execução grava um heartbeat a cada
+# INGEST_JOB_HEARTBEAT_SECONDS; a cada INGEST_JOB_RECOVERY_SECONDS os processos web procuram jobs
+# sem sinal (ou parados na fila) há INGEST_JOB_STALE_SECONDS e os reenviam (com upsert, até
+# INGEST_JOB_MAX_ATTEMPTS tentativas) ou os marcam como falhos
+INGEST_JOB_HEARTBEAT_SECONDS = float(os.getenv("INGEST_JOB_HEARTBEAT_SECONDS", "30"))
+INGEST_JOB_STALE_SECONDS = float(os.getenv("INGEST_JOB_STALE_SECONDS", "300"))
+INGEST_JOB_RECOVERY_SECONDS = float(os.getenv("INGEST_JOB_RECOVERY_SECONDS", "60"))
+INGEST_JOB_MAX_ATTEMPTS = int(os.getenv("INGEST_JOB_MAX_ATTEMPTS", "3"))
+
+# Processos usados no parsing paralelo dos TXT grandes (padrão: todos os núcleos)
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", str(os.cpu_count() or 1)))
+
+# Grava também o CSV intermediário (só para arquivamento; a ingestão não depende dele)
+ARCHIVE_CSV = os.getenv("ARCHIVE_CSV", "1") == "1"
+
+# Cache das respostas de plot: LRU em memória e, se RESPONSE_CACHE_DIR for definido, também em disco
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+RESPONSE_CACHE_MAX_MB = int(os.getenv("RESPONSE_CACHE_MAX_MB", "256"))
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "")
+RESPONSE_CACHE_DISK_MAX_MB = int(os.getenv("RESPONSE_CACHE_DISK_MAX_MB", "1024"))
+# Intervalo mínimo (segundos) entre leituras das invalidações feitas por outros processos
+RESPONSE_CACHE_POLL_SECONDS = float(os.getenv("RESPONSE_CACHE_POLL_SECONDS", "1"))
+# Janela (segundos) que cada leitura volta antes do último evento visto: cobre relógios
+# diferentes entre processos/hosts e eventos gravados fora de ordem
+RESPONSE_CACHE_EVENT_OVERLAP_SECONDS = float(os.getenv("RESPONSE_CACHE_EVENT_OVERLAP_SECONDS", "60"))
+
+# Cache dos pontos buscados para os plots: validade (segundos) e limite de memória
+TRAJECTORY_CACHE_ENABLED = os.getenv("TRAJECTORY_CACHE_ENABLED", "1") == "1"
+TRAJECTORY_CACHE_TTL_SECONDS = int(os.getenv("TRAJECTORY_CACHE_TTL_SECONDS", "300"))
+TRAJECTORY_CACHE_MAX_MB = int(os.getenv("TRAJECTORY_CACHE_MAX_MB", "512"))
+
+# Cache das câmeras: memória para as imagens de fundo decodificadas e maior lado (px; 0 = tamanho original)
+CAMERA_CACHE_MAX_MB = int(os.getenv("CAMERA_CACHE_MAX_MB", "256"))
+# Segundos até o documento da câmera ser conferido de novo no MongoDB (câmeras removidas saem do cache)
+CAMERA_CACHE_TTL_SECONDS = float(os.getenv("CAMERA_CACHE_TTL_SECONDS", "30"))
+CAMERA_BACKGROUND_MAX_SIDE = int(os.getenv("CAMERA_BACKGROUND_MAX_SIDE", "0"))
+
+# Renderização dos plots: DPI calculado a partir do tamanho exibido (xsize * 37.8 px vezes a
+# densidade de pixels da tela), limitado a [RENDER_MIN_DPI, RENDER_MAX_DPI]
+RENDER_PIXEL_RATIO = float(os.getenv("RENDER_PIXEL_RATIO", "2"))
+RENDER_MIN_DPI = float(os.getenv("RENDER_MIN_DPI", "72"))
+RENDER_MAX_DPI = float(os.getenv("RENDER_MAX_DPI", "300"))
+# Tamanho máximo (bytes) das métricas no cabeçalho X-Plot-Metrics das imagens binárias: acima disso
+# (proxies costumam recusar cabeçalhos de resposta maiores que 4-8 KB) a resposta vai em JSON, com a
+# imagem em base64 e as métricas no corpo
+PLOT_METRICS_HEADER_MAX_BYTES = int(os.getenv("PLOT_METRICS_HEADER_MAX_BYTES", "4096"))
+# Reduz os pontos desenhados à resolução da imagem (as métricas usam todos os pontos): no renderizador
+# native e nos plots básico e de categoria da smart_traject com summary=analytics (o resumo da
+# biblioteca seria calculado sobre os pontos desenhados)
+RENDER_LOD = os.getenv("RENDER_LOD", "1") == "1"
+# Renderizador dos plots básico e de categoria: "library" (smart_traject) ou "native" (LineCollection)
+PLOT_RENDERER = os.getenv("PLOT_RENDERER", "library")
+# Processos de renderização por processo web, usados pelas funções de plot da smart_traject e pelo
+# renderizador native (0 = renderiza no próprio processo web, com as plotagens da biblioteca uma por
+# vez pelo lock do pyplot). Cada processo carrega matplotlib e, na primeira plotagem da biblioteca,
+# geopandas/movingpandas. Renderizações simultâneas aceitas, espera (s) por uma vaga antes de
+# responder 503 e tempo máximo (s) de cada uma, incluindo a espera por um processo livre (depois dele,
+# 504 e o processo é reiniciado). O padrão é o timeout do gunicorn: plotagens pesadas que terminavam
+# dentro dele não podem passar a falhar
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_MAX_PENDING = int(os.getenv("RENDER_MAX_PENDING", "8"))
+RENDER_QUEUE_TIMEOUT_SECONDS = float(os.getenv("RENDER_QUEUE_TIMEOUT_SECONDS", "5"))
+RENDER_TIMEOUT_SECONDS = float(os.getenv("RENDER_TIMEOUT_SECONDS", str(GUNICORN_TIMEOUT)))
+
+# Agregados por câmera/categoria/intervalo mantidos na ingestão (consultados em /rollups).
+# Mudar intervalo ou célula exige "flask rebuild-rollups".
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "1") == "1"
+ROLLUP_BUCKET_SECONDS = int(os.getenv("ROLLUP_BUCKET_SECONDS", "300"))
+# Lado (px) das células do mapa de calor
+ROLLUP_CELL_SIZE = int(os.getenv("ROLLUP_CELL_SIZE", "32"))
+
+# Exportação em /trajectories/export: trajetórias lidas do MongoDB por lote do cursor
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+# Instrumentação das requisições: tempos por etapa em /metrics (formato Prometheus) e no cabeçalho Server-Timing
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_SERVER_TIMING = os.getenv("METRICS_SERVER_TIMING", "1") == "1"
+# Profiler por amostragem para requisições com profile=1 (pilhas .folded em METRICS_PROFILE_DIR)
+METRICS_PROFILE_ENABLED = os.getenv("METRICS_PROFILE_ENABLED", "0") == "1"
+METRICS_PROFILE_INTERVAL_MS = float(os.getenv("METRICS_PROFILE_INTERVAL_MS", "5"))
+METRICS_PROFILE_DIR = os.getenv("METRICS_PROFILE_DIR", os.path.join(os.path.dirname(__file__), 'data', 'output_data', 'profiles'))
 
 # Configurações de diretórios
 INPUT_DATA_DIR = os.path.join(os.path.dirname(__file__), 'data', 'input_data', 'txt')
@@ -0,0 +1,49 @@
+# Configuração do gunicorn para produção (lida automaticamente do diretório de trabalho ou com -c).
+# Valores vêm do config.py / variáveis de ambiente GUNICORN_*.
+#
+# Worker padrão gthread: cada processo atende GUNICORN_THREADS requisições ao mesmo tempo e mantém
+# um único pool de conexões (app/db.py). Threads só rendem no tempo fora do GIL (espera pelo MongoDB,
+# savefig, NumPy); as funções de plot da biblioteca ainda passam uma por vez pelo lock do pyplot.
+# O ganho sobre processos síncronos depende da carga: meça com benchmarks/bench_server.py --compare
+# sync gthread contra a aplicação e o MongoDB reais antes de mudar o padrão em produção.
+#
+# GUNICORN_PRELOAD=1: a aplicação e as bibliotecas pesadas são importadas uma vez no master e
+# compartilhadas pelos processos (copy-on-write). Com ou sem preload, as tarefas de inicialização
+# (run.start_background_tasks) são iniciadas no post_fork, em cada processo, e nunca no master.
+from config import (GUNICORN_BIND, GUNICORN_WORKERS, GUNICORN_WORKER_CLASS, GUNICORN_THREADS, GUNICORN_TIMEOUT,
+                    GUNICORN_KEEPALIVE, GUNICORN_MAX_REQUESTS, GUNICORN_MAX_REQUESTS_JITTER, GUNICORN_PRELOAD)
+
+wsgi_app = 'run:app'
+bind = GUNICORN_BIND
+workers = GUNICORN_WORKERS
+worker_class = GUNICORN_WORKER_CLASS
+# Com threads > 1 o gunicorn troca sync por gthread sem avisar: as threads só valem para o gthread
+threads = GUNICORN_THREADS if worker_class == 'gthread' else 1
+timeout = GUNICORN_TIMEOUT
+keepalive = GUNICORN_KEEPALIVE
+max_requests = GUNICORN_MAX_REQUESTS
+max_requests_jitter = GUNICORN_MAX_REQUESTS_JITTER
+accesslog = '-'
+preload_app = GUNICORN_PRELOAD
+
+
+def when_ready(server):
+    # Master pronto (aplicação já importada se preload_app), antes de criar os processos
+    if GUNICORN_PRELOAD:
+        from app.preload import preload_modules
+        timings = preload_modules(freeze=True)
+        server.log.info("Bibliotecas pré-carregadas: " + ', '.join(
+            f"{name} {seconds:.2f} s" for name, seconds in timings.items()))
+
+
+def post_fork(server, worker):
+    # Threads não passam pelo fork: cada processo inicia as suas (sem preload, este import é o que
+    # carrega a aplicação no processo)
+    from run import start_background_tasks
+    start_background_tasks()
+
+
+def worker_exit(server, worker):
+    # Fecha as conexões do processo que está saindo
+    from app.db import close_client
+    close_client()
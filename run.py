@@ -1,47 +1,143 @@
-from flask import render_template, request, jsonify, current_app
+from flask import render_template, request, jsonify, current_app, make_response
 from werkzeug.utils import secure_filename
 import os
 import io
 import json
-import matplotlib
+import click
+import threading
+import time
 import base64
-import matplotlib.pyplot as plt
+import importlib
+import numpy as np
 from app import create_app
-from pymongo import MongoClient
-from shapely import wkt
+from pymongo.errors import DuplicateKeyError, PyMongoError
 from datetime import datetime, timezone
-from shapely.errors import ShapelyError
 from functools import wraps
 from flask.json.provider import DefaultJSONProvider
-from app.utils import CustomJSONEncoder, create_trajectory_collection_mongodb, allowed_file
-from smart_traject.smart_trajectories.convert import txt_to_csv, txt_to_csv_datetime
-from smart_traject.smart_trajectories.processing import generate_trajectory_collection
-from smart_traject.smart_trajectories.plot import (
-    plot_trajectories_with_background, plot_trajectories_one_category_background, 
-    plot_trajectories_with_stop_in_rectangle, plot_trajectories_with_limits, 
-    plot_trajectories_with_start_finish, plot_trajectories_with_stopped, 
-    plot_trajectories_in_monitored_area
-)
+from app.utils import (CustomJSONEncoder, count_trajectories, load_trajectory_arrays,
+                       trajectory_collection_from_arrays, allowed_file)
+from app.analytics import (summary_metrics, category_metrics, reference_line_metrics, start_finish_metrics,
+                           stop_metrics, stop_in_rectangle_metrics, monitored_area_metrics)
+from app.cache import (InvalidationFeed, ResponseCache, TrajectoryArrayCache, make_cache_key,
+                       record_invalidation)
+from app.cameras import CameraRegistry
+from app.db import get_database
+from app.export import EXPORT_FORMATS, arrow_chunks, iter_export_records, ndjson_chunks
+from app.indexes import ensure_indexes, verify_indexes
+from app.metrics import MetricsRegistry, install_request_metrics, record_bytes, stage
+from app.render import decimate_to_pixels, render_dpi, render_trajectories
+from app.render_farm import RenderFarm, RenderFarmBusy, RenderTimeout, shareable
+from app.summary import backfill_summaries
+from app.jobs import get_job, make_rollup_store, recover_stale_jobs, submit_ingest_job
+from app.ingest import (archive_csv_async, deduplicate_trajectories, insert_trajectories,
+                        store_trajectories_streaming, upsert_trajectories)
+from app.parsing import iter_txt_trajectories, parse_txt_file
+from app.storage import LAYOUT_PACKED, LAYOUTS, migrate_points_layout, to_json_document
 from config import (INPUT_DATA_DIR, INPUT_DATA_DIR2, OUTPUT_DATA_DIR, OUTPUT_DATA_DIR2,
-                    MONGODB_URI, DB_NAME, COLLECTION_TRAJ, COLLECTION_CAM
+                    COLLECTION_TRAJ, COLLECTION_CAM, POINTS_STORAGE,
+                    ENSURE_INDEXES_ON_STARTUP, INGEST_MODE, INGEST_BATCH_SIZE, INGEST_ASYNC,
+                    COLLECTION_JOBS, INGEST_PARSE_WORKERS, ARCHIVE_CSV, COLLECTION_CACHE_EVENTS,
+                    RESPONSE_CACHE_ENABLED, RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_MAX_MB,
+                    RESPONSE_CACHE_DIR, RESPONSE_CACHE_DISK_MAX_MB, RESPONSE_CACHE_POLL_SECONDS,
+                    RESPONSE_CACHE_EVENT_OVERLAP_SECONDS, TRAJECTORY_CACHE_ENABLED, TRAJECTORY_CACHE_TTL_SECONDS,
+                    TRAJECTORY_CACHE_MAX_MB, CAMERA_CACHE_MAX_MB, CAMERA_CACHE_TTL_SECONDS,
+                    CAMERA_BACKGROUND_MAX_SIDE, PLOT_RENDERER, RENDER_LOD, RENDER_PIXEL_RATIO, RENDER_MIN_DPI,
+                    RENDER_MAX_DPI, PLOT_METRICS_HEADER_MAX_BYTES, COLLECTION_ROLLUPS,
+                    INGEST_UPSERT, INGEST_MERGE_GAP_SECONDS, EXPORT_BATCH_SIZE, RENDER_WORKERS,
+                    RENDER_MAX_PENDING, RENDER_QUEUE_TIMEOUT_SECONDS, RENDER_TIMEOUT_SECONDS, METRICS_ENABLED,
+                    METRICS_SERVER_TIMING, METRICS_PROFILE_ENABLED, METRICS_PROFILE_INTERVAL_MS, METRICS_PROFILE_DIR,
+                    INGEST_JOB_RECOVERY_SECONDS
 )
 
-matplotlib.use('Agg')
 
 class UTF8JSONProvider(DefaultJSONProvider):
     ensure_ascii = False
 
-# Configura o MongoDB
-client = MongoClient(MONGODB_URI)
-db = client[DB_NAME]
+# Configura o MongoDB (cliente único por processo, pool configurado em config.py)
+db = get_database()
 collection_traj = db[COLLECTION_TRAJ]
 collection_cam = db[COLLECTION_CAM]
+collection_jobs = db[COLLECTION_JOBS]
+collection_cache_events = db[COLLECTION_CACHE_EVENTS]
+
+# Agregados por câmera/categoria/intervalo, mantidos na ingestão (None quando desativados)
+rollup_store = make_rollup_store(db[COLLECTION_ROLLUPS])
+
+# Cache das respostas de plot (None quando desativado)
+response_cache = ResponseCache(
+    max_entries=RESPONSE_CACHE_MAX_ENTRIES, max_bytes=RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+    disk_dir=RESPONSE_CACHE_DIR or None, max_disk_bytes=RESPONSE_CACHE_DISK_MAX_MB * 1024 * 1024
+) if RESPONSE_CACHE_ENABLED else None
+
+# Cache dos pontos buscados no MongoDB para os plots (None quando desativado)
+trajectory_cache = TrajectoryArrayCache(
+    max_bytes=TRAJECTORY_CACHE_MAX_MB * 1024 * 1024, ttl=TRAJECTORY_CACHE_TTL_SECONDS
+) if TRAJECTORY_CACHE_ENABLED else None
+
+# Câmeras em memória: documento e imagem de fundo decodificada
+camera_registry = CameraRegistry(collection_cam, max_bytes=CAMERA_CACHE_MAX_MB * 1024 * 1024,
+                                 max_side=CAMERA_BACKGROUND_MAX_SIDE, ttl=CAMERA_CACHE_TTL_SECONDS)
+
+# Processos de renderização dos plots, da biblioteca e native (None: renderiza no processo web)
+render_farm = RenderFarm(workers=RENDER_WORKERS, max_pending=RENDER_MAX_PENDING, timeout=RENDER_TIMEOUT_SECONDS,
+                         queue_timeout=RENDER_QUEUE_TIMEOUT_SECONDS) if RENDER_WORKERS > 0 else None
+
+# Invalidações feitas por outros processos chegam aos dois caches por aqui
+invalidation_feed = InvalidationFeed([response_cache, trajectory_cache], RESPONSE_CACHE_POLL_SECONDS,
+                                     RESPONSE_CACHE_EVENT_OVERLAP_SECONDS)
 
 # Cria a aplicação Flask
 app = create_app()
 app.json = UTF8JSONProvider(app)
 app.config.update(JSON_AS_ASCII=False, JSONIFY_PRETTYPRINT_REGULAR=True)
 
+# Tempos por etapa de cada requisição (None quando desativados)
+metrics_registry = MetricsRegistry() if METRICS_ENABLED else None
+if metrics_registry is not None:
+    install_request_metrics(app, metrics_registry, server_timing=METRICS_SERVER_TIMING,
+                            profile_dir=METRICS_PROFILE_DIR if METRICS_PROFILE_ENABLED else None,
+                            profile_interval=METRICS_PROFILE_INTERVAL_MS / 1000)
+
+# Garante os índices em segundo plano para não atrasar o boot caso o MongoDB demore a responder
+def _ensure_indexes_on_startup():
+    try:
+        ensure_indexes(db, COLLECTION_TRAJ, COLLECTION_CAM, COLLECTION_CACHE_EVENTS, COLLECTION_ROLLUPS)
+        for label, plan in verify_indexes(db, COLLECTION_TRAJ, COLLECTION_CAM).items():
+            if 'COLLSCAN' in plan:
+                app.logger.warning(f"Consulta '{label}' ainda faz varredura completa da coleção")
+    except PyMongoError as e:
+        app.logger.warning(f"Não foi possível garantir os índices na inicialização: {str(e)}")
+
+# Reenvia ou marca como falhos os jobs de ingestão órfãos: na inicialização e depois periodicamente
+def _recover_jobs_periodically():
+    while True:
+        try:
+            counts = recover_stale_jobs(collection_jobs)
+            if counts["requeued"] or counts["failed"]:
+                app.logger.warning(f"Jobs de ingestão órfãos: {counts['requeued']} reenviados, "
+                                   f"{counts['failed']} marcados como falhos")
+        except PyMongoError as e:
+            app.logger.warning(f"Não foi possível verificar os jobs de ingestão: {str(e)}")
+        time.sleep(INGEST_JOB_RECOVERY_SECONDS)
+
+# Tarefas em segundo plano de cada processo que atende requisições: índices, processos de renderização
+# (aquecidos antes da primeira requisição) e recuperação dos jobs de ingestão. Nada disso roda no
+# import: os comandos "flask ...", os testes e o master do gunicorn (preload) só importam a aplicação.
+# Quem inicia é o post_fork do gunicorn.conf.py, em cada processo, ou o bloco __main__ no fim deste
+# arquivo ("flask run" não inicia as tarefas).
+_background_started = False
+
+def start_background_tasks():
+    global _background_started
+    if _background_started:
+        return
+    _background_started = True
+    if ENSURE_INDEXES_ON_STARTUP:
+        threading.Thread(target=_ensure_indexes_on_startup, name='ensure-indexes', daemon=True).start()
+    if render_farm is not None:
+        threading.Thread(target=render_farm.start, name='render-farm', daemon=True).start()
+    threading.Thread(target=_recover_jobs_periodically, name='job-recovery', daemon=True).start()
+
 # API para carregar mensagens de erro
 class ApiException(Exception):
     def __init__(self, message, status_code=400):
@@ -102,10 +198,15 @@ def register_camera():
             "metadata": {"coordinate_system": "pixel", "resolution": "native"}
         }
         
-        # Inserindo no MongoDb
-        result = collection_cam.insert_one(camera_data)
+        # Inserindo no MongoDb (o índice único em 'name' barra cadastros simultâneos)
+        try:
+            result = collection_cam.insert_one(camera_data)
+        except DuplicateKeyError:
+            os.remove(image_path)
+            return jsonify({'status': 'error', 'message': f'Câmera {name} já existe'}), 409
         if not result.inserted_id:
             return jsonify({'status': 'error', 'message': 'Erro ao inserir no banco'}), 500
+        camera_registry.refresh(name)
 
         return jsonify({
             'status': 'success',
@@ -118,8 +219,28 @@ def register_camera():
         current_app.logger.error(f"Erro no registro de câmera: {str(e)}")
         return jsonify({'status': 'error', 'message': 'Erro interno do servidor'}), 500
 
+# Descarta as respostas e os pontos em cache da câmera que cruzam o intervalo recém-gravado (epoch seconds)
+def _invalidate_cached_responses(camera, start, end):
+    if start is None:
+        return
+    try:
+        record_invalidation(collection_cache_events, camera, start, end)
+    except PyMongoError as e:
+        current_app.logger.warning(f"Não foi possível registrar a invalidação do cache: {str(e)}")
+    invalidation_feed.invalidate(camera, start, end)
+
+# Resposta dos uploads com as contagens da ingestão
+def _ingest_response(stats):
+    return jsonify({
+        'status': 'success',
+        'message': f'Arquivo processado. {stats["inserted"] + stats["updated"]} trajetórias salvas com sucesso!',
+        'inserted': stats["inserted"],
+        'updated': stats["updated"],
+        'skipped': stats["skipped"]
+    }), 200
+
 # Função auxiliar para processar upload de trajetórias
-def _process_and_store_trajectory(txt_file, camera, conversion_func, csv_suffix, json_suffix, timestamp_formatter):
+def _process_and_store_trajectory(txt_file, camera, csv_suffix, json_suffix, datetime_points):
     # Processa um arquivo TXT, converte e salva no MongoDB
     try:
         # Salva o arquivo .txt
@@ -131,45 +252,57 @@ def _process_and_store_trajectory(txt_file, camera, conversion_func, csv_suffix,
         base_filename = os.path.splitext(txt_filename)[0]
         csv_filename = f"{base_filename}{csv_suffix}"
         csv_file_path = os.path.join(OUTPUT_DATA_DIR, csv_filename)
+        json_filename = f"{base_filename}{json_suffix}"
+        json_file_path = os.path.join(OUTPUT_DATA_DIR2, json_filename)
 
-        # Conversão para CSV
-        conversion_func(txt_file_path, csv_file_path)
-        
-        # Geração da coleção de trajetórias
-        traj_collection = generate_trajectory_collection(csv_file_path)
-        
-        mongo_docs = []
-        for traj in traj_collection:
-            trajectory_data = {
-                "identifier": traj.id,
-                "category": traj.df['category'].iloc[0],
-                "start_time": traj.get_start_time(),
-                "end_time": traj.get_end_time(),
-                "geometry": traj.to_linestring().wkt,
-                "background": camera,
-                "points": [
-                    {"timestamp": timestamp_formatter(row.name), "geometry": row.geometry.wkt}
-                    for _, row in traj.df.iterrows()
-                ]
-            }
-            mongo_docs.append(trajectory_data)
-        
-        # Insere no MongoDB
-        docs_count = 0
-        if mongo_docs:
-            result = collection_traj.insert_many(mongo_docs)
-            docs_count = len(result.inserted_ids)
+        # Ingestão incremental (padrão INGEST_UPSERT): não duplica reenvios e mescla trajetórias
+        # que continuam de um arquivo para o outro
+        upsert = request.form.get('upsert', '1' if INGEST_UPSERT else '0') == '1'
+
+        if request.form.get('async', '1' if INGEST_ASYNC else '0') == '1':
+            # Processamento em segundo plano: devolve o job para acompanhamento em /jobs/<id>
+            job_id = submit_ingest_job(collection_jobs, camera, txt_file_path, json_file_path,
+                                       csv_file_path if ARCHIVE_CSV else None,
+                                       datetime_points=datetime_points, upsert=upsert)
+            return jsonify({
+                'status': 'accepted',
+                'message': 'Arquivo recebido. Processamento em andamento.',
+                'job_id': job_id,
+                'status_url': f'/jobs/{job_id}'
+            }), 202
+
+        if request.form.get('ingest_mode', INGEST_MODE) == 'streaming':
+            # Leitura incremental do TXT e gravação em lotes: memória constante
+            stats = store_trajectories_streaming(
+                iter_txt_trajectories(txt_file_path, datetime_input=datetime_points),
+                collection_traj, camera, json_file_path, csv_file_path if ARCHIVE_CSV else None,
+                datetime_points=datetime_points, layout=POINTS_STORAGE, batch_size=INGEST_BATCH_SIZE,
+                rollups=rollup_store, upsert=upsert, merge_gap=INGEST_MERGE_GAP_SECONDS)
+            _invalidate_cached_responses(camera, stats["start"], stats["end"])
+            return _ingest_response(stats)
+
+        # Parser em blocos (paralelo para arquivos grandes) direto para arrays em memória
+        arrays = parse_txt_file(txt_file_path, datetime_input=datetime_points, workers=INGEST_PARSE_WORKERS)
+
+        # O CSV passa a ser só arquivamento, gravado fora do caminho crítico
+        if ARCHIVE_CSV:
+            archive_csv_async(arrays, csv_file_path)
+
+        if upsert:
+            mongo_docs, stats = upsert_trajectories(
+                arrays, collection_traj, camera, datetime_points, POINTS_STORAGE,
+                merge_gap=INGEST_MERGE_GAP_SECONDS, batch_size=INGEST_BATCH_SIZE, rollups=rollup_store)
+        else:
+            # Insere no MongoDB; as trajetórias já gravadas (mesma chave) são ignoradas
+            mongo_docs, stats = insert_trajectories(arrays, collection_traj, camera, datetime_points,
+                                                    POINTS_STORAGE, rollups=rollup_store)
+        _invalidate_cached_responses(camera, stats["start"], stats["end"])
         
         # Cria e salva o JSON
-        json_filename = f"{base_filename}{json_suffix}"
-        json_file_path = os.path.join(OUTPUT_DATA_DIR2, json_filename)
         with open(json_file_path, 'w') as f:
-            json.dump(mongo_docs, f, cls=CustomJSONEncoder)
+            json.dump([to_json_document(doc) for doc in mongo_docs], f, cls=CustomJSONEncoder)
         
-        return jsonify({
-            'status': 'success',
-            'message': f'Arquivo processado. {docs_count} trajetórias salvas com sucesso!'
-        }), 200
+        return _ingest_response(stats)
 
     except Exception as e:
         current_app.logger.error(f"Erro ao processar o arquivo: {str(e)}")
@@ -188,8 +321,8 @@ def upload_txt_to_csv():
     if not collection_cam.find_one({'name': camera}):
         return jsonify({'status': 'error', 'message': f'Câmera {camera} não cadastrada'}), 404
 
-    return _process_and_store_trajectory(txt_file, camera, txt_to_csv,
-        '_converted.csv', '_converted.json', lambda ts: ts.isoformat())
+    return _process_and_store_trajectory(txt_file, camera,
+        '_converted.csv', '_converted.json', datetime_points=False)
 
 @app.route('/upload_txt_to_csv_datetime', methods=['POST'])
 def upload_txt_to_csv_datetime():
@@ -204,53 +337,67 @@ def upload_txt_to_csv_datetime():
     if not collection_cam.find_one({'name': camera}):
         return jsonify({'status': 'error', 'message': f'Câmera {camera} não cadastrada'}), 404
 
-    return _process_and_store_trajectory(txt_file, camera, txt_to_csv_datetime,
-        '_converted_datetime.csv', '_converted_datetime.json', lambda ts: ts)
+    return _process_and_store_trajectory(txt_file, camera,
+        '_converted_datetime.csv', '_converted_datetime.json', datetime_points=True)
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = get_job(collection_jobs, job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': f'Job {job_id} não encontrado'}), 404
+    # "status" é o da API, como nas demais rotas; o estado do job fica em job.status
+    return jsonify({'status': 'success', 'job': job})
+
+# Janela de consulta: data selecionada + horas decimais de início e fim (UTC)
+def _parse_time_window(selected_date, start_time, end_time):
+    base_date = datetime.fromisoformat(selected_date)
+    start_time = float(start_time)
+    end_time = float(end_time)
+
+    hours_init = int(start_time)
+    minutes_init = int((start_time - hours_init) * 60)
+    query_date_start = base_date.replace(hour=hours_init, minute=minutes_init, tzinfo=timezone.utc)
+    
+    hours_end = int(end_time)
+    minutes_end = int((end_time - hours_end) * 60)
+    query_date_end = base_date.replace(hour=hours_end, minute=minutes_end, tzinfo=timezone.utc)
+    return query_date_start, query_date_end
 
 # Função auxiliar para rotas de plot
 def _validate_common_plot_params():
     # Valida e extrai parâmetros comuns das rotas de plotagem
-    camera = request.form.get('camera')
+    camera = request.values.get('camera')
     if not camera:
         raise ApiException("Nome da câmera obrigatório", status_code=400)
 
-    camera_data = collection_cam.find_one({'name': camera})
+    camera_data = camera_registry.get(camera)
     if not camera_data:
         raise ApiException(f"Câmera '{camera}' não encontrada", status_code=404)
 
     image_path = camera_data.get('image_path')
-    if not image_path or not os.path.isfile(image_path):
+    if camera_data['image_mtime'] is None:
         raise ApiException(f"Imagem para a câmera '{camera}' não disponível", status_code=404)
 
-    selected_date = request.form.get('selected_date')
+    selected_date = request.values.get('selected_date')
     if not selected_date:
         raise ApiException("Parâmetro de seleção de data obrigatório", status_code=400)
 
     try:
-        base_date = datetime.fromisoformat(selected_date)
-        start_time = float(request.form.get('start_time', 0))
-        end_time = float(request.form.get('end_time', 24))
+        query_date_start, query_date_end = _parse_time_window(
+            selected_date, request.values.get('start_time', 0), request.values.get('end_time', 24))
     except (ValueError, TypeError):
         raise ApiException("Formato de data ou hora inválido", status_code=400)
 
     # Construção da query
     query = {"background": camera}
-    hours_init = int(start_time)
-    minutes_init = int((start_time - hours_init) * 60)
-    query_date_start = base_date.replace(hour=hours_init, minute=minutes_init, tzinfo=timezone.utc)
-    
-    hours_end = int(end_time)
-    minutes_end = int((end_time - hours_end) * 60)
-    query_date_end = base_date.replace(hour=hours_end, minute=minutes_end, tzinfo=timezone.utc)
-    
     query["start_time"] = {"$lte": query_date_end}
     query["end_time"] = {"$gte": query_date_start}
 
     try:
         plot_params = {
-            'xsize': float(request.form.get('xsize', 10)), 'ysize': float(request.form.get('ysize', 10)),
-            'xlim1': float(request.form.get('xlim1', 0)), 'xlim2': float(request.form.get('xlim2', 100)),
-            'ylim1': float(request.form.get('ylim1', 0)), 'ylim2': float(request.form.get('ylim2', 100))
+            'xsize': float(request.values.get('xsize', 10)), 'ysize': float(request.values.get('ysize', 10)),
+            'xlim1': float(request.values.get('xlim1', 0)), 'xlim2': float(request.values.get('xlim2', 100)),
+            'ylim1': float(request.values.get('ylim1', 0)), 'ylim2': float(request.values.get('ylim2', 100))
         }
         # Adiciona min/max para simplificar
         plot_params.update({
@@ -262,60 +409,442 @@ def _validate_common_plot_params():
     except (ValueError, TypeError):
         raise ApiException("Parâmetro numérico de plotagem inválido", status_code=400)
 
-    return {"query": query, "image_path": image_path, "plot_params": plot_params}
+    return {"camera": camera, "query": query, "time_window": (query_date_start, query_date_end),
+            "image_path": image_path, "plot_params": plot_params}
+
+# Pontos da consulta das rotas de plot, reaproveitando os já buscados quando possível.
+# bbox: (min_x, max_x, min_y, max_y), só as trajetórias que podem cruzar a área/linha analisada
+def _load_trajectory_arrays(common_params, bbox=None):
+    if trajectory_cache is not None:
+        invalidation_feed.poll(collection_cache_events)
+    return load_trajectory_arrays(common_params['query'], common_params['time_window'],
+                                  cache=trajectory_cache, bbox=bbox)
+
+# Pontos das rotas de plot da biblioteca; 404 se nenhuma trajetória tiver ao menos 2 pontos (o
+# TrajectoryCollection ficaria vazio). Sempre com todos os pontos: o nível de detalhe (RENDER_LOD)
+# é aplicado depois, em _generate_plot_response, só aos pontos desenhados.
+def _load_plot_arrays(common_params, message):
+    arrays = _load_trajectory_arrays(common_params)
+    identifiers = arrays['identifier']
+    if identifiers.size == 0 or np.unique(identifiers).size == identifiers.size:
+        raise ApiException(message, status_code=404)
+    return arrays
+
+# Modo "só métricas":
+# - metrics_only=1: a própria função de plot da smart_traject calcula o resumo (mesmas chaves e
+#   semântica da resposta com imagem), mas a figura é descartada sem savefig nem codificação;
+# - metrics_only=analytics: métricas de app.analytics direto sobre os arrays, sem TrajectoryCollection
+#   nem pyplot. Mais rápido, mas com chaves e regras próprias (não é o resumo da biblioteca). Nas
+#   rotas de parada, as paradas são as de app.analytics.detect_stops (regras descritas lá).
+# Nas respostas com imagem, summary=analytics troca o resumo da biblioteca pelo de app.analytics
+# sobre os mesmos arrays. A interface usa metrics_only=analytics e summary=analytics, então mostra
+# as mesmas chaves nos dois botões e o botão de métricas não passa pelo pyplot.
+METRICS_LIBRARY = 'library'
+METRICS_ANALYTICS = 'analytics'
+
+def _metrics_only_requested():
+    value = request.values.get('metrics_only')
+    if value == '1':
+        return METRICS_LIBRARY
+    if value == METRICS_ANALYTICS:
+        return METRICS_ANALYTICS
+    return None
+
+def _analytics_summary_requested():
+    return request.values.get('summary') == METRICS_ANALYTICS
+
+# bbox: (min_x, max_x, min_y, max_y) da área/linha analisada. Só os pontos das trajetórias cujo
+# resumo gravado na ingestão cruza esse bbox são lidos; o total de trajetórias é contado no MongoDB
+# com a regra de group_points (ao menos 2 pontos na janela), sem trazer as coordenadas.
+def _generate_metrics_response(common_params, metrics_function, *m_args, bbox=None, **m_kwargs):
+    if bbox is not None:
+        with stage('decode'):
+            total = count_trajectories(common_params['query'], common_params['time_window'])
+        if total == 0:
+            raise ApiException('Nenhuma trajetória encontrada para os filtros aplicados', status_code=404)
+        m_kwargs['total_trajectories'] = total
+        arrays = _load_trajectory_arrays(common_params, bbox)
+    else:
+        arrays = _load_trajectory_arrays(common_params)
+        if arrays['timestamp'].size == 0:
+            raise ApiException('Nenhuma trajetória encontrada para os filtros aplicados', status_code=404)
+
+    with stage('analysis'):
+        result = metrics_function(arrays, *m_args, **m_kwargs)
+    return jsonify({
+        "status": "success",
+        "metrics": {"summary": result, "source": METRICS_ANALYTICS}
+    })
 
-# Função para criar e retornar uma plotagem.
-def _generate_plot_response(plot_function, *p_args, **kw_args):
+# Geometrias WKT dos parâmetros (shapely importado só pelas rotas que recebem linhas)
+def _load_wkt(message, *values):
+    from shapely import wkt
+    from shapely.errors import ShapelyError
+    try:
+        return [wkt.loads(value) for value in values]
+    except ShapelyError:
+        raise ApiException(message, status_code=400)
+
+# bbox de geometrias shapely no formato de _generate_metrics_response
+def _geometry_bbox(*geometries):
+    bounds = [geometry.bounds for geometry in geometries]
+    return (min(b[0] for b in bounds), max(b[2] for b in bounds),
+            min(b[1] for b in bounds), max(b[3] for b in bounds))
+
+def _rect_bbox(rect_params):
+    return (min(rect_params['rect_min_x'], rect_params['rect_max_x']),
+            max(rect_params['rect_min_x'], rect_params['rect_max_x']),
+            min(rect_params['rect_min_y'], rect_params['rect_max_y']),
+            max(rect_params['rect_min_y'], rect_params['rect_max_y']))
+
+# Formatos binários aceitos para a imagem do plot (parâmetro "format"; padrão: JSON com base64)
+IMAGE_FORMATS = {'png': 'image/png', 'webp': 'image/webp'}
+
+def _requested_image_format():
+    image_format = request.values.get('format', 'json').lower()
+    if image_format != 'json' and image_format not in IMAGE_FORMATS:
+        raise ApiException(f"Formato de imagem não suportado: {image_format}", status_code=400)
+    return image_format
+
+# Resposta com a imagem renderizada: JSON com base64 (padrão) ou a imagem direto no corpo (em JSON
+# também quando as métricas passam de PLOT_METRICS_HEADER_MAX_BYTES)
+def _image_response(image, result, image_format):
+    record_bytes('image', len(image))
+    metrics_header = None
+    if image_format != 'json':
+        metrics_header = json.dumps({"summary": result}, cls=CustomJSONEncoder)
+    if image_format == 'json' or len(metrics_header) > PLOT_METRICS_HEADER_MAX_BYTES:
+        # Métricas grandes demais para o cabeçalho: imagem em base64 e métricas no corpo JSON
+        with stage('encode'):
+            response = jsonify({
+                "status": "success",
+                "image": base64.b64encode(image).decode('utf-8'),
+                "mimetype": IMAGE_FORMATS.get(image_format, IMAGE_FORMATS['png']),
+                "metrics": {"summary": result}
+            })
+        if image_format == 'json':
+            return response
+    else:
+        # Imagem direto no corpo e métricas no cabeçalho
+        response = app.response_class(image, mimetype=IMAGE_FORMATS[image_format])
+        response.headers['X-Plot-Metrics'] = metrics_header
+
+    # ETag para revalidação (304 em GET condicional)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+# As funções de plot da biblioteca desenham na figura corrente do pyplot, que é global no processo:
+# com o gunicorn em gthread, uma plotagem por vez em cada processo. O lock cobre só a chamada da
+# biblioteca e a retirada da figura do pyplot; a rasterização (savefig, a parte mais cara) é feita
+# depois, na própria figura, como no renderizador native, em paralelo com as outras threads.
+_pyplot_lock = threading.Lock()
+
+# pyplot e smart_traject (que traz geopandas/movingpandas) só são importados na primeira plotagem
+# da biblioteca; rotas de cadastro, upload e métricas não pagam por eles
+def _pyplot():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def _library_plot(name):
+    return getattr(importlib.import_module('smart_traject.smart_trajectories.plot'), name)
+
+# Plots da biblioteca que só desenham as trajetórias: o nível de detalhe não muda o desenho. Nos de
+# linhas, paradas e áreas os pontos descartados mudariam o que a biblioteca detecta e desenha.
+LOD_PLOTS = ('plot_trajectories_with_background', 'plot_trajectories_one_category_background')
+
+# Função para criar e retornar uma plotagem (ou só o resumo da biblioteca, com metrics_only=1):
+# plot_name(TrajectoryCollection dos arrays, *p_args, **kw_args) da smart_traject. Com RENDER_WORKERS,
+# a coleção é montada, desenhada e rasterizada num processo de renderização; sem ele, no processo web.
+# Com metrics_only=1 a figura é descartada sem savefig nem codificação: as métricas são exatamente
+# as da resposta com imagem. metrics: (função de app.analytics, *argumentos), o resumo da imagem
+# com summary=analytics. Nesse caso o resumo da biblioteca é descartado e, com RENDER_LOD, os
+# plots de LOD_PLOTS recebem só os pontos que mudam o desenho (decimate_to_pixels); o resumo é
+# calculado sobre todos os pontos.
+def _generate_plot_response(plot_name, metrics, arrays, *p_args, **kw_args):
+    metrics_only = _metrics_only_requested() == METRICS_LIBRARY
+    analytics_summary = not metrics_only and _analytics_summary_requested()
+    image_format = _requested_image_format()
+    output_format = None if metrics_only else ('png' if image_format == 'json' else image_format)
+
+    drawn = arrays
+    if analytics_summary and RENDER_LOD and plot_name in LOD_PLOTS:
+        with stage('render'):
+            drawn = decimate_to_pixels(arrays, kw_args, RENDER_PIXEL_RATIO)
+
+    if render_farm is not None and shareable(drawn):
+        image, result = _render_in_farm(render_farm.render_library, plot_name, drawn, p_args, kw_args,
+                                        output_format, RENDER_PIXEL_RATIO, RENDER_MIN_DPI, RENDER_MAX_DPI)
+    else:
+        image, result = _plot_in_process(plot_name, drawn, p_args, kw_args, output_format)
+
+    if metrics_only:
+        return jsonify({
+            "status": "success",
+            "metrics": {"summary": result, "source": METRICS_LIBRARY}
+        })
+    if analytics_summary:
+        with stage('analysis'):
+            result = metrics[0](arrays, *metrics[1:])
+    return _image_response(image, result, image_format)
+
+def _plot_in_process(plot_name, arrays, p_args, kw_args, output_format):
+    traj_collection = trajectory_collection_from_arrays(arrays)
+    plot_function = _library_plot(plot_name)
+    plt = _pyplot()
+
+    with stage('pyplot_wait'):
+        _pyplot_lock.acquire()
+    try:
+        # Análise e desenho da biblioteca smart_traject
+        with stage('analysis'):
+            result = plot_function(traj_collection, *p_args, **kw_args)
+            figure = plt.gcf()
+            plt.close(figure)
+    finally:
+        _pyplot_lock.release()
+    if output_format is None:
+        return None, result
+
+    # DPI a partir do tamanho em que a imagem será exibida, no lugar de 300 fixo
     buffer = io.BytesIO()
+    with stage('savefig'):
+        dpi = render_dpi(figure.get_figwidth(), kw_args, RENDER_PIXEL_RATIO, RENDER_MIN_DPI, RENDER_MAX_DPI)
+        figure.savefig(buffer, format=output_format, bbox_inches='tight', dpi=dpi)
+    return buffer.getvalue(), result
+
+# Chamada ao pool de renderização, com fila cheia e tempo limite virando 503/504
+def _render_in_farm(method, *args, **kwargs):
+    try:
+        with stage('render'):
+            return method(*args, **kwargs)
+    except RenderFarmBusy:
+        raise ApiException("Servidor ocupado renderizando outros plots, tente novamente", status_code=503)
+    except RenderTimeout:
+        raise ApiException("Tempo limite de renderização excedido", status_code=504)
+
+# Plot pelo renderizador próprio (PLOT_RENDERER=native): fundo já decodificado e LineCollection
+def _generate_native_plot_response(common_params, metrics_function, *m_args):
+    image_format = _requested_image_format()
+    arrays = _load_trajectory_arrays(common_params)
+    if arrays['timestamp'].size == 0:
+        raise ApiException('Nenhuma trajetória encontrada para os filtros aplicados', status_code=404)
+
+    output_format = 'png' if image_format == 'json' else image_format
+    if render_farm is None:
+        with stage('render'):
+            image = render_trajectories(
+                arrays, camera_registry.background(common_params['camera']), common_params['plot_params'],
+                image_format=output_format, pixel_ratio=RENDER_PIXEL_RATIO, min_dpi=RENDER_MIN_DPI,
+                max_dpi=RENDER_MAX_DPI, level_of_detail=RENDER_LOD)
+    else:
+        # O processo de renderização decodifica (e guarda) o fundo a partir do caminho e do mtime
+        camera = camera_registry.get(common_params['camera']) or {}
+        image_mtime = camera.get('image_mtime')
+        image = _render_in_farm(
+            render_farm.render, arrays, camera['image_path'] if image_mtime is not None else None, image_mtime,
+            common_params['plot_params'], output_format,
+            max_side=CAMERA_BACKGROUND_MAX_SIDE, pixel_ratio=RENDER_PIXEL_RATIO,
+            min_dpi=RENDER_MIN_DPI, max_dpi=RENDER_MAX_DPI, level_of_detail=RENDER_LOD)
+    with stage('analysis'):
+        result = metrics_function(arrays, *m_args)
+    return _image_response(image, result, image_format)
+
+# Normaliza um valor do formulário: números viram float ("10" e "10.0" são o mesmo parâmetro)
+def _canonical_form_value(value):
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+# Cabeçalhos guardados junto com o corpo da resposta em cache
+CACHED_HEADERS = ('ETag', 'Cache-Control', 'X-Plot-Metrics')
+
+# Decorador das rotas de plot: serve a resposta do cache quando a mesma consulta já foi renderizada
+def cached_plot_response(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        camera = request.values.get('camera')
+        if response_cache is None or not camera or request.values.get('no_cache') == '1':
+            return view(*args, **kwargs)
+        try:
+            window_start, window_end = _parse_time_window(
+                request.values.get('selected_date', ''), request.values.get('start_time', 0),
+                request.values.get('end_time', 24))
+        except (ValueError, TypeError):
+            # Parâmetros inválidos: a própria rota devolve o erro
+            return view(*args, **kwargs)
+
+        params = {key: _canonical_form_value(value) for key, value in request.values.items()
+                  if key not in ('selected_date', 'start_time', 'end_time', 'no_cache')}
+        params['window'] = [window_start.isoformat(), window_end.isoformat()]
+        key = make_cache_key(request.path, params)
+
+        invalidation_feed.poll(collection_cache_events)
+        entry = response_cache.get(key)
+        if entry is not None:
+            response = app.response_class(entry['body'], mimetype=entry['mimetype'], headers=entry['headers'])
+            response.headers['X-Cache'] = 'HIT'
+            return response.make_conditional(request)
+
+        response = make_response(view(*args, **kwargs))
+        if response.status_code == 200:
+            headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+            response_cache.set(key, response.get_data(), response.mimetype, camera,
+                               window_start.timestamp(), window_end.timestamp(), headers)
+        response.headers['X-Cache'] = 'MISS'
+        return response
+    return wrapper
+
+# Estatísticas dos caches de respostas, pontos e câmeras (acertos, faltas, remoções e ocupação)
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        'responses': response_cache.stats() if response_cache is not None else {'enabled': False},
+        'trajectories': trajectory_cache.stats() if trajectory_cache is not None else {'enabled': False},
+        'cameras': camera_registry.stats(),
+        'render_farm': render_farm.stats() if render_farm is not None else {'enabled': False}
+    })
+
+
+# Contadores e histogramas das requisições no formato texto do Prometheus (deste processo)
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    if metrics_registry is None:
+        raise ApiException("Métricas desativadas (METRICS_ENABLED=0)", status_code=404)
+    return app.response_class(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
+# Câmera e período [start, end) das rotas de consulta por período (datas ou instantes ISO, UTC)
+def _period_params():
+    camera = request.args.get('camera')
+    if not camera:
+        raise ApiException("Nome da câmera obrigatório", status_code=400)
+    if not camera_registry.get(camera):
+        raise ApiException(f"Câmera '{camera}' não encontrada", status_code=404)
+
+    try:
+        start = datetime.fromisoformat(request.args['start'])
+        end = datetime.fromisoformat(request.args['end'])
+    except (KeyError, ValueError):
+        raise ApiException("Parâmetros start e end obrigatórios no formato ISO", status_code=400)
+    if end <= start:
+        raise ApiException("O fim do período deve ser posterior ao início", status_code=400)
+
+    # category é opcional, mas um valor inválido não pode virar "todas as categorias"
+    category = request.args.get('category')
+    if category is not None:
+        try:
+            category = int(category)
+        except ValueError:
+            raise ApiException("Parâmetro de categoria deve ser um número inteiro", status_code=400)
+    return camera, start, end, category
+
+# Métricas e mapa de calor de períodos longos a partir dos agregados, sem ler as trajetórias.
+# start/end: datas ou instantes ISO (UTC), fim exclusivo; category, retângulo (rect_*),
+# heatmap=1 e interval (segundos, para a série temporal) são opcionais.
+@app.route('/rollups', methods=['GET'])
+def rollups():
+    if rollup_store is None:
+        raise ApiException("Agregados desativados (ROLLUPS_ENABLED=0)", status_code=404)
+
+    camera, start, end, category = _period_params()
+    try:
+        interval = int(request.args.get('interval', 0))
+        rect = None
+        if 'rect_min_x' in request.args:
+            rect = _rect_bbox({name: float(request.args[name])
+                               for name in ('rect_min_x', 'rect_max_x', 'rect_min_y', 'rect_max_y')})
+    except (KeyError, ValueError, TypeError):
+        raise ApiException("Parâmetro numérico inválido", status_code=400)
+    if interval < 0 or interval % rollup_store.bucket_seconds:
+        raise ApiException(f"interval deve ser múltiplo de {rollup_store.bucket_seconds} segundos",
+                           status_code=400)
 
-    result = plot_function(*p_args, **kw_args)
-    
-    plt.savefig(buffer, format='png', bbox_inches='tight', dpi=300)
-    plt.close()
-    buffer.seek(0)
-    
     return jsonify({
         "status": "success",
-        "image": base64.b64encode(buffer.getvalue()).decode('utf-8'),
-        "metrics": {"summary": result}
+        "rollups": rollup_store.query(camera, start, end, category=category, rect=rect,
+                                      heatmap=request.args.get('heatmap') == '1', interval=interval)
     })
-    
 
-@app.route('/plot_with_background', methods=['POST'])
+
+# Exportação em streaming das trajetórias de uma câmera no período [start, end):
+# format=ndjson (padrão, uma trajetória por linha), arrow ou parquet (um ponto por linha; requer pyarrow).
+# Os pontos são recortados ao período; category é opcional.
+@app.route('/trajectories/export', methods=['GET'])
+def export_trajectories():
+    camera, start, end, category = _period_params()
+    export_format = request.args.get('format', 'ndjson').lower()
+    if export_format not in EXPORT_FORMATS:
+        raise ApiException(f"Formato inválido. Use: {', '.join(EXPORT_FORMATS)}", status_code=400)
+
+    query = {"background": camera, "start_time": {"$lt": end}, "end_time": {"$gte": start}}
+    if category is not None:
+        query["category"] = category
+    records = iter_export_records(collection_traj, query, (start, end), batch_size=EXPORT_BATCH_SIZE)
+    if export_format == 'ndjson':
+        chunks = ndjson_chunks(records)
+    else:
+        try:
+            chunks = arrow_chunks(records, export_format)
+        except RuntimeError as e:
+            raise ApiException(str(e), status_code=501)
+
+    filename = f"{secure_filename(camera)}_{start:%Y%m%dT%H%M%S}_{end:%Y%m%dT%H%M%S}.{export_format}"
+    return app.response_class(chunks, mimetype=EXPORT_FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@app.route('/plot_with_background', methods=['GET', 'POST'])
+@cached_plot_response
 def plot_with_background():
     common_params = _validate_common_plot_params()
-    render_mode = request.form.get('render_mode', 'all')
+    render_mode = request.values.get('render_mode', 'all')
         
-    traj_collection = create_trajectory_collection_mongodb(common_params['query'])
-    if not traj_collection:
-        raise ApiException('Nenhuma trajetória encontrada para o período', status_code=404)
+    metrics = (summary_metrics,)
+    if _metrics_only_requested() == METRICS_ANALYTICS:
+        return _generate_metrics_response(common_params, *metrics)
+    if PLOT_RENDERER == 'native' and render_mode == 'all' and not _metrics_only_requested():
+        return _generate_native_plot_response(common_params, *metrics)
+
+    arrays = _load_plot_arrays(common_params, 'Nenhuma trajetória encontrada para o período')
 
     return _generate_plot_response(
-        plot_trajectories_with_background,
-        traj_collection,
+        'plot_trajectories_with_background',
+        metrics,
+        arrays,
         common_params['image_path'],
         render_mode=render_mode,
         **common_params['plot_params']
     )
 
 
-@app.route('/plot_one_category', methods=['POST'])
+@app.route('/plot_one_category', methods=['GET', 'POST'])
+@cached_plot_response
 def plot_category():
     common_params = _validate_common_plot_params()
-    category = request.form.get('category', type=int)
-    render_mode = request.form.get('render_mode', 'all')
+    category = request.values.get('category', type=int)
+    render_mode = request.values.get('render_mode', 'all')
 
     if category is None:
         raise ApiException("Parâmetro de categoria é obrigatório e deve ser um número", status_code=400)
     common_params['query']['category'] = category
 
-    traj_collection = create_trajectory_collection_mongodb(common_params['query'])
-    if not traj_collection:
-        raise ApiException("Nenhuma trajetória encontrada", status_code=404)
+    metrics = (category_metrics, category)
+    if _metrics_only_requested() == METRICS_ANALYTICS:
+        return _generate_metrics_response(common_params, *metrics)
+    if PLOT_RENDERER == 'native' and render_mode == 'all' and not _metrics_only_requested():
+        return _generate_native_plot_response(common_params, *metrics)
+
+    arrays = _load_plot_arrays(common_params, "Nenhuma trajetória encontrada")
 
     return _generate_plot_response(
-        plot_trajectories_one_category_background,
-        traj_collection,
+        'plot_trajectories_one_category_background',
+        metrics,
+        arrays,
         category,
         common_params['image_path'],
         render_mode=render_mode,
@@ -323,31 +852,32 @@ def plot_category():
     )
 
 
-@app.route('/plot_with_limits', methods=['POST'])
+@app.route('/plot_with_limits', methods=['GET', 'POST'])
+@cached_plot_response
 def plot_limits():
     common_params = _validate_common_plot_params()
-    category = request.form.get('category', type=int)
-    reference_line_wkt = request.form.get('reference_line')
-    render_mode = request.form.get('render_mode', 'all')
+    category = request.values.get('category', type=int)
+    reference_line_wkt = request.values.get('reference_line')
+    render_mode = request.values.get('render_mode', 'all')
     
     if category is None or not reference_line_wkt:
         raise ApiException("Parâmetros de categoria e linha de referência são obrigatórios", 
                            status_code=400)
         
-    try:
-        reference_line = wkt.loads(reference_line_wkt)
-    except ShapelyError:
-        raise ApiException("Formato WKT inválido para linha de referência", status_code=400)
+    reference_line = _load_wkt("Formato WKT inválido para linha de referência", reference_line_wkt)[0]
     
     common_params['query']['category'] = category
 
-    traj_collection = create_trajectory_collection_mongodb(common_params['query'])
-    if not traj_collection:
-        raise ApiException('Nenhuma trajetória encontrada para os filtros aplicados', status_code=404)
+    metrics = (reference_line_metrics, category, reference_line)
+    if _metrics_only_requested() == METRICS_ANALYTICS:
+        return _generate_metrics_response(common_params, *metrics, bbox=_geometry_bbox(reference_line))
+
+    arrays = _load_plot_arrays(common_params, 'Nenhuma trajetória encontrada para os filtros aplicados')
 
     return _generate_plot_response(
-        plot_trajectories_with_limits,
-        traj_collection,
+        'plot_trajectories_with_limits',
+        metrics,
+        arrays,
         category,
         common_params['image_path'],
         reference_line,
@@ -356,33 +886,35 @@ def plot_limits():
     )
 
 
-@app.route('/plot_start_finish', methods=['POST'])
+@app.route('/plot_start_finish', methods=['GET', 'POST'])
+@cached_plot_response
 def plot_start_finish():
     common_params = _validate_common_plot_params()
-    category = request.form.get('category', type=int)
-    finish_line_wkt = request.form.get('finish_line')
-    departure_line_wkt = request.form.get('departure_line')
-    render_mode = request.form.get('render_mode', 'all')
+    category = request.values.get('category', type=int)
+    finish_line_wkt = request.values.get('finish_line')
+    departure_line_wkt = request.values.get('departure_line')
+    render_mode = request.values.get('render_mode', 'all')
     
     if category is None or not finish_line_wkt or not departure_line_wkt:
         raise ApiException("Parâmetros de categoria e linhas partida/chegada são obrigatórios", 
                          status_code=400)
         
-    try:
-        departure_line = wkt.loads(departure_line_wkt)
-        arrival_line = wkt.loads(finish_line_wkt)
-    except ShapelyError:
-        raise ApiException("Formato WKT inválido para linha de referência", status_code=400)
+    departure_line, arrival_line = _load_wkt("Formato WKT inválido para linha de referência",
+                                             departure_line_wkt, finish_line_wkt)
             
     common_params['query']['category'] = category
 
-    traj_collection = create_trajectory_collection_mongodb(common_params['query'])
-    if not traj_collection:
-        raise ApiException('Nenhuma trajetória encontrada para os filtros aplicados', status_code=404)
+    metrics = (start_finish_metrics, category, arrival_line, departure_line)
+    if _metrics_only_requested() == METRICS_ANALYTICS:
+        return _generate_metrics_response(common_params, *metrics,
+                                          bbox=_geometry_bbox(arrival_line, departure_line))
+
+    arrays = _load_plot_arrays(common_params, 'Nenhuma trajetória encontrada para os filtros aplicados')
 
     return _generate_plot_response(
-        plot_trajectories_with_start_finish,
-        traj_collection,
+        'plot_trajectories_with_start_finish',
+        metrics,
+        arrays,
         category,
         common_params['image_path'],
         arrival_line,
@@ -392,16 +924,17 @@ def plot_start_finish():
     )
 
 
-@app.route('/plot_with_stopped', methods=['POST'])
+@app.route('/plot_with_stopped', methods=['GET', 'POST'])
+@cached_plot_response
 def plot_with_stopped():
     common_params = _validate_common_plot_params()
-    render_mode = request.form.get('render_mode', 'all')
+    render_mode = request.values.get('render_mode', 'all')
 
     try:
-        category = int(request.form['category'])
-        stop_threshold = int(request.form['stop_threshold'])
-        min_duration = int(request.form['min_duration'])
-        noise_tolerance = int(request.form['noise_tolerance'])
+        category = int(request.values['category'])
+        stop_threshold = int(request.values['stop_threshold'])
+        min_duration = int(request.values['min_duration'])
+        noise_tolerance = int(request.values['noise_tolerance'])
     except (KeyError, ValueError, TypeError):
         raise ApiException(
             "Parâmetros de categoria e características de parada são obrigatórios e devem ser números inteiros.",
@@ -409,13 +942,16 @@ def plot_with_stopped():
 
     common_params['query']['category'] = category
 
-    traj_collection = create_trajectory_collection_mongodb(common_params['query'])
-    if not traj_collection:
-        raise ApiException('Nenhuma trajetória encontrada para os filtros aplicados', status_code=404)
+    metrics = (stop_metrics, category, stop_threshold, min_duration, noise_tolerance)
+    if _metrics_only_requested() == METRICS_ANALYTICS:
+        return _generate_metrics_response(common_params, *metrics)
+
+    arrays = _load_plot_arrays(common_params, 'Nenhuma trajetória encontrada para os filtros aplicados')
 
     return _generate_plot_response(
-        plot_trajectories_with_stopped,
-        traj_collection,
+        'plot_trajectories_with_stopped',
+        metrics,
+        arrays,
         category,
         common_params['image_path'],
         render_mode=render_mode,
@@ -426,22 +962,23 @@ def plot_with_stopped():
     )
 
 
-@app.route('/plot_with_stop_rec', methods=['POST'])
+@app.route('/plot_with_stop_rec', methods=['GET', 'POST'])
+@cached_plot_response
 def plot_with_stop_in_rectangle():
     common_params = _validate_common_plot_params()
-    render_mode = request.form.get('render_mode', 'all')
+    render_mode = request.values.get('render_mode', 'all')
 
     try:
-        category = int(request.form['category'])
-        stop_threshold = int(request.form['stop_threshold'])
-        min_duration = int(request.form['min_duration'])
-        noise_tolerance = int(request.form['noise_tolerance'])
+        category = int(request.values['category'])
+        stop_threshold = int(request.values['stop_threshold'])
+        min_duration = int(request.values['min_duration'])
+        noise_tolerance = int(request.values['noise_tolerance'])
 
         rect_params = {
-            'rect_min_x': float(request.form['rect_min_x']),
-            'rect_max_x': float(request.form['rect_max_x']),
-            'rect_min_y': float(request.form['rect_min_y']),
-            'rect_max_y': float(request.form['rect_max_y'])
+            'rect_min_x': float(request.values['rect_min_x']),
+            'rect_max_x': float(request.values['rect_max_x']),
+            'rect_min_y': float(request.values['rect_min_y']),
+            'rect_max_y': float(request.values['rect_max_y'])
         }
     except (KeyError, ValueError, TypeError):
         raise ApiException(
@@ -451,13 +988,18 @@ def plot_with_stop_in_rectangle():
     common_params['query']['category'] = category
     common_params['plot_params'].update(rect_params)
 
-    traj_collection = create_trajectory_collection_mongodb(common_params['query'])
-    if not traj_collection:
-        raise ApiException('Nenhuma trajetória encontrada para os filtros aplicados', status_code=404)
+    # rect_params na ordem dos argumentos de stop_in_rectangle_metrics
+    metrics = (stop_in_rectangle_metrics, category, stop_threshold, min_duration, noise_tolerance,
+               *rect_params.values())
+    if _metrics_only_requested() == METRICS_ANALYTICS:
+        return _generate_metrics_response(common_params, *metrics, bbox=_rect_bbox(rect_params))
+
+    arrays = _load_plot_arrays(common_params, 'Nenhuma trajetória encontrada para os filtros aplicados')
 
     return _generate_plot_response(
-        plot_trajectories_with_stop_in_rectangle,
-        traj_collection,
+        'plot_trajectories_with_stop_in_rectangle',
+        metrics,
+        arrays,
         category,
         common_params['image_path'],
         render_mode=render_mode,
@@ -468,18 +1010,19 @@ def plot_with_stop_in_rectangle():
     )
 
 
-@app.route('/plot_monitored_area', methods=['POST'])
+@app.route('/plot_monitored_area', methods=['GET', 'POST'])
+@cached_plot_response
 def plot_monitored_area():
     common_params = _validate_common_plot_params()
-    render_mode = request.form.get('render_mode', 'all')
+    render_mode = request.values.get('render_mode', 'all')
 
     try:
-        category = int(request.form['category'])
+        category = int(request.values['category'])
         rect_params = {
-            'rect_min_x': float(request.form['rect_min_x']),
-            'rect_max_x': float(request.form['rect_max_x']),
-            'rect_min_y': float(request.form['rect_min_y']),
-            'rect_max_y': float(request.form['rect_max_y'])
+            'rect_min_x': float(request.values['rect_min_x']),
+            'rect_max_x': float(request.values['rect_max_x']),
+            'rect_min_y': float(request.values['rect_min_y']),
+            'rect_max_y': float(request.values['rect_max_y'])
         }
     except (KeyError, ValueError, TypeError):
         raise ApiException(
@@ -490,19 +1033,81 @@ def plot_monitored_area():
     common_params['query']['category'] = category
     common_params['plot_params'].update(rect_params)
 
-    traj_collection = create_trajectory_collection_mongodb(common_params['query'])
-    if not traj_collection:
-        raise ApiException('Nenhuma trajetória encontrada para os filtros aplicados', status_code=404)
+    # rect_params na ordem dos argumentos de monitored_area_metrics
+    metrics = (monitored_area_metrics, category, *rect_params.values())
+    if _metrics_only_requested() == METRICS_ANALYTICS:
+        return _generate_metrics_response(common_params, *metrics, bbox=_rect_bbox(rect_params))
+
+    arrays = _load_plot_arrays(common_params, 'Nenhuma trajetória encontrada para os filtros aplicados')
 
     return _generate_plot_response(
-        plot_trajectories_in_monitored_area,
-        traj_collection,
+        'plot_trajectories_in_monitored_area',
+        metrics,
+        arrays,
         category,
         common_params['image_path'],
         render_mode=render_mode,
         **common_params['plot_params']
     )
 
+# Comando para criar (online) e conferir os índices das coleções
+@app.cli.command('ensure-indexes')
+@click.option('--verify/--no-verify', default=True, show_default=True,
+              help='Confere com explain() o índice escolhido para as consultas das rotas')
+def ensure_indexes_command(verify):
+    created = ensure_indexes(db, COLLECTION_TRAJ, COLLECTION_CAM, COLLECTION_CACHE_EVENTS, COLLECTION_ROLLUPS)
+    for collection_name, names in created.items():
+        click.echo(f"{collection_name}: {', '.join(names) or 'nenhum índice criado'}")
+    if verify:
+        for label, plan in verify_indexes(db, COLLECTION_TRAJ, COLLECTION_CAM).items():
+            click.echo(f"{label}: {', '.join(plan)}")
+
+# Comando para converter as trajetórias já gravadas para outro layout de pontos
+@app.cli.command('migrate-points')
+@click.option('--layout', type=click.Choice(LAYOUTS), default=LAYOUT_PACKED, show_default=True)
+@click.option('--camera', default=None, help='Converte apenas as trajetórias desta câmera')
+@click.option('--batch-size', default=500, show_default=True)
+def migrate_points(layout, camera, batch_size):
+    query = {"background": camera} if camera else {}
+    stats = migrate_points_layout(collection_traj, layout=layout, batch_size=batch_size, query=query)
+    ratio = stats['bytes_before'] / stats['bytes_after'] if stats['bytes_after'] else 0
+    click.echo(f"{stats['converted']} trajetórias convertidas para '{layout}' "
+               f"({stats['bytes_before']} -> {stats['bytes_after']} bytes, {ratio:.1f}x)")
+
+# Comando para gravar o resumo por trajetória nos documentos ingeridos antes dele existir
+@app.cli.command('summarize-trajectories')
+@click.option('--camera', default=None, help='Resume apenas as trajetórias desta câmera')
+@click.option('--batch-size', default=500, show_default=True)
+def summarize_trajectories(camera, batch_size):
+    query = {"background": camera} if camera else {}
+    updated = backfill_summaries(collection_traj, batch_size=batch_size, query=query)
+    click.echo(f"{updated} trajetórias resumidas")
+
+# Comando para refazer os agregados a partir das trajetórias gravadas
+@app.cli.command('rebuild-rollups')
+@click.option('--camera', default=None, help='Refaz apenas os agregados desta câmera')
+@click.option('--batch-size', default=500, show_default=True)
+def rebuild_rollups(camera, batch_size):
+    if rollup_store is None:
+        raise click.ClickException("Agregados desativados (ROLLUPS_ENABLED=0)")
+    updated = rollup_store.rebuild(collection_traj, camera=camera, batch_size=batch_size)
+    click.echo(f"{updated} atualizações de agregados gravadas")
+
+# Migração única para o índice único (câmera, identifier, start_time): junta as trajetórias gravadas
+# mais de uma vez com a mesma chave e cria o índice
+@app.cli.command('dedup-trajectories')
+@click.option('--camera', default=None, help='Junta apenas as duplicatas desta câmera')
+@click.option('--batch-size', default=500, show_default=True)
+@click.option('--dry-run', is_flag=True, help='Só conta as duplicatas, sem alterar nada')
+def dedup_trajectories(camera, batch_size, dry_run):
+    stats = deduplicate_trajectories(collection_traj, camera=camera, rollups=rollup_store, dry_run=dry_run,
+                                     batch_size=batch_size)
+    verb = 'seriam removidos' if dry_run else 'removidos'
+    click.echo(f"{stats['keys']} chaves repetidas, {stats['removed']} documentos {verb}")
+    if not dry_run:
+        created = ensure_indexes(db, COLLECTION_TRAJ, COLLECTION_CAM)
+        click.echo(f"{COLLECTION_TRAJ}: {', '.join(created[COLLECTION_TRAJ]) or 'nenhum índice criado'}")
+
 '''
 # Endpoint para receber e processar arquivos de trajetórias enviados pelo software de automação
 @app.route('/send_trajectory_archive', methods=['POST'])
@@ -511,4 +1116,7 @@ def send_trajectory_archive():
 '''
 
 if __name__ == "__main__":
+    # Com o recarregador do modo debug, só o processo filho (o que atende) inicia as tarefas
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_tasks()
     app.run(debug=True)
\ No newline at end of file
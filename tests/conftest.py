@@ -0,0 +1,90 @@
+import os
+import sys
+import textwrap
+
+import mongomock
+import pytest
+
+from benchmarks.mongomock_compat import patch_mongomock_bulk_write
+
+TXT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'input_data', 'txt')
+
+patch_mongomock_bulk_write()
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()['trajectories_test']
+
+
+@pytest.fixture
+def rollups(db):
+    from app.rollups import RollupStore
+    return RollupStore(db.rollups)
+
+
+@pytest.fixture
+def sample_txt():
+    return os.path.join(TXT_DIR, 'trail_points_data_1.txt')
+
+
+@pytest.fixture
+def split_txt(tmp_path, sample_txt):
+    # Cópia da amostra em que a segunda metade de algumas trajetórias vem numa linha repetida do
+    # mesmo identificador no fim do arquivo (como o rastreador faz ao reencontrar um objeto), mais
+    # uma linha de um ponto só completada depois.
+    from app.parsing import iter_txt_trajectories
+
+    def line(identifier, category, t, x, y):
+        step = (t[-1] - t[0]) / max(t.size - 1, 1)
+        points = ', '.join(f'({int(xi)}, {int(yi)})' for xi, yi in zip(x, y))
+        return f"{identifier:g}, {category:g}, {float(t[0])!r}, {float(t[0] + step * t.size)!r}, [{points}]\n"
+
+    heads, tails = [], []
+    for i, (identifier, category, t, x, y) in enumerate(iter_txt_trajectories(sample_txt)):
+        if i % 7 == 0 and t.size >= 6:
+            half = t.size // 2
+            heads.append(line(identifier, category, t[:half], x[:half], y[:half]))
+            tails.append(line(identifier, category, t[half:], x[half:], y[half:]))
+        else:
+            heads.append(line(identifier, category, t, x, y))
+    first = float(heads[0].split(',')[2])
+    heads.insert(3, f"9001, 1, {first!r}, {first!r}, [(10, 10)]\n")
+    tails.append(f"9001, 1, {first + 1!r}, {first + 4!r}, [(12, 10), (14, 11), (16, 12)]\n")
+    path = tmp_path / 'split.txt'
+    path.write_text(''.join(heads + tails))
+    return str(path)
+
+
+# Função de plot no formato das da smart_traject (o submódulo não vem com o repositório): desenha na
+# figura corrente do pyplot e devolve um resumo que depende dos valores de identifier e category
+FAKE_PLOT = '''
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+
+def plot_trajectories_with_background(traj_collection, image_path, render_mode='all', **kwargs):
+    plt.figure(figsize=(kwargs['xsize'], kwargs['ysize']))
+    categories = {}
+    for trajectory in traj_collection.trajectories:
+        plt.plot(trajectory.df.geometry.x, trajectory.df.geometry.y)
+        category = trajectory.df['category'].iloc[0]
+        categories[str(category)] = categories.get(str(category), 0) + 1
+    return {'total_trajectories': len(traj_collection), 'trajectories_per_category': categories,
+            'image_path': image_path}
+'''
+
+
+@pytest.fixture
+def fake_library(tmp_path, monkeypatch):
+    package = tmp_path / 'smart_traject' / 'smart_trajectories'
+    package.mkdir(parents=True)
+    (tmp_path / 'smart_traject' / '__init__.py').write_text('')
+    (package / '__init__.py').write_text('')
+    (package / 'plot.py').write_text(textwrap.dedent(FAKE_PLOT))
+    # Os processos do pool (spawn) recebem o sys.path do processo pai
+    monkeypatch.syspath_prepend(str(tmp_path))
+    yield
+    for name in [name for name in sys.modules if name.startswith('smart_traject')]:
+        del sys.modules[name]
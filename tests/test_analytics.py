@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.analytics import _candidate_segments, _first_crossing_times, detect_stops, group_points
+from app.parsing import parse_txt_file
+from benchmarks.bench_stops import assert_same_stops, reference_stops
+from conftest import TXT_DIR
+
+SAMPLES = [('trail_points_data.txt', False), ('trail_points_data_1.txt', False),
+           ('trail_points_data_2.txt', True)]
+
+
+def _stops(trajectories, stop_threshold, min_duration, noise_tolerance):
+    # trajectories: lista de (t, x, y), uma trajetória por item, pontos já em ordem
+    counts = np.array([len(t) for t, _, _ in trajectories], dtype=np.int64)
+    points = {name: np.concatenate([np.asarray(trajectory[i], dtype=np.float64) for trajectory in trajectories])
+              for i, name in enumerate(('timestamp', 'x', 'y'))}
+    return detect_stops(points, np.cumsum(counts) - counts, counts, stop_threshold, min_duration, noise_tolerance)
+
+
+def _intervals(stops):
+    return list(zip(stops['trajectory'].tolist(), stops['start'].tolist(), stops['end'].tolist()))
+
+
+def test_step_equal_to_threshold_is_still():
+    trajectory = ([0, 1, 2], [0, 3, 6], [0, 0, 0])
+    assert _intervals(_stops([trajectory], 3, 0, 0)) == [(0, 0.0, 2.0)]
+    assert _intervals(_stops([trajectory], 2.9, 0, 0)) == []
+
+
+def test_noise_tolerance_counts_consecutive_moving_steps():
+    # Passos: parado, 2 em movimento, parado, 1 em movimento, parado
+    trajectory = ([0, 1, 2, 3, 4, 5, 6], [0, 0, 50, 100, 100, 150, 150], [0] * 7)
+    assert _intervals(_stops([trajectory], 1, 0, 2)) == [(0, 0.0, 6.0)]
+    assert _intervals(_stops([trajectory], 1, 0, 1)) == [(0, 0.0, 1.0), (0, 3.0, 6.0)]
+    assert _intervals(_stops([trajectory], 1, 0, 0)) == [(0, 0.0, 1.0), (0, 3.0, 4.0), (0, 5.0, 6.0)]
+
+
+def test_min_duration_is_inclusive():
+    trajectory = ([0, 1, 2, 3], [0, 0, 0, 90], [0, 0, 0, 0])
+    assert _intervals(_stops([trajectory], 1, 2, 0)) == [(0, 0.0, 2.0)]
+    assert _intervals(_stops([trajectory], 1, 2.5, 0)) == []
+
+
+def test_stop_spans_first_to_last_still_step():
+    # Passos em movimento no início e no fim ficam de fora; o ruído no meio entra na duração e
+    # na posição média
+    trajectory = ([0, 1, 2, 3, 4, 5, 6], [0, 40, 40, 46, 46, 90, 130], [0, 0, 0, 0, 0, 0, 0])
+    stops = _stops([trajectory], 1, 0, 1)
+    assert _intervals(stops) == [(0, 1.0, 4.0)]
+    assert stops['x'].tolist() == [43.0]
+    assert stops['y'].tolist() == [0.0]
+
+
+def test_stop_never_crosses_trajectories():
+    # A primeira termina parada e a segunda começa parada, no mesmo lugar
+    first = ([0, 1, 2], [0, 50, 50], [0, 0, 0])
+    second = ([3, 4, 5], [50, 50, 100], [0, 0, 0])
+    assert _intervals(_stops([first, second], 1, 0, 5)) == [(0, 1.0, 2.0), (1, 3.0, 4.0)]
+
+
+def test_no_trajectories():
+    empty = np.empty(0, dtype=np.int64)
+    stops = detect_stops({'timestamp': np.empty(0), 'x': np.empty(0), 'y': np.empty(0)}, empty, empty, 3, 2, 2)
+    assert all(values.size == 0 for values in stops.values())
+
+
+@pytest.mark.parametrize('filename,datetime_input', SAMPLES)
+@pytest.mark.parametrize('stop_threshold,min_duration,noise_tolerance',
+                         [(0, 0, 0), (1, 1, 0), (3, 2, 2), (5, 0, 1), (5, 3, 5), (10, 10, 3)])
+def test_detect_stops_matches_loop_on_samples(filename, datetime_input, stop_threshold, min_duration,
+                                              noise_tolerance):
+    # Vetorização contra o laço com as mesmas regras (as regras em si ficam nos casos acima).
+    # Pontos soltos, como os arrays que as rotas leem do MongoDB
+    arrays = parse_txt_file(os.path.join(TXT_DIR, filename), datetime_input=datetime_input, workers=1)
+    points, starts, counts = group_points({'identifier': np.repeat(arrays['identifier'], arrays['counts']),
+                                           'timestamp': arrays['t'], 'x': arrays['x'], 'y': arrays['y']})
+    params = (stop_threshold, min_duration, noise_tolerance)
+
+    stops = detect_stops(points, starts, counts, *params)
+
+    assert_same_stops(reference_stops(points, starts, counts, *params), stops)
+
+
+def _brute_force_first_crossings(points, starts, counts, line):
+    # Cada segmento de cada trajetória testado com o shapely, um por vez
+    from shapely.geometry import LineString
+    times = []
+    for start, count in zip(starts.tolist(), counts.tolist()):
+        time = np.nan
+        for i in range(start, start + count - 1):
+            segment = LineString([(points['x'][i], points['y'][i]), (points['x'][i + 1], points['y'][i + 1])])
+            if segment.intersects(line):
+                time = points['timestamp'][i]
+                break
+        times.append(time)
+    return np.array(times)
+
+
+@pytest.mark.parametrize('line_wkt', ['LINESTRING (950 0, 950 1080)', 'LINESTRING (600 200, 1300 700)',
+                                      'LINESTRING (0 0, 1 1)', 'LINESTRING (1000 300, 1000 300.5, 1100 900)'])
+def test_first_crossings_match_brute_force(line_wkt):
+    from shapely import wkt
+    arrays = parse_txt_file(os.path.join(TXT_DIR, 'trail_points_data_2.txt'), datetime_input=True, workers=1)
+    points, starts, counts = group_points({'identifier': np.repeat(arrays['identifier'], arrays['counts']),
+                                           'category': np.repeat(arrays['category'], arrays['counts']),
+                                           'timestamp': arrays['t'], 'x': arrays['x'], 'y': arrays['y']})
+    line = wkt.loads(line_wkt)
+
+    np.testing.assert_array_equal(_first_crossing_times(points, starts, counts, line),
+                                  _brute_force_first_crossings(points, starts, counts, line))
+
+
+def test_candidate_segments_touching_the_bounds_are_kept():
+    # Segmentos que só encostam na borda do bbox da linha continuam candidatos
+    points = {'x': np.array([0.0, 10.0, 10.0, 20.0]), 'y': np.array([0.0, 0.0, 5.0, 5.0])}
+    assert _candidate_segments(points, np.arange(3), (10, 5, 30, 30)).tolist() == [1, 2]
+    assert _candidate_segments(points, np.arange(3), (10.5, 6, 30, 30)).tolist() == []
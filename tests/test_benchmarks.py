@@ -0,0 +1,63 @@
+import json
+import sys
+
+import numpy as np
+import pytest
+
+from app.parsing import parse_txt_file
+from benchmarks import suite
+from benchmarks.synthetic import generate_txt
+
+
+def _result(items_per_second, p95_ms):
+    return {'items_per_second': items_per_second, 'p95_ms': p95_ms}
+
+
+@pytest.mark.parametrize('datetime_format', [False, True])
+def test_generated_txt_parses_in_tracker_format(tmp_path, datetime_format):
+    path = generate_txt(str(tmp_path / 'cam.txt'), tracks=25, points_per_track=20, datetime_format=datetime_format,
+                        seed=3)
+
+    arrays = parse_txt_file(path, datetime_input=datetime_format, workers=1)
+
+    assert arrays['identifier'].tolist() == list(range(1, 26))
+    assert arrays['counts'].sum() == arrays['t'].size
+    assert np.all((arrays['counts'] >= 10) & (arrays['counts'] <= 30))
+    assert np.all((arrays['x'] >= 0) & (arrays['x'] < 1920) & (arrays['y'] >= 0) & (arrays['y'] < 1080))
+
+
+def test_measure_counts_failed_operations():
+    result = suite.measure([lambda: None, lambda: False, lambda: True], items=30)
+
+    assert result['operations'] == 3 and result['items'] == 30 and result['errors'] == 1
+    assert result['p50_ms'] <= result['p95_ms'] <= result['p99_ms']
+
+
+def test_compare_flags_only_regressions_beyond_tolerance():
+    baseline = {'parse': _result(100, 10), 'load': _result(100, 10), 'ingest': _result(100, 10),
+                'routes': {'skipped': 'run.py não importável'}}
+    current = {'parse': _result(85, 11.5), 'load': _result(75, 10), 'ingest': _result(100, 13),
+               'routes': _result(1, 1000), 'nova': _result(1, 1000)}
+
+    assert suite.compare(baseline, current, tolerance=0.2) == ['load', 'ingest']
+
+
+def test_suite_saves_and_compares_baseline(tmp_path, monkeypatch, capsys):
+    # Execução mínima no mongomock, sem as rotas: salva a baseline e compara com ela mesma
+    baseline = tmp_path / 'baseline.json'
+    args = ['suite', '--tracks', '5', '--points', '10', '--cameras', '2', '--repeat', '1',
+            '--stages', 'parse', 'load']
+    monkeypatch.setattr(sys, 'argv', args + ['--save', str(baseline)])
+    suite.main()
+
+    saved = json.loads(baseline.read_text())
+    assert saved['backend'] == 'mongomock'
+    assert saved['params'] == {'tracks': 5, 'points': 10, 'cameras': 2, 'repeat': 1}
+    assert list(saved['results']) == ['parse', 'ingest', 'load']
+    assert saved['results']['ingest']['items'] == saved['results']['load']['items']
+    assert saved['results']['parse']['items'] == saved['results']['load']['items']
+    assert all(result['errors'] == 0 for result in saved['results'].values())
+
+    monkeypatch.setattr(sys, 'argv', args + ['--compare', str(baseline), '--tolerance', '1000'])
+    suite.main()
+    assert 'REGRESSÃO' not in capsys.readouterr().out
@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from app.cache import InvalidationFeed, TrajectoryArrayCache
+
+
+class RecordingCache:
+
+    def __init__(self):
+        self.invalidated = []
+
+    def invalidate(self, camera, start, end):
+        self.invalidated.append((camera, start, end))
+
+
+def _event(db, camera, at):
+    db.events.insert_one({"camera": camera, "start": 0.0, "end": 1.0, "at": at})
+
+
+def test_invalidation_feed_applies_late_events_once(db):
+    cache = RecordingCache()
+    feed = InvalidationFeed([cache], poll_interval=0, overlap=60)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    _event(db, 'a', now + timedelta(seconds=5))
+    feed.poll(db.events)
+    # Gravado depois, mas com "at" anterior ao último visto (relógio atrasado ou commit tardio)
+    _event(db, 'b', now + timedelta(seconds=2))
+    feed.poll(db.events)
+    feed.poll(db.events)
+
+    assert [camera for camera, _, _ in cache.invalidated] == ['a', 'b']
+
+
+DAY = (datetime(2023, 6, 21, tzinfo=timezone.utc), datetime(2023, 6, 21, 23, 59, 59, tzinfo=timezone.utc))
+
+
+def _day_arrays():
+    rng = np.random.default_rng(0)
+    timestamp = np.sort(rng.uniform(DAY[0].timestamp(), DAY[1].timestamp(), 1000))
+    return {'identifier': rng.integers(0, 50, 1000).astype(float), 'category': rng.integers(0, 3, 1000).astype(float),
+            'timestamp': timestamp, 'x': rng.uniform(0, 100, 1000), 'y': rng.uniform(0, 100, 1000)}
+
+
+def _query(start, end, category=None):
+    query = {"background": "cam", "start_time": {"$lte": end}, "end_time": {"$gte": start}}
+    if category is not None:
+        query["category"] = category
+    return query
+
+
+def test_array_cache_slices_wider_entry():
+    arrays = _day_arrays()
+    fetched = []
+
+    def fetch(query, time_window):
+        fetched.append((query, time_window))
+        return arrays
+
+    cache = TrajectoryArrayCache()
+    assert cache.get_arrays(_query(*DAY), DAY, fetch) is arrays
+
+    window = (datetime(2023, 6, 21, 10, tzinfo=timezone.utc), datetime(2023, 6, 21, 12, tzinfo=timezone.utc))
+    sliced = cache.get_arrays(_query(*window, category=1), window, fetch)
+
+    inside = ((arrays['timestamp'] >= window[0].timestamp()) & (arrays['timestamp'] <= window[1].timestamp())
+              & (arrays['category'] == 1))
+    assert len(fetched) == 1
+    for column, values in arrays.items():
+        np.testing.assert_array_equal(sliced[column], values[inside])
+    assert cache.stats()['slices'] == 1
+
+    # Janela fora da entrada: busca de novo
+    wider = (DAY[0] - timedelta(hours=1), DAY[1])
+    cache.get_arrays(_query(*wider), wider, fetch)
+    assert len(fetched) == 2
+    # Outros filtros não passam pelo cache
+    cache.get_arrays(dict(_query(*DAY), identifier=3), DAY, fetch)
+    assert len(fetched) == 3
+
+
+def test_array_cache_invalidation_drops_overlapping_entries():
+    cache = TrajectoryArrayCache()
+    cache.get_arrays(_query(*DAY), DAY, lambda query, time_window: _day_arrays())
+    assert cache.invalidate('outra', DAY[0].timestamp(), DAY[1].timestamp()) == 0
+    assert cache.invalidate('cam', DAY[0].timestamp() + 60, DAY[0].timestamp() + 120) == 1
+    assert cache.lookup('cam', None, DAY[0].timestamp(), DAY[1].timestamp()) is None
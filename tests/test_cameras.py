@@ -0,0 +1,26 @@
+import numpy as np
+from PIL import Image
+
+from app.cameras import CameraRegistry
+
+
+def _camera(db, tmp_path, name='cam'):
+    image_path = str(tmp_path / f'{name}.png')
+    Image.fromarray(np.zeros((4, 6, 3), dtype=np.uint8)).save(image_path)
+    db.cameras.insert_one({'name': name, 'image_path': image_path})
+
+
+def test_deleted_camera_is_evicted_after_ttl(db, tmp_path):
+    _camera(db, tmp_path)
+    registry = CameraRegistry(db.cameras, ttl=60)
+    assert registry.background('cam').shape == (4, 6, 3)
+
+    db.cameras.delete_one({'name': 'cam'})
+    # Dentro do prazo o documento em cache ainda vale
+    assert registry.get('cam') is not None
+
+    registry.ttl = 0
+    assert registry.get('cam') is None
+    assert registry.background('cam') is None
+    stats = registry.stats()
+    assert (stats['cameras'], stats['backgrounds'], stats['bytes']) == (0, 0, 0)
@@ -0,0 +1,39 @@
+from app.indexes import (CACHE_EVENT_INDEXES, CAMERA_INDEXES, ROLLUP_INDEXES, TRAJECTORY_INDEXES, _winning_indexes,
+                         ensure_indexes)
+
+
+def _names(indexes):
+    return [index.document['name'] for index in indexes]
+
+
+def test_ensure_indexes_creates_every_index_once(db):
+    created = ensure_indexes(db, 'traj', 'cams', 'events', 'rollups')
+    again = ensure_indexes(db, 'traj', 'cams', 'events', 'rollups')
+
+    assert created == again == {'traj': _names(TRAJECTORY_INDEXES), 'cams': _names(CAMERA_INDEXES),
+                                'events': _names(CACHE_EVENT_INDEXES), 'rollups': _names(ROLLUP_INDEXES)}
+    info = db.traj.index_information()
+    assert list(info['background_category_time']['key']) == [('background', 1), ('category', 1), ('start_time', 1),
+                                                       ('end_time', 1)]
+    assert info['background_identifier_start'].get('unique') is True
+    assert db.cams.index_information()['name_unique'].get('unique') is True
+
+
+def test_duplicate_cameras_do_not_block_other_indexes(db):
+    db.cams.insert_many([{'name': 'cam'}, {'name': 'cam'}])
+
+    created = ensure_indexes(db, 'traj', 'cams')
+
+    assert created == {'traj': _names(TRAJECTORY_INDEXES), 'cams': []}
+    assert 'name_unique' not in db.cams.index_information()
+
+
+def test_winning_indexes_walks_the_plan():
+    fetch = {'stage': 'FETCH', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'background_category_time'}}
+    merged = {'stage': 'SHARD_MERGE', 'inputStages': [
+        {'stage': 'SHARDING_FILTER', 'inputStage': {'stage': 'IXSCAN', 'indexName': 'background_time'}},
+        {'stage': 'COLLSCAN'}]}
+
+    assert _winning_indexes(fetch) == ['background_category_time']
+    assert _winning_indexes(merged) == ['background_time', 'COLLSCAN']
+    assert _winning_indexes({'queryPlan': {'stage': 'COLLSCAN'}}) == ['COLLSCAN']
@@ -0,0 +1,238 @@
+import json
+
+import numpy as np
+import pytest
+
+from pymongo.errors import BulkWriteError
+
+from app.indexes import TRAJECTORY_INDEXES, ensure_indexes
+from app.ingest import (DUPLICATE_KEY, _merge_points, build_trajectory_documents, deduplicate_trajectories,
+                        insert_trajectories, store_trajectories_streaming, upsert_trajectories)
+from app.parsing import (arrays_from_trajectories, group_by_identifier, iter_trajectory_arrays,
+                         iter_txt_trajectories, parse_txt_file, write_csv)
+from app.storage import LAYOUT_PACKED, LAYOUT_POINTS, document_points, points_to_arrays
+
+
+def _stored(collection):
+    # Documentos gravados por identificador: categoria, pontos e resumo
+    return {doc['identifier']: (doc['category'], document_points(doc), dict(doc['summary']))
+            for doc in collection.find({}, {'_id': 0})}
+
+
+def _assert_same_documents(expected, actual):
+    assert sorted(expected) == sorted(actual)
+    for identifier, (category, points, summary) in expected.items():
+        other_category, other_points, other_summary = actual[identifier]
+        assert other_category == category, identifier
+        for values, other_values in zip(points, other_points):
+            np.testing.assert_array_equal(values, other_values)
+        assert other_summary.pop('bbox') == summary.pop('bbox')
+        assert other_summary == pytest.approx(summary)
+
+
+def _stream(split_txt, collection, tmp_path, **kwargs):
+    return store_trajectories_streaming(iter_txt_trajectories(split_txt), collection, 'cam',
+                                        str(tmp_path / 'out.json'), str(tmp_path / 'out.csv'),
+                                        layout=LAYOUT_PACKED, batch_size=50, **kwargs)
+
+
+def _collection_documents(csv_path, camera):
+    # Caminho antigo: CSV relido com pandas, TrajectoryCollection e um documento por trajetória
+    import pandas as pd
+    from app.utils import trajectory_collection_from_arrays
+    df = pd.read_csv(csv_path)
+    collection = trajectory_collection_from_arrays({column: df[column].to_numpy() for column in df.columns})
+    return [{
+        "identifier": trajectory.id,
+        "category": trajectory.df['category'].iloc[0],
+        "start_time": trajectory.get_start_time(),
+        "end_time": trajectory.get_end_time(),
+        "geometry": trajectory.to_linestring().wkt,
+        "background": camera,
+        "points": [{"timestamp": moment.isoformat(), "geometry": point.wkt}
+                   for moment, point in trajectory.df.geometry.items()]
+    } for trajectory in collection]
+
+
+def test_documents_from_arrays_match_csv_collection(split_txt, tmp_path):
+    arrays = parse_txt_file(split_txt, workers=1)
+    write_csv(arrays, str(tmp_path / 'out.csv'))
+
+    expected = _collection_documents(str(tmp_path / 'out.csv'), 'cam')
+    documents = build_trajectory_documents(arrays, 'cam', layout=LAYOUT_POINTS)
+
+    # Linhas repetidas do mesmo identificador (inclusive a de um ponto só completada depois) viram
+    # uma trajetória, na ordem do TrajectoryCollection
+    assert [doc['identifier'] for doc in documents] == [doc['identifier'] for doc in expected]
+    for doc, other in zip(documents, expected):
+        assert doc['category'] == other['category']
+        assert doc['geometry'] == other['geometry']
+        assert doc['background'] == other['background']
+        assert abs(doc['start_time'] - other['start_time']).total_seconds() < 1e-3
+        assert abs(doc['end_time'] - other['end_time']).total_seconds() < 1e-3
+        assert [point['geometry'] for point in doc['points']] == [point['geometry'] for point in other['points']]
+        # O caminho antigo trunca em microssegundos; o novo arredonda
+        np.testing.assert_allclose(points_to_arrays(doc['points'])[0], points_to_arrays(other['points'])[0],
+                                   rtol=0, atol=2e-6)
+
+
+def test_streaming_groups_repeated_identifiers_like_batch(db, split_txt, tmp_path):
+    arrays = parse_txt_file(split_txt, workers=1)
+    db.batch.insert_many(build_trajectory_documents(arrays, 'cam', layout=LAYOUT_PACKED))
+
+    stats = _stream(split_txt, db.streaming, tmp_path)
+
+    _assert_same_documents(_stored(db.batch), _stored(db.streaming))
+    assert stats['read'] == arrays['counts'].size
+    assert stats['trajectories'] == stats['inserted'] == db.batch.count_documents({})
+    with open(tmp_path / 'out.json') as f:
+        assert sorted(doc['identifier'] for doc in json.load(f)) == sorted(_stored(db.batch))
+
+
+def test_streaming_csv_matches_write_csv(db, sample_txt, tmp_path):
+    write_csv(parse_txt_file(sample_txt, workers=1), str(tmp_path / 'batch.csv'))
+    store_trajectories_streaming(iter_txt_trajectories(sample_txt), db.traj, 'cam', str(tmp_path / 'out.json'),
+                                 str(tmp_path / 'streaming.csv'), batch_size=50)
+
+    batch = (tmp_path / 'batch.csv').read_text()
+    assert (tmp_path / 'streaming.csv').read_text() == batch
+    # Formato do txt_to_csv: identifier e category como float, x e y inteiros
+    header, first = batch.splitlines()[:2]
+    assert header == 'identifier,category,timestamp,x,y'
+    assert first.split(',')[:2] == ['1.0', '2.0']
+    assert first.split(',')[3:] == ['1122', '320']
+
+
+def test_streaming_upsert_groups_repeated_identifiers_like_batch(db, split_txt, tmp_path):
+    arrays = parse_txt_file(split_txt, workers=1)
+    upsert_trajectories(arrays, db.batch, 'cam', layout=LAYOUT_PACKED, merge_gap=0.0)
+
+    stats = _stream(split_txt, db.streaming, tmp_path, upsert=True)
+
+    _assert_same_documents(_stored(db.batch), _stored(db.streaming))
+    assert stats['inserted'] == db.batch.count_documents({})
+
+
+def _rollup_totals(collection):
+    # Valores não nulos de cada documento de agregado (um $inc seguido do desconto deixa zeros)
+    totals = {}
+    for doc in collection.find({}, {'_id': 0, 'cell_size': 0}):
+        key = (doc.pop('background'), doc.pop('resolution'), doc.pop('bucket'), doc.pop('category'))
+        for field, value in doc.items():
+            for name, number in (value.items() if isinstance(value, dict) else [(None, value)]):
+                if abs(number) > 1e-6:
+                    totals[key + (field, name)] = number
+    return totals
+
+
+def _assert_rollups_rebuilt(db, rollups):
+    incremental = _rollup_totals(db.rollups)
+    rollups.rebuild(db.traj)
+    rebuilt = _rollup_totals(db.rollups)
+    assert sorted(incremental) == sorted(rebuilt)
+    assert incremental == pytest.approx(rebuilt)
+
+
+def _split_uploads(arrays, every=7):
+    # Duas partes de um mesmo arquivo: a primeira leva a cabeça de uma em cada `every` trajetórias
+    # (e as demais inteiras), a segunda o resto dessas trajetórias, como dois envios consecutivos
+    first, second = [], []
+    for i, (identifier, category, t, x, y) in enumerate(iter_trajectory_arrays(arrays)):
+        if i % every == 0 and t.size >= 6:
+            half = t.size // 2
+            first.append((identifier, category, t[:half], x[:half], y[:half]))
+            second.append((identifier, category, t[half:], x[half:], y[half:]))
+        else:
+            first.append((identifier, category, t, x, y))
+    return arrays_from_trajectories(first), arrays_from_trajectories(second)
+
+
+def test_merge_points_orders_and_drops_repeated_points():
+    t, x, y = _merge_points([
+        (np.array([10.0, 11.0, 12.0]), np.array([1.0, 2.0, 3.0]), np.array([1.0, 2.0, 3.0])),
+        (np.array([12.0005, 13.0, 9.0]), np.array([30.0, 4.0, 0.0]), np.array([30.0, 4.0, 0.0]))
+    ])
+    # 12.0005 está a menos de 2 ms de 12.0: vale o ponto da primeira parte
+    np.testing.assert_array_equal(t, [9.0, 10.0, 11.0, 12.0, 13.0])
+    np.testing.assert_array_equal(x, [0.0, 1.0, 2.0, 3.0, 4.0])
+
+
+def test_upsert_merges_trajectory_split_across_uploads(db, sample_txt, rollups):
+    arrays = parse_txt_file(sample_txt, workers=1)
+    first, second = _split_uploads(arrays)
+    upsert_trajectories(arrays, db.whole, 'cam', layout=LAYOUT_PACKED)
+
+    upsert_trajectories(first, db.traj, 'cam', layout=LAYOUT_PACKED, merge_gap=5.0, rollups=rollups)
+    _, stats = upsert_trajectories(second, db.traj, 'cam', layout=LAYOUT_PACKED, merge_gap=5.0, rollups=rollups)
+
+    assert stats['updated'] == second['counts'].size
+    assert stats['inserted'] == 0
+    _assert_same_documents(_stored(db.whole), _stored(db.traj))
+    # As partes substituídas foram descontadas (sign=-1): os agregados batem com os refeitos do zero
+    _assert_rollups_rebuilt(db, rollups)
+
+
+@pytest.mark.parametrize('upsert', [True, False])
+def test_reupload_is_skipped(db, sample_txt, rollups, upsert):
+    ensure_indexes(db, 'traj', 'cams')
+    arrays = parse_txt_file(sample_txt, workers=1)
+    ingest = upsert_trajectories if upsert else insert_trajectories
+    _, first = ingest(arrays, db.traj, 'cam', layout=LAYOUT_PACKED, rollups=rollups)
+    totals = _rollup_totals(db.rollups)
+
+    documents, second = ingest(arrays, db.traj, 'cam', layout=LAYOUT_PACKED, rollups=rollups)
+
+    assert documents == []
+    assert (second['inserted'], second['updated'], second['skipped']) == (0, 0, first['inserted'])
+    assert db.traj.count_documents({}) == first['inserted']
+    assert _rollup_totals(db.rollups) == totals
+
+
+class RacingCollection:
+    # Coleção em que outra ingestão grava a primeira chave de cada lote entre a busca e o bulk_write:
+    # o índice único recusa essa operação (code) e as demais seguem
+
+    def __init__(self, collection, code=DUPLICATE_KEY):
+        self.collection = collection
+        self.code = code
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def bulk_write(self, operations, ordered=True):
+        result = self.collection.bulk_write(operations[1:], ordered=ordered)
+        raise BulkWriteError({'writeErrors': [{'index': 0, 'code': self.code, 'errmsg': 'E11000'}],
+                              'upserted': [{'index': index + 1, '_id': _id}
+                                           for index, _id in result.upserted_ids.items()],
+                              'writeConcernErrors': []})
+
+
+def test_concurrent_upsert_of_same_key_is_skipped(db, sample_txt):
+    arrays = parse_txt_file(sample_txt, workers=1)
+    documents, stats = upsert_trajectories(arrays, RacingCollection(db.traj), 'cam', layout=LAYOUT_PACKED,
+                                           batch_size=arrays['counts'].size)
+
+    assert stats['skipped'] == 1
+    assert stats['inserted'] == len(documents) == db.traj.count_documents({})
+
+    with pytest.raises(BulkWriteError):
+        upsert_trajectories(arrays, RacingCollection(db.other, code=2), 'cam', layout=LAYOUT_PACKED)
+
+
+def test_deduplicate_trajectories(db, sample_txt, rollups):
+    arrays = parse_txt_file(sample_txt, workers=1)
+    insert_trajectories(arrays, db.traj, 'cam', layout=LAYOUT_PACKED, rollups=rollups)
+    insert_trajectories(arrays, db.traj, 'cam', layout=LAYOUT_PACKED, rollups=rollups)
+    # Uma cópia com um ponto a mais que a original
+    identifier, category, t, x, y = next(iter_trajectory_arrays(group_by_identifier(arrays)))
+    longer = arrays_from_trajectories([(identifier, category, np.r_[t, t[-1] + 1], np.r_[x, x[-1]], np.r_[y, y[-1]])])
+    insert_trajectories(longer, db.traj, 'cam', layout=LAYOUT_PACKED, rollups=rollups)
+    total = db.traj.count_documents({}) // 2
+
+    assert deduplicate_trajectories(db.traj, dry_run=True) == {'keys': total, 'removed': total + 1}
+    assert deduplicate_trajectories(db.traj, rollups=rollups) == {'keys': total, 'removed': total + 1}
+
+    assert db.traj.count_documents({}) == total
+    assert document_points(db.traj.find_one({'identifier': identifier}))[0].size == t.size + 1
+    assert ensure_indexes(db, 'traj', 'cams')['traj'] == [index.document['name'] for index in TRAJECTORY_INDEXES]
+    _assert_rollups_rebuilt(db, rollups)
@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta, timezone
+import time
+
+import pytest
+from bson import ObjectId
+
+from app import jobs
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(jobs, '_get_executor', lambda: executor)
+    yield executor
+    executor.shutdown()
+
+
+def _job(db, **fields):
+    now = datetime.now(timezone.utc)
+    job = {"camera": "cam", "file": "in.txt", "json_file": "out.json", "csv_file": None,
+           "datetime_points": False, "upsert": True, "attempts": 1, "created_at": now, "queued_at": now}
+    job.update(fields)
+    return db.jobs.insert_one(job).inserted_id
+
+
+def test_crashed_worker_marks_job_failed(db, executor, monkeypatch):
+    def crash(*args):
+        raise BrokenProcessPool("processo encerrado")
+    monkeypatch.setattr(jobs, 'run_ingest_job', crash)
+
+    job_id = jobs.submit_ingest_job(db.jobs, 'cam', 'in.txt', 'out.json', None)
+    executor.shutdown(wait=True)
+
+    job = db.jobs.find_one({"_id": ObjectId(job_id)})
+    assert job["status"] == jobs.JOB_FAILED
+    assert "processo encerrado" in job["error"]
+
+
+def test_recover_stale_jobs(db, monkeypatch):
+    submitted = []
+    monkeypatch.setattr(jobs, '_submit', lambda collection, job_id, job: submitted.append(job_id))
+    old = datetime.now(timezone.utc) - timedelta(hours=1)
+    fresh = datetime.now(timezone.utc)
+
+    requeued = _job(db, status=jobs.JOB_RUNNING, heartbeat_at=old)
+    no_upsert = _job(db, status=jobs.JOB_RUNNING, heartbeat_at=old, upsert=False)
+    exhausted = _job(db, status=jobs.JOB_RUNNING, heartbeat_at=old, attempts=3)
+    alive = _job(db, status=jobs.JOB_RUNNING, heartbeat_at=fresh)
+    waiting = _job(db, status=jobs.JOB_QUEUED, queued_at=old)
+    just_queued = _job(db, status=jobs.JOB_QUEUED)
+
+    counts = jobs.recover_stale_jobs(db.jobs, stale_seconds=300, max_attempts=3)
+
+    assert counts == {"requeued": 2, "failed": 2}
+    assert sorted(submitted) == sorted([str(requeued), str(waiting)])
+    status = {doc["_id"]: doc["status"] for doc in db.jobs.find()}
+    assert status[no_upsert] == status[exhausted] == jobs.JOB_FAILED
+    assert status[alive] == jobs.JOB_RUNNING
+    assert status[requeued] == status[waiting] == status[just_queued] == jobs.JOB_QUEUED
+
+    # Já reivindicados: a próxima verificação não os reenvia de novo
+    assert jobs.recover_stale_jobs(db.jobs, stale_seconds=300) == {"requeued": 0, "failed": 0}
+
+
+def test_recovered_job_without_upsert_field_uses_default(db, executor, monkeypatch):
+    calls = []
+    monkeypatch.setattr(jobs, 'run_ingest_job', lambda *args: calls.append(args))
+    job_id = _job(db, status=jobs.JOB_QUEUED, queued_at=datetime.now(timezone.utc) - timedelta(hours=1))
+    db.jobs.update_one({"_id": job_id}, {"$unset": {"upsert": ""}})
+
+    assert jobs.recover_stale_jobs(db.jobs, stale_seconds=300) == {"requeued": 1, "failed": 0}
+    executor.shutdown(wait=True)
+
+    assert calls == [(str(job_id), 'cam', 'in.txt', 'out.json', None, False, jobs.INGEST_UPSERT)]
+
+
+def test_get_executor_creates_one_pool_across_threads(monkeypatch):
+    created = []
+
+    class SlowPool:
+        def __init__(self, **kwargs):
+            time.sleep(0.01)
+            created.append(self)
+
+    monkeypatch.setattr(jobs, 'ProcessPoolExecutor', SlowPool)
+    monkeypatch.setattr(jobs, '_executor', None)
+    with ThreadPoolExecutor(max_workers=8) as threads:
+        pools = list(threads.map(lambda _: jobs._get_executor(), range(16)))
+
+    assert len(created) == 1
+    assert all(pool is created[0] for pool in pools)
+    jobs._discard_executor(created[0])
+    assert jobs._executor is None
@@ -0,0 +1,45 @@
+import time
+
+from app.metrics import MetricsRegistry, begin_request, end_request, stage
+
+
+def _sample(text, prefix):
+    return [line.rsplit(' ', 1)[1] for line in text.splitlines() if line.startswith(prefix)]
+
+
+def test_render_keeps_every_digit():
+    registry = MetricsRegistry(buckets=(0.5, 1.0))
+    registry.describe('bytes_total', 'counter', 'Bytes')
+    registry.describe('duration_seconds', 'histogram', 'Tempo')
+    registry.inc('bytes_total', (('stage', 'image'),), 1234567)
+    registry.inc('bytes_total', (('stage', 'image'),), 1)
+    registry.observe('duration_seconds', (), 0.1234567891)
+    registry.observe('duration_seconds', (), 1234567.25)
+
+    text = registry.render()
+
+    assert _sample(text, 'bytes_total{stage="image"}') == ['1234568']
+    assert _sample(text, 'duration_seconds_sum') == [repr(0.1234567891 + 1234567.25)]
+    assert _sample(text, 'duration_seconds_count') == ['2']
+    assert _sample(text, 'duration_seconds_bucket{le="0.5"}') == ['1']
+    assert _sample(text, 'duration_seconds_bucket{le="+Inf"}') == ['2']
+
+
+def test_nested_stages_are_exclusive():
+    timings = begin_request()
+    with stage('decode'):
+        with stage('mongo'):
+            time.sleep(0.02)
+        time.sleep(0.01)
+    end_request()
+
+    assert timings.stages['mongo'] >= 0.02
+    assert 0.01 <= timings.stages['decode'] < timings.stages['mongo']
+    assert sum(timings.stages.values()) <= timings.elapsed()
+
+
+def test_stage_outside_request_records_nothing():
+    end_request()
+    with stage('mongo'):
+        pass
+    assert end_request() is None
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from app.parsing import (arrays_from_trajectories, group_by_identifier, iter_txt_trajectories, parse_txt_file,
+                         parse_txt_line)
+
+
+def _assert_same_arrays(expected, actual):
+    assert sorted(expected) == sorted(actual)
+    for key, values in expected.items():
+        np.testing.assert_array_equal(actual[key], values, err_msg=key)
+
+
+def test_parse_txt_line_spreads_timestamps_from_start():
+    identifier, category, t, x, y = parse_txt_line("7, 2, 100.0, 103.0, [(10, 20), (11, 21), (12, 22)]\n")
+    assert (identifier, category) == (7.0, 2.0)
+    np.testing.assert_allclose(t, [100.0, 101.0, 102.0])
+    np.testing.assert_array_equal(x, [10, 11, 12])
+    np.testing.assert_array_equal(y, [20, 21, 22])
+
+
+def test_parse_txt_line_datetime_input_is_utc():
+    _, _, t, _, _ = parse_txt_line("1, 0, 2023-06-21 11:37:40.5, 2023-06-21 11:37:42.5, [(1, 1), (2, 2)]",
+                                   datetime_input=True)
+    np.testing.assert_allclose(t, [1687347460.5, 1687347461.5])
+
+
+def test_parse_txt_file_matches_line_by_line_parser(sample_txt):
+    expected = arrays_from_trajectories(iter_txt_trajectories(sample_txt))
+    _assert_same_arrays(expected, parse_txt_file(sample_txt, workers=1))
+    # Em blocos no pool: mesma ordem do arquivo
+    _assert_same_arrays(expected, parse_txt_file(sample_txt, workers=2, min_parallel_bytes=0))
+
+
+def test_malformed_line_reports_line_number(tmp_path):
+    path = tmp_path / 'bad.txt'
+    path.write_text("1, 0, 10.0, 11.0, [(1, 1), (2, 2)]\n\n2, 0, 10.0, 11.0, [(1, 1), (2\n")
+    with pytest.raises(ValueError, match='Linha 3'):
+        list(iter_txt_trajectories(str(path)))
+
+
+def test_group_by_identifier_joins_repeated_lines():
+    arrays = arrays_from_trajectories([
+        (5.0, 1.0, np.array([20.0, 21.0]), np.array([3.0, 4.0]), np.array([3.0, 4.0])),
+        (2.0, 0.0, np.array([1.0, 2.0]), np.array([0.0, 0.0]), np.array([0.0, 0.0])),
+        (5.0, 2.0, np.array([10.0, 11.0]), np.array([1.0, 2.0]), np.array([1.0, 2.0]))
+    ])
+    grouped = group_by_identifier(arrays)
+    np.testing.assert_array_equal(grouped['identifier'], [2.0, 5.0])
+    # Categoria do ponto mais antigo
+    np.testing.assert_array_equal(grouped['category'], [0.0, 2.0])
+    np.testing.assert_array_equal(grouped['counts'], [2, 4])
+    np.testing.assert_array_equal(grouped['t'], [1.0, 2.0, 10.0, 11.0, 20.0, 21.0])
+    np.testing.assert_array_equal(grouped['x'], [0.0, 0.0, 1.0, 2.0, 3.0, 4.0])
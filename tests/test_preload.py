@@ -0,0 +1,52 @@
+import json
+import os
+import subprocess
+import sys
+
+from app.preload import preload_modules
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Importa run num interpretador novo (os testes deste processo já carregaram outras bibliotecas)
+IMPORT_RUN = '''
+import json, sys, threading
+import run
+from app.preload import HEAVY_MODULES
+print(json.dumps({"loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+                  "threads": [thread.name for thread in threading.enumerate()]}))
+'''
+
+
+# post_fork do gunicorn.conf.py num processo novo, como o gunicorn faz em cada processo
+POST_FORK = '''
+import importlib.util, json, threading
+spec = importlib.util.spec_from_file_location('gunicorn_conf', 'gunicorn.conf.py')
+conf = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(conf)
+conf.post_fork(None, None)
+conf.post_fork(None, None)
+print(json.dumps({"threads": sorted(thread.name for thread in threading.enumerate())}))
+'''
+
+
+def _run(code, **env):
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True,
+                            env=dict(os.environ, **env), check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def test_import_run_loads_no_heavy_library_and_starts_nothing():
+    for preload in ('0', '1'):
+        result = _run(IMPORT_RUN, GUNICORN_PRELOAD=preload, ENSURE_INDEXES_ON_STARTUP='1')
+        assert result['loaded'] == ['numpy']
+        assert result['threads'] == ['MainThread']
+
+
+def test_post_fork_starts_background_tasks_once():
+    result = _run(POST_FORK, ENSURE_INDEXES_ON_STARTUP='0', RENDER_WORKERS='0')
+    assert result['threads'] == ['MainThread', 'job-recovery']
+
+
+def test_preload_modules_skips_missing_modules():
+    timings = preload_modules(('json', 'modulo_que_nao_existe'))
+    assert list(timings) == ['json']
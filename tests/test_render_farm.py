@@ -0,0 +1,80 @@
+import time
+
+import numpy as np
+import pytest
+
+from app.render_farm import RenderFarm, RenderTimeout
+
+def _arrays():
+    rng = np.random.default_rng(1)
+    identifier = np.repeat(np.arange(20), 15)
+    return {'identifier': identifier, 'category': identifier % 3,
+            'timestamp': 1687340000.0 + np.tile(np.arange(15.0), 20),
+            'x': rng.uniform(0, 100, identifier.size), 'y': rng.uniform(0, 100, identifier.size)}
+
+
+def test_library_plot_in_farm_matches_in_process(fake_library):
+    import run
+
+    arrays = _arrays()
+    kw_args = {'render_mode': 'all', 'xsize': 4.0, 'ysize': 3.0, 'xlim1': 0, 'xlim2': 100, 'ylim1': 0,
+               'ylim2': 100, 'min_x': 0, 'max_x': 100, 'min_y': 0, 'max_y': 100}
+    expected_image, expected = run._plot_in_process('plot_trajectories_with_background', arrays, ('bg.jpg',),
+                                                    kw_args, 'png')
+
+    farm = RenderFarm(workers=1, timeout=120)
+    try:
+        image, result = farm.render_library('plot_trajectories_with_background', arrays, ('bg.jpg',), kw_args,
+                                            'png', run.RENDER_PIXEL_RATIO, run.RENDER_MIN_DPI, run.RENDER_MAX_DPI)
+        _, metrics = farm.render_library('plot_trajectories_with_background', arrays, ('bg.jpg',), kw_args, None)
+    finally:
+        farm.shutdown()
+
+    # Inteiros continuam inteiros depois do bloco float64 compartilhado
+    assert result == metrics == expected
+    assert '0' in result['trajectories_per_category']
+    assert image[:8] == b'\x89PNG\r\n\x1a\n'
+    assert len(image) == pytest.approx(len(expected_image), rel=0.05)
+    assert farm.stats()['rendered'] == 2
+
+
+def _sleep_job(shm_name, n_points, dtypes, seconds):
+    time.sleep(seconds)
+    return n_points
+
+
+def test_timeout_recycles_worker_and_frees_slot():
+    arrays = _arrays()
+    farm = RenderFarm(workers=1, max_pending=1, timeout=3, queue_timeout=0.1)
+    try:
+        farm.start()
+        assert farm._run(_sleep_job, arrays, 0) == arrays['timestamp'].size
+
+        started = time.monotonic()
+        with pytest.raises(RenderTimeout):
+            farm._run(_sleep_job, arrays, 60)
+        assert time.monotonic() - started < 10
+
+        # Vaga e processo livres de novo: o próximo job roda num processo novo
+        assert farm._run(_sleep_job, arrays, 0) == arrays['timestamp'].size
+        stats = farm.stats()
+    finally:
+        farm.shutdown()
+
+    assert stats['timeouts'] == 1
+    assert stats['recycled'] == 1
+    assert stats['pending'] == 0
+    assert stats['alive'] == 1
+    assert stats['rendered'] == 2
+
+
+def test_job_error_keeps_worker():
+    farm = RenderFarm(workers=1, timeout=60)
+    try:
+        with pytest.raises(TypeError):
+            farm._run(_sleep_job, _arrays(), 'x')
+        assert farm._run(_sleep_job, _arrays(), 0) == 300
+        stats = farm.stats()
+    finally:
+        farm.shutdown()
+    assert (stats['failed'], stats['recycled'], stats['rendered']) == (1, 0, 1)
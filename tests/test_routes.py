@@ -0,0 +1,158 @@
+import base64
+import io
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+from shapely import wkt
+
+import run
+from app import utils
+from app.analytics import monitored_area_metrics, reference_line_metrics, stop_metrics, summary_metrics
+from app.ingest import build_trajectory_documents
+from app.parsing import parse_txt_file
+from conftest import TXT_DIR
+
+# Janela das rotas de plot para trail_points_data_2.txt (2023-06-21, 11.6h a 11.7h)
+WINDOW_PARAMS = {'camera': 'cam', 'selected_date': '2023-06-21', 'start_time': 11.6, 'end_time': 11.7}
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(run.camera_registry, 'get', lambda name: {'name': name})
+    return run.app.test_client()
+
+
+@pytest.fixture
+def plot_client(db, monkeypatch):
+    # Rotas de plot sobre o mongomock, sem caches nem pool de renderização
+    arrays = parse_txt_file(os.path.join(TXT_DIR, 'trail_points_data_2.txt'), datetime_input=True, workers=1)
+    db.traj.insert_many(build_trajectory_documents(arrays, 'cam', datetime_points=True))
+    monkeypatch.setattr(utils, 'collection_traj', db.traj)
+    monkeypatch.setattr(run.camera_registry, 'get',
+                        lambda name: {'name': name, 'image_path': 'bg.jpg', 'image_mtime': 1.0})
+    for name in ('response_cache', 'trajectory_cache', 'render_farm'):
+        monkeypatch.setattr(run, name, None)
+    monkeypatch.setattr(run, 'PLOT_RENDERER', 'library')
+    return run.app.test_client()
+
+
+def _window_arrays(query=None):
+    start, end = run._parse_time_window(WINDOW_PARAMS['selected_date'], WINDOW_PARAMS['start_time'],
+                                        WINDOW_PARAMS['end_time'])
+    query = dict(query or {}, background='cam', start_time={'$lte': end}, end_time={'$gte': start})
+    return utils.fetch_trajectory_arrays(query, (start, end))
+
+
+@pytest.mark.parametrize('path', ['/trajectories/export', '/rollups'])
+def test_invalid_category_is_rejected(client, path):
+    response = client.get(path, query_string={'camera': 'cam', 'start': '2023-06-21', 'end': '2023-06-22',
+                                              'category': 'carro'})
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+
+def test_interface_metrics_never_touch_pyplot(plot_client, monkeypatch):
+    # O botão de métricas da interface (metrics_only=analytics) não importa pyplot nem a smart_traject
+    for name in ('matplotlib.pyplot', 'smart_traject', 'smart_traject.smart_trajectories.plot'):
+        monkeypatch.setitem(sys.modules, name, None)
+    monkeypatch.setattr(run, '_pyplot', lambda: pytest.fail('pyplot chamado'))
+    monkeypatch.setattr(run, '_library_plot', lambda name: pytest.fail('biblioteca chamada'))
+
+    response = plot_client.get('/plot_with_background', query_string=dict(WINDOW_PARAMS, metrics_only='analytics'))
+    stopped = plot_client.get('/plot_with_stopped', query_string=dict(
+        WINDOW_PARAMS, metrics_only='analytics', category=0, stop_threshold=3, min_duration=2, noise_tolerance=2))
+
+    assert response.status_code == stopped.status_code == 200
+    assert response.get_json()['metrics'] == {'summary': summary_metrics(_window_arrays()), 'source': 'analytics'}
+    assert stopped.get_json()['metrics']['summary'] == stop_metrics(_window_arrays({'category': 0}), 0, 3, 2, 2)
+
+
+def test_interface_image_reports_analytics_summary(plot_client, fake_library):
+    metrics = plot_client.get('/plot_with_background', query_string=dict(WINDOW_PARAMS, metrics_only='analytics'))
+    image = plot_client.get('/plot_with_background', query_string=dict(WINDOW_PARAMS, format='png',
+                                                                       summary='analytics'))
+    library = plot_client.get('/plot_with_background', query_string=dict(WINDOW_PARAMS, format='png'))
+
+    assert image.status_code == library.status_code == 200
+    assert image.data[:8] == b'\x89PNG\r\n\x1a\n'
+    # Mesmas chaves nos dois botões da interface; sem summary, o resumo continua o da biblioteca
+    assert json.loads(image.headers['X-Plot-Metrics'])['summary'] == metrics.get_json()['metrics']['summary']
+    assert json.loads(library.headers['X-Plot-Metrics'])['summary']['image_path'] == 'bg.jpg'
+
+
+def _dense_arrays():
+    # Passos bem menores que um pixel: a maior parte dos pontos não muda o desenho
+    rng = np.random.default_rng(3)
+    identifier = np.repeat(np.arange(12), 2000)
+    steps = rng.normal(0, 0.04, (2, identifier.size)).reshape(2, 12, 2000).cumsum(axis=2).reshape(2, -1)
+    start = np.repeat(rng.uniform(20, 80, (2, 12)), 2000, axis=1)
+    return {'identifier': identifier, 'category': identifier % 3,
+            'timestamp': 1687347400.0 + np.tile(np.arange(2000.0), 12) / 10,
+            'x': start[0] + steps[0], 'y': start[1] + steps[1]}
+
+
+def test_library_image_with_level_of_detail_matches_full_render(plot_client, fake_library, monkeypatch):
+    from matplotlib.image import imread
+
+    arrays = _dense_arrays()
+    drawn = []
+    plot_in_process = run._plot_in_process
+    monkeypatch.setattr(run, '_load_plot_arrays', lambda common_params, message: arrays)
+    monkeypatch.setattr(run, '_plot_in_process', lambda plot_name, arrays, *args: (
+        drawn.append(arrays['x'].size), plot_in_process(plot_name, arrays, *args))[1])
+    params = dict(WINDOW_PARAMS, format='png', summary='analytics', xsize=4, ysize=4)
+
+    monkeypatch.setattr(run, 'RENDER_LOD', False)
+    full = plot_client.get('/plot_with_background', query_string=params)
+    monkeypatch.setattr(run, 'RENDER_LOD', True)
+    decimated = plot_client.get('/plot_with_background', query_string=params)
+
+    assert drawn[0] == arrays['x'].size and drawn[1] < arrays['x'].size / 4
+    assert decimated.headers['X-Plot-Metrics'] == full.headers['X-Plot-Metrics']
+    full_image, decimated_image = (imread(io.BytesIO(response.data)) for response in (full, decimated))
+    assert full_image.shape == decimated_image.shape
+    # Deslocar as trajetórias 1 unidade (cerca de 3 px) dá diferença média de 0.004
+    assert np.abs(full_image - decimated_image).mean() < 0.002
+
+
+@pytest.mark.parametrize('path,params,metrics', [
+    ('/plot_monitored_area', {'rect_min_x': 900, 'rect_max_x': 1000, 'rect_min_y': 0, 'rect_max_y': 1080},
+     lambda arrays: monitored_area_metrics(arrays, 0, 900, 1000, 0, 1080)),
+    ('/plot_with_limits', {'reference_line': 'LINESTRING (950 0, 950 1080)'},
+     lambda arrays: reference_line_metrics(arrays, 0, wkt.loads('LINESTRING (950 0, 950 1080)'))),
+])
+def test_region_metrics_with_bbox_match_full_window(plot_client, path, params, metrics):
+    response = plot_client.get(path, query_string=dict(WINDOW_PARAMS, metrics_only='analytics', category=0,
+                                                       **params))
+
+    # Só parte das trajetórias cruza a área, mas o total continua o da janela inteira
+    summary = response.get_json()['metrics']['summary']
+    assert response.status_code == 200
+    assert summary == metrics(_window_arrays({'category': 0}))
+    assert 0 < min(value for key, value in summary.items() if key.endswith('area') or key.startswith('crossed'))
+    assert summary['total_trajectories'] == 26
+
+
+def test_binary_image_with_etag_and_json_fallback(plot_client, fake_library, monkeypatch):
+    params = dict(WINDOW_PARAMS, format='png')
+    image = plot_client.get('/plot_with_background', query_string=params)
+    revalidated = plot_client.get('/plot_with_background', query_string=params,
+                                  headers={'If-None-Match': image.headers['ETag']})
+    encoded = plot_client.get('/plot_with_background', query_string=WINDOW_PARAMS)
+    # Métricas maiores que o limite do cabeçalho: imagem em base64 e métricas no corpo
+    monkeypatch.setattr(run, 'PLOT_METRICS_HEADER_MAX_BYTES', 10)
+    fallback = plot_client.get('/plot_with_background', query_string=params)
+    unsupported = plot_client.get('/plot_with_background', query_string=dict(WINDOW_PARAMS, format='gif'))
+
+    assert image.status_code == 200 and image.mimetype == 'image/png'
+    assert image.data[:8] == b'\x89PNG\r\n\x1a\n'
+    summary = json.loads(image.headers['X-Plot-Metrics'])['summary']
+    assert revalidated.status_code == 304 and not revalidated.data
+    assert encoded.get_json()['image'] == base64.b64encode(image.data).decode()
+    assert encoded.get_json()['metrics']['summary'] == summary
+    assert 'X-Plot-Metrics' not in fallback.headers and 'ETag' in fallback.headers
+    assert fallback.get_json()['mimetype'] == 'image/png' and fallback.get_json()['metrics']['summary'] == summary
+    assert unsupported.status_code == 400
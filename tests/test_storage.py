@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from app.ingest import build_trajectory_documents
+from app.parsing import parse_txt_file
+from app.storage import (LAYOUT_PACKED, LAYOUT_POINTS, decode_packed_points, document_datetime_points,
+                         migrate_points_layout)
+
+
+def _documents(collection):
+    return {doc['identifier']: doc for doc in collection.find({}, {'_id': 0})}
+
+
+@pytest.mark.parametrize('datetime_points', [False, True])
+def test_points_layout_round_trip_keeps_timestamp_type(db, sample_txt, datetime_points):
+    arrays = parse_txt_file(sample_txt, workers=1)
+    db.traj.insert_many(build_trajectory_documents(arrays, 'cam', datetime_points, LAYOUT_POINTS))
+    original = _documents(db.traj)
+
+    migrate_points_layout(db.traj, LAYOUT_PACKED, batch_size=7)
+    packed = _documents(db.traj)
+    assert all('points' not in doc and doc['points_packed']['datetime'] is datetime_points
+               for doc in packed.values())
+
+    migrate_points_layout(db.traj, LAYOUT_POINTS, batch_size=7)
+
+    assert _documents(db.traj) == original
+    assert all(document_datetime_points(doc) is datetime_points for doc in original.values())
+
+
+@pytest.mark.parametrize('datetime_points,precision', [(False, 1e-6), (True, 1e-3)])
+def test_packed_layout_round_trip_keeps_points(db, sample_txt, datetime_points, precision):
+    # ISO guarda microssegundos e datas BSON milissegundos: é o que sobra dos instantes na volta
+    arrays = parse_txt_file(sample_txt, workers=1)
+    db.traj.insert_many(build_trajectory_documents(arrays, 'cam', datetime_points, LAYOUT_PACKED))
+    original = _documents(db.traj)
+
+    migrate_points_layout(db.traj, LAYOUT_POINTS)
+    points = _documents(db.traj)
+    assert all(isinstance(doc['points'][0]['timestamp'], datetime) is datetime_points for doc in points.values())
+    migrate_points_layout(db.traj, LAYOUT_PACKED)
+
+    for identifier, doc in _documents(db.traj).items():
+        before = original[identifier].pop('points_packed')
+        after = doc.pop('points_packed')
+        assert doc == original[identifier]
+        assert after['datetime'] is datetime_points and after['xy_dtype'] == before['xy_dtype']
+        before, after = decode_packed_points(before), decode_packed_points(after)
+        np.testing.assert_allclose(after[0], before[0], rtol=0, atol=precision)
+        np.testing.assert_array_equal(after[1:], before[1:])
@@ -0,0 +1,132 @@
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from app import storage, utils
+from app.analytics import group_points
+from app.ingest import build_trajectory_documents
+from app.parsing import parse_txt_file
+from app.storage import LAYOUTS
+from conftest import TXT_DIR
+
+# start_time=11.6 e end_time=11.7 em 2023-06-21, como _parse_time_window monta a janela das rotas
+# (minutos truncados: 11:36 a 11:41)
+WINDOW = (datetime(2023, 6, 21, 11, 36, tzinfo=timezone.utc), datetime(2023, 6, 21, 11, 41, tzinfo=timezone.utc))
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_count_trajectories_matches_loaded_trajectories(db, monkeypatch, layout):
+    monkeypatch.setattr(utils, 'collection_traj', db.traj)
+    arrays = parse_txt_file(os.path.join(TXT_DIR, 'trail_points_data_2.txt'), datetime_input=True, workers=1)
+    db.traj.insert_many(build_trajectory_documents(arrays, 'cam', datetime_points=True, layout=layout))
+    query = {"background": "cam", "category": 0,
+             "start_time": {"$lte": WINDOW[1]}, "end_time": {"$gte": WINDOW[0]}}
+
+    _, _, counts = group_points(utils.fetch_trajectory_arrays(query, WINDOW))
+
+    # Trajetórias que só encostam na janela com um ponto não entram no total
+    assert len(db.traj.distinct('identifier', query)) == 27
+    assert utils.count_trajectories(query, WINDOW) == counts.size == 26
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_fetch_with_bbox_keeps_only_crossing_trajectories(db, monkeypatch, layout):
+    monkeypatch.setattr(utils, 'collection_traj', db.traj)
+    arrays = parse_txt_file(os.path.join(TXT_DIR, 'trail_points_data_2.txt'), datetime_input=True, workers=1)
+    db.traj.insert_many(build_trajectory_documents(arrays, 'cam', datetime_points=True, layout=layout))
+    query = {"background": "cam", "start_time": {"$lte": WINDOW[1]}, "end_time": {"$gte": WINDOW[0]}}
+    bbox = (900, 1000, 300, 400)
+
+    full = utils.fetch_trajectory_arrays(query, WINDOW)
+    filtered = utils.fetch_trajectory_arrays(query, WINDOW, bbox=bbox)
+
+    # Trajetórias inteiras (também os pontos fora da janela contam no bbox do resumo)
+    crossing = {doc['identifier'] for doc in db.traj.find(query)
+                if doc['summary']['bbox']['min_x'] <= bbox[1] and doc['summary']['bbox']['max_x'] >= bbox[0]
+                and doc['summary']['bbox']['min_y'] <= bbox[3] and doc['summary']['bbox']['max_y'] >= bbox[2]}
+    keep = np.isin(full['identifier'], list(crossing))
+    assert 0 < keep.sum() < keep.size
+    for column, values in full.items():
+        np.testing.assert_array_equal(filtered[column], values[keep])
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_count_trajectories_uses_stored_point_counts(db, monkeypatch, layout):
+    monkeypatch.setattr(utils, 'collection_traj', db.traj)
+    arrays = parse_txt_file(os.path.join(TXT_DIR, 'trail_points_data_2.txt'), datetime_input=True, workers=1)
+    db.traj.insert_many(build_trajectory_documents(arrays, 'cam', datetime_points=True, layout=layout))
+    query = {"background": "cam", "start_time": {"$lte": WINDOW[1]}, "end_time": {"$gte": WINDOW[0]}}
+    inside = {"start_time": {"$gte": WINDOW[0].replace(tzinfo=None)}, "end_time": {"$lte": WINDOW[1].replace(tzinfo=None)}}
+    assert 0 < db.traj.count_documents(dict(query, **inside)) < db.traj.count_documents(query)
+    # Resumo adulterado: só os documentos inteiros dentro da janela leem n_points dele
+    db.traj.update_many(inside, {"$set": {"summary.n_points": 1}})
+    db.traj.update_many({"summary.n_points": {"$ne": 1}}, {"$set": {"summary.n_points": 10 ** 6}})
+
+    with_summary = utils.count_trajectories(query, WINDOW)
+    db.traj.update_many({}, {"$unset": {"summary": ""}})
+
+    assert with_summary == utils.count_trajectories(query, WINDOW) - db.traj.count_documents(dict(query, **inside))
+    assert utils.count_trajectories({"background": "cam"}) == len(db.traj.distinct('identifier'))
+
+
+def _per_point_arrays(collection, query):
+    # Leitura ponto a ponto, como o carregador antigo: pd.Timestamp e split do WKT em cada ponto
+    import pandas as pd
+    rows = []
+    for doc in collection.find(query):
+        for point in doc['points']:
+            x, y = point['geometry'].replace('POINT (', '').rstrip(')').split()
+            rows.append((doc['identifier'], doc['category'],
+                         pd.Timestamp(point['timestamp']).tz_localize(None).timestamp(), float(x), float(y)))
+    return {column: np.array([row[i] for row in rows])
+            for i, column in enumerate(('identifier', 'category', 'timestamp', 'x', 'y'))}
+
+
+@pytest.mark.parametrize('datetime_points', [False, True])
+def test_columnar_loader_matches_per_point_loop(db, monkeypatch, datetime_points):
+    monkeypatch.setattr(utils, 'collection_traj', db.traj)
+    arrays = parse_txt_file(os.path.join(TXT_DIR, 'trail_points_data_1.txt'), workers=1)
+    db.traj.insert_many(build_trajectory_documents(arrays, 'cam', datetime_points=datetime_points))
+    db.packed.insert_many(build_trajectory_documents(arrays, 'cam', datetime_points=datetime_points,
+                                                     layout=LAYOUTS[1]))
+
+    expected = _per_point_arrays(db.traj, {})
+    loaded = utils.fetch_trajectory_arrays()
+    monkeypatch.setattr(utils, 'collection_traj', db.packed)
+    packed = utils.fetch_trajectory_arrays()
+
+    for column, values in expected.items():
+        np.testing.assert_allclose(loaded[column], values, rtol=0, atol=1e-3 if datetime_points else 1e-6)
+        np.testing.assert_allclose(packed[column], values, rtol=0, atol=1e-3 if datetime_points else 1e-6)
+    collection = utils.trajectory_collection_from_arrays(loaded)
+    assert len(collection) == np.unique(loaded['identifier']).size
+
+
+def test_wkt_parsing_falls_back_to_shapely():
+    x, y = storage.points_wkt_to_xy(['POINT (1 2)', 'POINT(3.5 -4e2)', 'POINT Z (5 6 7)'])
+    assert x.tolist() == [1.0, 3.5, 5.0]
+    assert y.tolist() == [2.0, -400.0, 6.0]
+
+
+@pytest.mark.parametrize('layout', LAYOUTS)
+def test_window_is_trimmed_and_geometry_left_out(db, monkeypatch, layout):
+    monkeypatch.setattr(utils, 'collection_traj', db.traj)
+    # Metade dos documentos com datas BSON e metade com ISO: o $filter atende os dois tipos
+    arrays = parse_txt_file(os.path.join(TXT_DIR, 'trail_points_data_2.txt'), datetime_input=True, workers=1)
+    documents = build_trajectory_documents(arrays, 'cam', datetime_points=True, layout=layout)
+    iso = build_trajectory_documents(arrays, 'cam', datetime_points=False, layout=layout)
+    db.traj.insert_many(documents[::2] + iso[1::2])
+    query = {"background": "cam", "start_time": {"$lte": WINDOW[1]}, "end_time": {"$gte": WINDOW[0]}}
+
+    stages = utils._trajectory_pipeline(query, WINDOW)
+    full = utils.fetch_trajectory_arrays(query)
+    trimmed = utils.fetch_trajectory_arrays(query, WINDOW)
+
+    assert stages[0] == {"$match": query} and 'geometry' not in stages[1]["$project"]
+    inside = ((full['timestamp'] >= WINDOW[0].timestamp() - 1e-6)
+              & (full['timestamp'] <= WINDOW[1].timestamp() + 1e-6))
+    assert 0 < inside.sum() < inside.size
+    for column, values in full.items():
+        np.testing.assert_array_equal(trimmed[column], values[inside])